@@ -0,0 +1,287 @@
+"""Offline benchmark of the whole graph with a deterministic fake LLM.
+
+Runs `graph.build_graph()` end to end: sample index, ReAct agents per sample,
+format understanding and the output writer. It uses a synthetic template and
+synthetic evidence folders (PDF/PNG/txt). Every model call goes to `FakeOpenAI`
+through `llm_registry.use_transport`, with a fixed `--latency`, so no network
+or API key is needed. Captures use the PIL rasterizer.
+
+Reported per run:
+  * wall time, and time per node (main graph, understand_format and agent
+    sub-graph nodes; fan-out workers are summed);
+  * model calls by kind, and the simulated model latency summed over calls
+    (concurrent calls overlap, so this can exceed the wall time in fan-out mode);
+  * peak RSS, plus the peak traced Python memory per main-graph node when
+    run with `--memory` (tracemalloc slows everything down, so it is off by
+    default).
+
+`--scale samples=1,4,16` (or fields=..., sheets=...) repeats the run for each
+value and prints a scaling table. An untimed warm-up run on a tiny input goes
+first so one-off imports and font loading are not charged to the first point.
+
+Usage:
+    python benchmarks/bench_pipeline.py [--samples 4] [--sheets 2] [--fields 20] [--latency 0.0]
+        [--parallel] [--evidence-mode eager|lazy] [--tool-calls 1] [--scale samples=1,4,16]
+        [--memory] [--no-warmup] [--json OUT]
+"""
+
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR.parent / "src"))
+sys.path.insert(0, str(BENCH_DIR))
+
+# Main-graph nodes grouped into the stages whose non-LLM overhead we track
+STAGES = {
+    "index": ["index_samples_node"],
+    "samples": ["react_node", "sample_worker_node"],
+    "format": ["run_excel_format_workflow_node"],
+    "writer": ["update_format_node"],
+}
+
+
+def prepare_environment(root: str) -> None:
+    """Point config at a scratch project root before any src module is imported."""
+    os.environ["PROJECT_ROOT"] = root
+    os.environ.setdefault("RENDER_BACKEND", "pil")
+    os.environ.setdefault("OPENAI_API_KEY", "sk-offline-benchmark")
+    os.environ["LANGCHAIN_TRACING_V2"] = "false"
+    os.environ["LANGSMITH_TRACING"] = "false"
+
+
+class NodeTimer:
+    """Callback handler recording wall time (and optional traced-memory peak) per graph node."""
+
+    def __init__(self, memory: bool):
+        from langchain_core.callbacks import BaseCallbackHandler
+
+        timer = self
+
+        class Handler(BaseCallbackHandler):
+            def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, metadata=None, name=None, **kwargs):
+                timer.start(run_id, parent_run_id, name or (serialized or {}).get("name"), metadata or {})
+
+            def on_chain_end(self, outputs, *, run_id, **kwargs):
+                timer.end(run_id)
+
+            def on_chain_error(self, error, *, run_id, **kwargs):
+                timer.end(run_id)
+
+        self.handler = Handler()
+        self.memory = memory
+        self.timings = defaultdict(list)
+        self.peaks = defaultdict(int)
+        self._running = {}
+        self._lock = threading.Lock()
+
+    def start(self, run_id, parent_run_id, name, metadata) -> None:
+        # Only the node runnables themselves, not the sequences / writers inside them
+        # (some prebuilt nodes wrap a runnable carrying the same name)
+        if not name or metadata.get("langgraph_node") != name:
+            return
+        with self._lock:
+            parent = self._running.get(parent_run_id)
+        if parent is not None and parent[0] == name:
+            return
+        top_level = "|" not in (metadata.get("langgraph_checkpoint_ns") or metadata.get("checkpoint_ns") or "")
+        with self._lock:
+            self._running[run_id] = (name, time.perf_counter(), top_level)
+        if self.memory and top_level:
+            tracemalloc.reset_peak()
+
+    def end(self, run_id) -> None:
+        with self._lock:
+            entry = self._running.pop(run_id, None)
+        if entry is None:
+            return
+        name, started, top_level = entry
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.timings[name].append(elapsed)
+            if self.memory and top_level:
+                self.peaks[name] = max(self.peaks[name], tracemalloc.get_traced_memory()[1])
+
+
+def structured_handlers(fake, sheet_fields, samples):
+    """Canned answers that match the synthetic template, so highlighting and writing do real work."""
+    fields = [f"{sheet}!{cell}" for sheet, cells in sheet_fields.items() for cell in cells]
+
+    def estimator(body):
+        return {
+            "fields": [{"cell_id": cell_id, "description": f"入力欄 {cell_id}"} for cell_id in fields],
+            "reason": "ベンチマーク用の固定回答",
+        }
+
+    def writer(body):
+        kinds = ["2025-04-01", "12,345", "12.5%", "OK", ""]
+        items = [{"cell_id": cell_id, "value": kinds[idx % len(kinds)], "values": []} for idx, cell_id in enumerate(fields)]
+        # One result per sample written down a table column on the first sheet
+        first_sheet = next(iter(sheet_fields))
+        items.append({"cell_id": f"{first_sheet}!H3", "value": "", "values": [f"サンプル{n}: OK" for n in range(1, samples + 1)]})
+        return {"items": items}
+
+    fake.on("ExcelFormFields", estimator)
+    fake.on("CellValueList", writer)
+    fake.on("Result", lambda body: {"reason": "証跡の日付は2025年", "support_data": "請求書 2025-04-01", "result": "OK"})
+
+
+def run_point(root: str, args, samples: int, sheets: int, fields: int) -> dict:
+    """Generate inputs for one configuration, run the graph once and collect the measurements."""
+    from fake_llm import FakeOpenAI
+    from langgraph.checkpoint.memory import MemorySaver
+    from synthetic import build_evidence, build_form_template
+
+    from config import SAMPLE_DATA_DIR
+    from graph import build_graph
+
+    point = f"s{samples}_sh{sheets}_f{fields}"
+    template = os.path.join(root, "templates", f"{point}.xlsx")
+    os.makedirs(os.path.dirname(template), exist_ok=True)
+    sheet_fields = build_form_template(template, sheets, fields, merged=args.merged)
+    evidence_dir = os.path.join(SAMPLE_DATA_DIR, point)
+    build_evidence(evidence_dir, samples, pdfs=args.pdfs, pdf_pages=args.pdf_pages, pngs=args.pngs, txts=args.txts)
+    output_dir = os.path.join(root, "out", point)
+    os.makedirs(output_dir, exist_ok=True)
+
+    fake = FakeOpenAI(latency=args.latency, tool_calls=args.tool_calls)
+    structured_handlers(fake, sheet_fields, samples)
+    fake.install()
+
+    timer = NodeTimer(args.memory)
+    graph = build_graph(checkpointer=MemorySaver())
+    inputs = {
+        "procedure": "証跡の日付が2025年であることを確認してください。",
+        "sample_data_path": point,
+        "format_path": template,
+        "excel_file": template,
+        "output_dir": output_dir,
+        "parallel_samples": args.parallel,
+        "evidence_mode": args.evidence_mode,
+        "excel_render_backend": "pil",
+        "refresh_format_cache": not args.format_cache,
+    }
+    config = {"configurable": {"thread_id": f"bench-{point}"}, "callbacks": [timer.handler], "recursion_limit": 10000}
+
+    if args.memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        values = graph.invoke(inputs, config)
+    finally:
+        wall = time.perf_counter() - started
+        traced_peak = tracemalloc.get_traced_memory()[1] if args.memory else None
+        if args.memory:
+            tracemalloc.stop()
+        fake.uninstall()
+
+    model_calls = sum(count for name, count in fake.calls.items() if name != "tool_call")
+    nodes = {
+        name: {"calls": len(times), "total": round(sum(times), 4), "mean": round(sum(times) / len(times), 4), "max": round(max(times), 4)}
+        for name, times in sorted(timer.timings.items())
+    }
+    return {
+        "point": {"samples": samples, "sheets": sheets, "fields": fields},
+        "wall_seconds": round(wall, 4),
+        "stages": {stage: round(sum(nodes.get(name, {}).get("total", 0) for name in names), 4) for stage, names in STAGES.items()},
+        "nodes": nodes,
+        "model_calls": dict(fake.calls),
+        "simulated_latency_seconds": round(model_calls * args.latency, 4),
+        "memory": {
+            "max_rss_mib": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            "traced_peak_mib": round(traced_peak / 2**20, 2) if traced_peak is not None else None,
+            "node_peaks_mib": {name: round(peak / 2**20, 2) for name, peak in sorted(timer.peaks.items())},
+        },
+        "samples_completed": len(values.get("iter_data") or []),
+        "output_excel_path": values.get("output_excel_path"),
+    }
+
+
+def print_point(result: dict) -> None:
+    point = result["point"]
+    print(f"\n== samples={point['samples']} sheets={point['sheets']} fields={point['fields']}: "  # noqa: T201
+          f"wall {result['wall_seconds'] * 1000:.0f} ms, simulated LLM latency {result['simulated_latency_seconds'] * 1000:.0f} ms, "
+          f"max RSS {result['memory']['max_rss_mib']} MiB")
+    peaks = result["memory"]["node_peaks_mib"]
+    print(f"{'node':<40} {'calls':>5} {'total ms':>10} {'mean ms':>9} {'max ms':>9}" + (f" {'peak MiB':>9}" if peaks else ""))  # noqa: T201
+    for name, stats in result["nodes"].items():
+        line = f"{name:<40} {stats['calls']:>5} {stats['total'] * 1000:>10.1f} {stats['mean'] * 1000:>9.1f} {stats['max'] * 1000:>9.1f}"
+        if peaks:
+            line += f" {peaks[name]:>9.2f}" if name in peaks else f" {'':>9}"
+        print(line)  # noqa: T201
+    print("model calls: " + ", ".join(f"{name}={count}" for name, count in sorted(result["model_calls"].items())))  # noqa: T201
+
+
+def print_scaling(param: str, results: list) -> None:
+    print(f"\n== scaling by {param}")  # noqa: T201
+    print(f"{param:>8} {'wall ms':>9} " + " ".join(f"{stage + ' ms':>11}" for stage in STAGES) + f" {'model calls':>11} {'RSS MiB':>8}")  # noqa: T201
+    for result in results:
+        calls = sum(count for name, count in result["model_calls"].items() if name != "tool_call")
+        print(f"{result['point'][param]:>8} {result['wall_seconds'] * 1000:>9.0f} "  # noqa: T201
+              + " ".join(f"{result['stages'][stage] * 1000:>11.1f}" for stage in STAGES)
+              + f" {calls:>11} {result['memory']['max_rss_mib']:>8}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--samples", type=int, default=4)
+    parser.add_argument("--sheets", type=int, default=2)
+    parser.add_argument("--fields", type=int, default=20, help="input fields per sheet")
+    parser.add_argument("--merged", type=int, default=2, help="extra merged blocks per sheet")
+    parser.add_argument("--pdfs", type=int, default=1, help="PDFs per sample")
+    parser.add_argument("--pdf-pages", type=int, default=2)
+    parser.add_argument("--pngs", type=int, default=1, help="PNGs per sample")
+    parser.add_argument("--txts", type=int, default=1, help="text files per sample")
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated seconds per model call")
+    parser.add_argument("--tool-calls", type=int, default=1, help="analyze_image_tool calls per agent run")
+    parser.add_argument("--parallel", action="store_true", help="fan-out mode (one worker per sample)")
+    parser.add_argument("--evidence-mode", choices=["eager", "lazy"], default="eager")
+    parser.add_argument("--format-cache", action="store_true", help="allow format_cache hits (default: refresh every run)")
+    parser.add_argument("--scale", help="PARAM=V1,V2,... with PARAM one of samples, sheets, fields")
+    parser.add_argument("--memory", action="store_true", help="trace Python allocations per node (slow)")
+    parser.add_argument("--no-warmup", action="store_true", help="skip the untimed warm-up run")
+    parser.add_argument("--json", help="write all results as JSON to this file")
+    args = parser.parse_args()
+
+    points = [(args.samples, args.sheets, args.fields)]
+    param = None
+    if args.scale:
+        param, _, values = args.scale.partition("=")
+        if param not in ("samples", "sheets", "fields") or not values:
+            parser.error("--scale must look like samples=1,4,16 (samples, sheets or fields)")
+        base = {"samples": args.samples, "sheets": args.sheets, "fields": args.fields}
+        points = [(v["samples"], v["sheets"], v["fields"]) for v in ({**base, param: int(value)} for value in values.split(","))]
+
+    with tempfile.TemporaryDirectory(prefix="bench_pipeline_") as root:
+        prepare_environment(root)
+        import logging
+        import warnings
+
+        logging.disable(logging.WARNING)
+        warnings.simplefilter("ignore")
+        if not args.no_warmup:
+            run_point(root, argparse.Namespace(**{**vars(args), "memory": False}), 1, 1, 2)
+        results = []
+        for samples, sheets, fields in points:
+            result = run_point(root, args, samples, sheets, fields)
+            print_point(result)
+            results.append(result)
+        if param:
+            print_scaling(param, results)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2, default=str)
+
+
+if __name__ == "__main__":
+    main()
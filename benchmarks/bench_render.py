@@ -0,0 +1,106 @@
+"""Benchmark the capture backends used by the format-understanding workflow.
+
+Compares the in-process PIL rasterizer (`sheet_rasterizer`) with the LibreOffice
+render path (`render_service`, skipped when `soffice` is not installed) on a
+synthetic form template or on a workbook given with `--excel`.
+
+Usage:
+    python benchmarks/bench_render.py [--excel PATH] [--rows 60] [--cols 8] [--sheets 1] [--repeat 5]
+"""
+
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+import openpyxl  # noqa: E402
+from openpyxl.styles import Border, Font, PatternFill, Side  # noqa: E402
+
+from config import SOFFICE_PATH  # noqa: E402
+
+
+def build_template(path: str, rows: int, cols: int, sheets: int) -> None:
+    """Write a form-like workbook: bold labels, filled headers, borders, merged titles and highlights."""
+    thin = Side(style="thin")
+    header_fill = PatternFill(start_color="DDEBF7", end_color="DDEBF7", fill_type="solid")
+    highlight_fill = PatternFill(start_color="FFFF00", end_color="FFFF00", fill_type="solid")
+    workbook = openpyxl.Workbook()
+    workbook.remove(workbook.active)
+    for sheet_idx in range(1, sheets + 1):
+        sheet = workbook.create_sheet(f"Sheet{sheet_idx}")
+        sheet.merge_cells(start_row=1, start_column=1, end_row=1, end_column=cols)
+        sheet.cell(row=1, column=1, value=f"サンプルテスト調書 {sheet_idx}").font = Font(bold=True)
+        for col in range(1, cols + 1):
+            header = sheet.cell(row=2, column=col, value=f"項目{col}")
+            header.font = Font(bold=True)
+            header.fill = header_fill
+            sheet.column_dimensions[openpyxl.utils.get_column_letter(col)].width = 14
+        for row in range(3, rows + 1):
+            for col in range(1, cols + 1):
+                cell = sheet.cell(row=row, column=col)
+                cell.border = Border(left=thin, right=thin, top=thin, bottom=thin)
+                if col == 1:
+                    cell.value = f"ラベル{row}"
+                    cell.font = Font(bold=True)
+                elif (row + col) % 7 == 0:
+                    cell.fill = highlight_fill
+                    cell.value = cell.coordinate
+        sheet.print_area = sheet.calculate_dimension()
+        sheet.page_setup.fitToPage = True
+    workbook.save(path)
+
+
+def time_backend(name, render, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        captures = render()
+        timings.append(time.perf_counter() - started)
+    sizes = sum(os.path.getsize(c) for c in captures)
+    print(  # noqa: T201
+        f"{name:<10} runs={repeat:<3} mean={statistics.mean(timings) * 1000:9.1f} ms  "
+        f"min={min(timings) * 1000:9.1f} ms  max={max(timings) * 1000:9.1f} ms  "
+        f"pngs={len(captures)} ({sizes / 1024:.0f} KiB)"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--excel", help="workbook to render (default: synthetic template)")
+    parser.add_argument("--rows", type=int, default=60)
+    parser.add_argument("--cols", type=int, default=8)
+    parser.add_argument("--sheets", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    from sheet_rasterizer import rasterize_workbook
+
+    with tempfile.TemporaryDirectory(prefix="bench_render_") as tmp:
+        excel_path = args.excel
+        if not excel_path:
+            excel_path = os.path.join(tmp, "template.xlsx")
+            build_template(excel_path, args.rows, args.cols, args.sheets)
+            print(f"synthetic template: {args.sheets} sheet(s) x {args.rows} rows x {args.cols} cols")  # noqa: T201
+        out_dir = os.path.join(tmp, "captures")
+
+        time_backend("pil", lambda: rasterize_workbook(excel_path, out_dir), args.repeat)
+
+        if shutil.which(SOFFICE_PATH) or os.path.exists(SOFFICE_PATH):
+            from render_service import render_workbook
+
+            # 1回目はワーカーの起動を含むため別に計測する
+            time_backend("soffice*", lambda: render_workbook(excel_path, out_dir, "soffice"), 1)
+            time_backend("soffice", lambda: render_workbook(excel_path, out_dir, "soffice"), args.repeat)
+            print("(* first call includes LibreOffice worker start-up)")  # noqa: T201
+        else:
+            print(f"soffice    skipped: {SOFFICE_PATH} not found")  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
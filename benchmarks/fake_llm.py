@@ -0,0 +1,141 @@
+"""Deterministic stand-in for the OpenAI chat completions API, used by the offline benchmarks.
+
+`FakeOpenAI` is installed into `llm_registry` as an httpx mock transport, so the
+real `ChatOpenAI` clients, structured-output parsing, blob restoring and the
+ReAct agent all run unchanged; only the network round trip is replaced by a
+canned response after a configurable latency.
+
+Responses are chosen per request:
+  * structured output (`response_format` json_schema, or a forced tool call):
+    a handler registered for the schema name, else a minimal instance generated
+    from the JSON schema itself;
+  * ReAct agent turns (tools bound): up to `tool_calls` calls of the first
+    image tool, then a plain answer;
+  * anything else (e.g. the vision tool): a short fixed text.
+"""
+
+import asyncio
+import json
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, Optional
+
+import httpx
+
+Handler = Callable[[Dict[str, Any]], Dict[str, Any]]
+
+
+def instance_from_schema(schema: Dict[str, Any], root: Optional[Dict[str, Any]] = None) -> Any:
+    """Build the smallest value that validates against a JSON schema (first enum / anyOf branch)."""
+    root = root or schema
+    if "$ref" in schema:
+        name = schema["$ref"].rsplit("/", 1)[-1]
+        return instance_from_schema((root.get("$defs") or root.get("definitions") or {})[name], root)
+    if "enum" in schema:
+        return schema["enum"][0]
+    if "const" in schema:
+        return schema["const"]
+    for key in ("anyOf", "oneOf", "allOf"):
+        if key in schema:
+            branches = [branch for branch in schema[key] if branch.get("type") != "null"] or schema[key]
+            return instance_from_schema(branches[0], root)
+    kind = schema.get("type")
+    if isinstance(kind, list):
+        kind = next((k for k in kind if k != "null"), "null")
+    if kind == "object" or "properties" in schema:
+        return {name: instance_from_schema(prop, root) for name, prop in (schema.get("properties") or {}).items()}
+    return {"array": [], "string": "", "integer": 0, "number": 0, "boolean": False, "null": None}.get(kind, "")
+
+
+class FakeOpenAI:
+    """Canned chat completions with per-schema handlers, latency and call counters."""
+
+    def __init__(self, latency: float = 0.0, tool_calls: int = 0):
+        self.latency = latency
+        self.tool_calls = tool_calls
+        self.handlers: Dict[str, Handler] = {}
+        self.calls: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def on(self, schema_name: str, handler: Handler) -> None:
+        """Answer structured-output requests for `schema_name` with `handler(request_body)`."""
+        self.handlers[schema_name] = handler
+
+    def count(self, name: str) -> int:
+        with self._lock:
+            self.calls[name] += 1
+            return self.calls[name]
+
+    def install(self) -> None:
+        import llm_registry
+
+        llm_registry.use_transport(httpx.MockTransport(self._handle), httpx.MockTransport(self._handle_async))
+
+    @staticmethod
+    def uninstall() -> None:
+        import llm_registry
+
+        llm_registry.use_transport(None)
+
+    # -- request handling -------------------------------------------------
+
+    def _structured(self, name: str, schema: Dict[str, Any], body: Dict[str, Any]) -> str:
+        self.count(name)
+        handler = self.handlers.get(name)
+        value = handler(body) if handler else instance_from_schema(schema)
+        return json.dumps(value, ensure_ascii=False)
+
+    def _message(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        response_format = body.get("response_format") or {}
+        if response_format.get("type") == "json_schema":
+            spec = response_format["json_schema"]
+            return {"role": "assistant", "content": self._structured(spec["name"], spec.get("schema") or {}, body)}
+
+        tools = body.get("tools") or []
+        tool_choice = body.get("tool_choice")
+        if isinstance(tool_choice, dict) or tool_choice == "required":
+            # with_structured_output(method="function_calling")
+            function = tool_choice["function"]["name"] if isinstance(tool_choice, dict) else tools[0]["function"]["name"]
+            spec = next(tool["function"] for tool in tools if tool["function"]["name"] == function)
+            arguments = self._structured(function, spec.get("parameters") or {}, body)
+            return {"role": "assistant", "content": None, "tool_calls": [
+                {"id": f"call_{self.count('tool_call')}", "type": "function", "function": {"name": function, "arguments": arguments}}
+            ]}
+
+        if tools:
+            self.count("agent")
+            done = sum(1 for message in body.get("messages", []) if message.get("role") == "tool")
+            image_tool = next((tool["function"]["name"] for tool in tools if "image" in tool["function"]["name"]), None)
+            if image_tool and done < self.tool_calls:
+                arguments = json.dumps({"image_data_num": 1, "query": f"確認事項{done + 1}"}, ensure_ascii=False)
+                return {"role": "assistant", "content": None, "tool_calls": [
+                    {"id": f"call_{self.count('tool_call')}", "type": "function", "function": {"name": image_tool, "arguments": arguments}}
+                ]}
+            return {"role": "assistant", "content": "手続きを実施しました。結果はOKです。"}
+
+        self.count("text")
+        return {"role": "assistant", "content": "画像には2025年の日付が記載されています。"}
+
+    def _response(self, request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        message = self._message(body)
+        payload = {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "fake"),
+            "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if message.get("tool_calls") else "stop"}],
+            "usage": {"prompt_tokens": len(request.content) // 4, "completion_tokens": 16, "total_tokens": len(request.content) // 4 + 16},
+        }
+        return httpx.Response(200, json=payload)
+
+    def _handle(self, request: httpx.Request) -> httpx.Response:
+        if self.latency:
+            time.sleep(self.latency)
+        return self._response(request)
+
+    async def _handle_async(self, request: httpx.Request) -> httpx.Response:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._response(request)
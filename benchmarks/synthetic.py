@@ -0,0 +1,95 @@
+"""Synthetic inputs for the offline benchmarks: form templates and evidence folders.
+
+Everything is generated deterministically from the given sizes (and `seed`), so
+two runs of a benchmark on the same box read the same bytes.
+"""
+
+import os
+import random
+from typing import Dict, List
+
+import openpyxl
+from openpyxl.styles import Border, Font, PatternFill, Side
+from openpyxl.utils import get_column_letter
+
+
+def build_form_template(path: str, sheets: int, fields: int, merged: int = 2, label_rows: int = 40, cols: int = 6) -> Dict[str, List[str]]:
+    """Write a workpaper-like template and return its input fields per sheet.
+
+    Each sheet gets a merged title, `merged` extra merged label blocks, a block of
+    labelled rows and `fields` empty input cells spread over the unlabelled
+    columns B, D, F, ... (top to bottom) that the fake estimator reports back.
+    """
+    thin = Side(style="thin")
+    header_fill = PatternFill(start_color="DDEBF7", end_color="DDEBF7", fill_type="solid")
+    workbook = openpyxl.Workbook()
+    workbook.remove(workbook.active)
+    sheet_fields: Dict[str, List[str]] = {}
+    for sheet_idx in range(1, sheets + 1):
+        sheet = workbook.create_sheet(f"Sheet{sheet_idx}")
+        sheet.merge_cells(start_row=1, start_column=1, end_row=1, end_column=cols)
+        sheet.cell(row=1, column=1, value=f"サンプルテスト調書 {sheet_idx}").font = Font(bold=True)
+        per_column = max(1, -(-fields // (cols // 2)))
+        rows = max(label_rows, per_column + 2)
+        for row in range(2, rows + 2):
+            for col in range(1, cols + 1):
+                cell = sheet.cell(row=row, column=col)
+                cell.border = Border(left=thin, right=thin, top=thin, bottom=thin)
+                if col % 2 == 1:
+                    cell.value = f"項目{row}-{col}"
+                    cell.fill = header_fill
+        for block in range(merged):
+            top = rows + 3 + block * 3
+            sheet.merge_cells(start_row=top, start_column=1, end_row=top + 1, end_column=cols)
+            sheet.cell(row=top, column=1, value=f"備考{block + 1}")
+        cells = []
+        for number in range(fields):
+            pair, offset = divmod(number, per_column)
+            cells.append(f"{get_column_letter(2 + 2 * pair)}{3 + offset}")
+        sheet_fields[sheet.title] = cells
+        for col in range(1, cols + 1):
+            sheet.column_dimensions[get_column_letter(col)].width = 14
+    workbook.save(path)
+    return sheet_fields
+
+
+def _write_png(path: str, rng: random.Random, size=(800, 600)) -> None:
+    from PIL import Image, ImageDraw
+
+    image = Image.new("RGB", size, "white")
+    draw = ImageDraw.Draw(image)
+    for line in range(20):
+        y = 20 + line * 28
+        draw.rectangle([20, y, 20 + rng.randint(200, size[0] - 40), y + 12], fill=(rng.randint(0, 80),) * 3)
+    image.save(path)
+
+
+def _write_pdf(path: str, pages: int, rng: random.Random) -> None:
+    import fitz
+
+    document = fitz.open()
+    for page_num in range(pages):
+        page = document.new_page(width=595, height=842)
+        for line in range(30):
+            page.insert_text((50, 60 + line * 24), f"Invoice {page_num + 1}-{line} amount {rng.randint(1000, 99999)} date 2025-0{1 + line % 9}-1{line % 9}")
+    document.save(path)
+    document.close()
+
+
+def build_evidence(root: str, samples: int, pdfs: int = 1, pdf_pages: int = 2, pngs: int = 1, txts: int = 1, seed: int = 0) -> List[str]:
+    """Create `samples` sample folders under `root`, each with PDFs, PNGs and text files."""
+    rng = random.Random(seed)
+    names = []
+    for sample in range(1, samples + 1):
+        name = f"sample{sample:04d}"
+        folder = os.path.join(root, name)
+        os.makedirs(folder, exist_ok=True)
+        for idx in range(pdfs):
+            _write_pdf(os.path.join(folder, f"invoice{idx + 1}.pdf"), pdf_pages, rng)
+        for idx in range(pngs):
+            _write_png(os.path.join(folder, f"receipt{idx + 1}.png"), rng)
+        for idx in range(txts):
+            with open(os.path.join(folder, f"note{idx + 1}.txt"), "w", encoding="utf-8") as f:
+                f.write(f"サンプル{sample} 取引日: 2025-04-{1 + sample % 28:02d} 金額: {rng.randint(1000, 99999)}円\n")
+        names.append(name)
+    return names
@@ -0,0 +1,253 @@
+"""
+監査手続き × サンプルフォルダのバッチ実行
+
+マニフェストの各ジョブ（監査手続き・サンプルフォルダ・テンプレート）をスレッドプールでグラフに流し、
+ジョブごとの結果を完了順に JSON Lines に追記して、最後にスループットとレイテンシの集計を出力する。
+    - テンプレートごとの入力欄特定は、ジョブの実行前にテンプレート1つにつき1回だけ実行して format_cache に
+      保存しておく（同じテンプレートのジョブはキャッシュを使う）
+    - チェックポイントは local_runner.py と同じ SQLite に保存し、スレッドIDは "<バッチID>-<ジョブID>" とする。
+      同じマニフェストを再実行すると、完了したジョブはスキップし、途中のジョブはチェックポイントから再開する
+    - query_to_human の問い合わせは --answers の回答ファイルで自動回答する。回答が無い場合は
+      "interrupted" としてチェックポイントに残し（キューに積み）、回答ファイルを指定した再実行で再開する
+
+マニフェスト（JSON Lines または JSON の配列）の各行:
+    {"job_id": "sales-2025", "procedure": "...", "sample_data_path": "...", "format_path": "...", "parallel": true}
+回答ファイル（JSON）: ジョブIDごとの回答（文字列は毎回同じ回答、リストは順に使用）と全ジョブ共通の "*"
+    {"sales-2025": ["回答1", "回答2"], "*": "不明のため保留としてください"}
+
+使い方:
+    python src/batch_runner.py jobs.jsonl --out results.jsonl --workers 4 [--answers answers.json]
+"""
+
+import argparse
+import json
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from config import CHECKPOINT_DB_PATH
+from local_runner import build_inputs, open_checkpointer, pending_interrupts, run
+
+logger = logging.getLogger(__name__)
+
+JOB_FIELDS = {"job_id", "procedure", "sample_data_path", "format_path", "parallel", "evidence_mode"}
+# 1ジョブあたりの自動回答の上限（同じ問い合わせが繰り返される場合に止めるため）
+MAX_AUTO_ANSWERS = 10
+
+def load_manifest(path: Path) -> List[Dict[str, Any]]:
+    """マニフェストを読み込んで検証する（job_id が無いジョブには行番号から採番する）"""
+    text = path.read_text(encoding="utf-8")
+    if text.lstrip().startswith("["):
+        jobs = json.loads(text)
+    else:
+        jobs = [json.loads(line) for line in text.splitlines() if line.strip()]
+    seen = set()
+    for number, job in enumerate(jobs, 1):
+        unknown = set(job) - JOB_FIELDS
+        if unknown:
+            raise ValueError(f"ジョブ {number} に不明な項目があります: {', '.join(sorted(unknown))}")
+        job.setdefault("job_id", f"job-{number}")
+        job["job_id"] = str(job["job_id"])
+        if job["job_id"] in seen:
+            raise ValueError(f"job_id が重複しています: {job['job_id']}")
+        seen.add(job["job_id"])
+    return jobs
+
+class AnswerBook:
+    """回答ファイルの回答をジョブごとに順に払い出す"""
+
+    def __init__(self, answers: Optional[Dict[str, Any]] = None):
+        self._answers = answers or {}
+        self._used: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path: Optional[Path]) -> "AnswerBook":
+        if path is None:
+            return cls()
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def next_answer(self, job_id: str) -> Optional[str]:
+        """次の回答（無い場合は None）"""
+        answers = self._answers.get(job_id, self._answers.get("*"))
+        if answers is None:
+            return None
+        if isinstance(answers, str):
+            return answers
+        with self._lock:
+            used = self._used.get(job_id, 0)
+            if used >= len(answers):
+                return None
+            self._used[job_id] = used + 1
+        return str(answers[used])
+
+def warm_format_cache(jobs: List[Dict[str, Any]], workers: int) -> Dict[str, Dict[str, Any]]:
+    """テンプレートごとに入力欄特定を1回実行して format_cache に保存する（失敗してもジョブ側で再実行される）"""
+    from excel_format_node import run_excel_format_workflow_node
+    from state import State
+
+    templates = sorted({job.get("format_path") or State().format_path for job in jobs})
+
+    def warm(format_path: str) -> Dict[str, Any]:
+        started = time.perf_counter()
+        try:
+            result = run_excel_format_workflow_node(State(**build_inputs(format_path=format_path)))
+            ok = bool(result.get("excel_format_json_path"))
+            return {"ok": ok, "seconds": round(time.perf_counter() - started, 3)}
+        except Exception as e:
+            logger.exception(f"入力欄特定の事前実行に失敗しました: {format_path}")
+            return {"ok": False, "seconds": round(time.perf_counter() - started, 3), "error": str(e)}
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(templates)))) as pool:
+        results = dict(zip(templates, pool.map(warm, templates)))
+    logger.info(f"入力欄特定を事前に実行しました: {len(templates)}テンプレート")
+    return results
+
+def run_job(graph, job: Dict[str, Any], thread_id: str, answers: AnswerBook) -> Dict[str, Any]:
+    """1ジョブを実行（または再開）し、結果のレコードを返す"""
+    job_id = job["job_id"]
+    record: Dict[str, Any] = {
+        "job_id": job_id,
+        "thread_id": thread_id,
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "answered": 0,
+    }
+    started = time.perf_counter()
+    try:
+        config = {"configurable": {"thread_id": thread_id}}
+        snapshot = graph.get_state(config)
+        if snapshot.values and not snapshot.next:
+            record.update(status="skipped", samples=len(snapshot.values.get("iter_data") or []),
+                          output_excel_path=snapshot.values.get("output_excel_path"))
+            return record
+
+        answer = None
+        if pending_interrupts(snapshot):
+            answer = answers.next_answer(job_id)
+            if answer is None:
+                # 回答が届くまでチェックポイントに残す
+                record.update(status="interrupted", queued=True, interrupts=pending_interrupts(snapshot))
+                return record
+        inputs = build_inputs(job.get("procedure"), job.get("sample_data_path"), job.get("format_path"),
+                              job.get("parallel"), job.get("evidence_mode"))
+        result = run(graph, thread_id, inputs, answer)
+        record["answered"] += answer is not None
+        while result["interrupts"] and record["answered"] < MAX_AUTO_ANSWERS:
+            answer = answers.next_answer(job_id)
+            if answer is None:
+                break
+            logger.info(f"問い合わせに自動回答します: {job_id}")
+            result = run(graph, thread_id, answer=answer)
+            record["answered"] += 1
+
+        values = result["values"]
+        if result["interrupts"]:
+            status = "interrupted"
+        else:
+            status = "completed" if not result["next"] else "incomplete"
+        record.update(
+            status=status,
+            samples=len(values.get("iter_data") or []),
+            output_excel_path=values.get("output_excel_path"),
+            interrupts=result["interrupts"],
+        )
+    except Exception as e:
+        logger.exception(f"ジョブが失敗しました: {job_id}")
+        record.update(status="failed", error=f"{type(e).__name__}: {e}")
+    finally:
+        record["seconds"] = round(time.perf_counter() - started, 3)
+    return record
+
+def _percentile(values: List[float], percent: float) -> Optional[float]:
+    # nearest-rank 法
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * percent // 100))
+    return ordered[int(rank) - 1]
+
+def summarize(records: List[Dict[str, Any]], wall_seconds: float) -> Dict[str, Any]:
+    """ジョブ件数・スループット・レイテンシ（スキップしたジョブと回答待ちのまま実行しなかったジョブを除く）の集計"""
+    statuses: Dict[str, int] = {}
+    for record in records:
+        statuses[record["status"]] = statuses.get(record["status"], 0) + 1
+    executed = [record for record in records if record["status"] != "skipped" and not record.get("queued")]
+    latencies = [record["seconds"] for record in executed]
+    samples = sum(record.get("samples") or 0 for record in executed if record["status"] == "completed")
+    minutes = wall_seconds / 60 if wall_seconds > 0 else None
+    return {
+        "jobs": len(records),
+        "statuses": statuses,
+        "wall_seconds": round(wall_seconds, 3),
+        "throughput": {
+            "jobs_per_minute": round(statuses.get("completed", 0) / minutes, 2) if minutes else None,
+            "samples_per_minute": round(samples / minutes, 2) if minutes else None,
+        },
+        "latency_seconds": {
+            "mean": round(sum(latencies) / len(latencies), 3) if latencies else None,
+            "p50": _percentile(latencies, 50),
+            "p90": _percentile(latencies, 90),
+            "p95": _percentile(latencies, 95),
+            "max": max(latencies) if latencies else None,
+        },
+        "interrupted": [record["job_id"] for record in records if record["status"] == "interrupted"],
+        "failed": [record["job_id"] for record in records if record["status"] == "failed"],
+    }
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="マニフェストのジョブをまとめてグラフで実行する（SQLiteチェックポイント）")
+    parser.add_argument("manifest", type=Path, help="ジョブのマニフェスト（JSON Lines または JSON の配列）")
+    parser.add_argument("--out", type=Path, help="ジョブごとの結果を追記する JSON Lines（省略時は <マニフェスト>.results.jsonl）")
+    parser.add_argument("--workers", type=int, default=4, help="同時に実行するジョブ数")
+    parser.add_argument("--answers", type=Path, help="問い合わせへの回答ファイル（JSON）")
+    parser.add_argument("--batch-id", help="スレッドIDの接頭辞（省略時はマニフェストのファイル名。同じIDで再実行すると再開する）")
+    parser.add_argument("--rerun", action="store_true", help="完了済みのジョブも新しいスレッドで実行し直す")
+    parser.add_argument("--no-warm", action="store_true", help="入力欄特定の事前実行を行わない")
+    parser.add_argument("--db", type=Path, default=CHECKPOINT_DB_PATH, help="チェックポイントのSQLiteファイル")
+    args = parser.parse_args(argv)
+
+    jobs = load_manifest(args.manifest)
+    answers = AnswerBook.load(args.answers)
+    out_path = args.out or args.manifest.with_suffix(".results.jsonl")
+    batch_id = args.batch_id or args.manifest.stem
+    run_suffix = f"-{uuid.uuid4().hex[:8]}" if args.rerun else ""
+
+    # グラフの読み込みはLLMクライアント等の初期化を伴うため、引数の解析後に行う
+    from graph import build_graph
+
+    started = time.perf_counter()
+    warmed = {} if args.no_warm else warm_format_cache(jobs, args.workers)
+    graph = build_graph(checkpointer=open_checkpointer(args.db))
+
+    records = []
+    out_lock = threading.Lock()
+    # 再実行（再開）のたびに結果を追記し、前回までの結果を残す
+    with open(out_path, "a", encoding="utf-8") as out, ThreadPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        futures = [
+            pool.submit(run_job, graph, job, f"{batch_id}-{job['job_id']}{run_suffix}", answers)
+            for job in jobs
+        ]
+        for future in as_completed(futures):
+            record = future.result()
+            with out_lock:
+                out.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+                out.flush()
+            records.append(record)
+            logger.info(f"ジョブ {record['job_id']}: {record['status']} ({record.get('seconds', 0):.1f}秒)")
+
+    summary = summarize(records, time.perf_counter() - started)
+    summary["results"] = str(out_path)
+    summary["format_warmup"] = warmed
+    print(json.dumps(summary, ensure_ascii=False, indent=2, default=str))  # noqa: T201
+    if summary["interrupted"]:
+        print(f"問い合わせ待ちのジョブは回答ファイルを指定して再実行すると再開します: --batch-id {batch_id} --answers <回答ファイル>")  # noqa: T201
+    return 1 if summary["failed"] else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,133 @@
+"""
+アップロードされたファイルのコンテンツアドレス型ストア
+
+ファイルの実体は BLOB_DIR/objects/<SHA-256の先頭2文字>/<SHA-256> に1つだけ保存し、
+data/sample・data/format の各パスにはハードリンク（別ファイルシステム等でリンクできない場合はコピー）で配置する。
+どのパスにどのダイジェストを配置したかは BLOB_DIR/manifests/<名前>.json に記録する。
+同じ証跡フォルダやテンプレートを何度アップロードしても、実体は1つしか保存されない。
+
+オブジェクトは複数のパスから共有されるため、配置したファイルをその場で書き換えてはならない
+（置き換える場合は materialize で新しいリンクを作成する）。
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from pathlib import Path
+from typing import Dict, Optional
+
+from config import BLOB_DIR
+
+logger = logging.getLogger(__name__)
+
+OBJECTS_DIR = BLOB_DIR / "objects"
+MANIFESTS_DIR = BLOB_DIR / "manifests"
+TMP_DIR = BLOB_DIR / "tmp"
+
+_manifest_lock = threading.Lock()
+
+def object_path(digest: str) -> Path:
+    return OBJECTS_DIR / digest[:2] / digest
+
+def has(digest: str) -> bool:
+    return object_path(digest).exists()
+
+def temp_file() -> tuple:
+    """
+    アップロード中のデータを書き込む一時ファイル (fd, パス) を返す
+    （オブジェクトと同じファイルシステムに作成するため、ingest で os.replace できる）
+    """
+    TMP_DIR.mkdir(parents=True, exist_ok=True)
+    return tempfile.mkstemp(dir=TMP_DIR, prefix="upload-", suffix=".part")
+
+def ingest(tmp_path: str, digest: str) -> bool:
+    """
+    書き込み済みの一時ファイルをオブジェクトとして登録する。
+    同じダイジェストのオブジェクトが既にあれば一時ファイルを削除して True（重複）を返す
+    """
+    path = object_path(digest)
+    if path.exists():
+        os.remove(tmp_path)
+        return True
+    path.parent.mkdir(parents=True, exist_ok=True)
+    os.replace(tmp_path, path)
+    return False
+
+def put_bytes(data: bytes) -> str:
+    """バイト列をオブジェクトとして保存し、SHA-256を返す（既にあれば書き込まない）"""
+    digest = hashlib.sha256(data).hexdigest()
+    if not has(digest):
+        fd, tmp_path = temp_file()
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        ingest(tmp_path, digest)
+    return digest
+
+def read_bytes(digest: str) -> bytes:
+    with open(object_path(digest), "rb") as f:
+        return f.read()
+
+def materialize(digest: str, target_path: str) -> None:
+    """
+    オブジェクトを target_path に配置する（ハードリンク、できない場合はコピー）
+    既存のファイルは原子的に置き換える
+    """
+    target_dir = os.path.dirname(target_path)
+    os.makedirs(target_dir, exist_ok=True)
+    source = object_path(digest)
+    # 配置済み（同じオブジェクトへのハードリンク）なら何もしない。rename は同じ inode 同士では何もせず一時リンクが残る
+    if os.path.exists(target_path) and os.path.samefile(source, target_path):
+        return
+    tmp_link = os.path.join(target_dir, f".{os.path.basename(target_path)}.{digest[:12]}.link")
+    if os.path.lexists(tmp_link):
+        os.remove(tmp_link)
+    try:
+        os.link(source, tmp_link)
+    except OSError as e:
+        logger.info(f"ハードリンクを作成できないためコピーします ({e}): {target_path}")
+        shutil.copyfile(source, tmp_link)
+    os.replace(tmp_link, target_path)
+
+def _manifest_path(name: str) -> Path:
+    return MANIFESTS_DIR / f"{name}.json"
+
+def load_manifest(name: str) -> Dict[str, dict]:
+    """パス（アップロード先からの相対パス） -> {"sha256", "size"} のマニフェストを返す"""
+    path = _manifest_path(name)
+    if not path.exists():
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def record(name: str, rel_path: str, digest: str, size: int) -> None:
+    """マニフェストにパスとダイジェストの対応を記録する"""
+    with _manifest_lock:
+        manifest = load_manifest(name)
+        manifest[rel_path.replace(os.sep, "/")] = {"sha256": digest, "size": size}
+        MANIFESTS_DIR.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=MANIFESTS_DIR, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+        os.replace(tmp_path, _manifest_path(name))
+
+def lookup(name: str, rel_path: str) -> Optional[str]:
+    """マニフェストに記録されたパスのダイジェスト（未登録の場合は None）"""
+    entry = load_manifest(name).get(rel_path.replace(os.sep, "/"))
+    return entry["sha256"] if entry else None
+
+def stats() -> dict:
+    """オブジェクト数と合計サイズ、マニフェストが参照するサイズの合計（重複排除前のサイズ）"""
+    objects = [p for p in OBJECTS_DIR.glob("*/*") if p.is_file()] if OBJECTS_DIR.exists() else []
+    referenced = 0
+    if MANIFESTS_DIR.exists():
+        for manifest_file in MANIFESTS_DIR.glob("*.json"):
+            referenced += sum(entry["size"] for entry in load_manifest(manifest_file.stem).values())
+    return {
+        "objects": len(objects),
+        "stored_bytes": sum(p.stat().st_size for p in objects),
+        "referenced_bytes": referenced,
+    }
@@ -10,3 +10,105 @@ DATA_DIR = PROJECT_ROOT / "data"
 SAMPLE_DATA_DIR = DATA_DIR / "sample"
 FORMAT_DIR = DATA_DIR / "format"
 DEFAULT_FORMAT_FILE = FORMAT_DIR / "サンプルテスト調書フォーマット.xlsx"
+
+# Derived artifacts (format-understanding results, renders, ...) that can be rebuilt at any time
+CACHE_DIR = Path(os.getenv("CACHE_DIR", DATA_DIR / "cache"))
+FORMAT_CACHE_DIR = CACHE_DIR / "format"
+FORMAT_CACHE_MAX_BYTES = int(os.getenv("FORMAT_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+
+# Maximum number of samples whose ReAct agents run at the same time in fan-out mode
+SAMPLE_CONCURRENCY = int(os.getenv("SAMPLE_CONCURRENCY", "4"))
+
+# LibreOffice rendering service (see render_service.py)
+SOFFICE_PATH = os.getenv("SOFFICE_PATH", "soffice")
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", "2"))
+RENDER_BASE_PORT = int(os.getenv("RENDER_BASE_PORT", "2002"))
+RENDER_TIMEOUT = float(os.getenv("RENDER_TIMEOUT", "120"))
+RENDER_HEALTHCHECK_INTERVAL = float(os.getenv("RENDER_HEALTHCHECK_INTERVAL", "30"))
+# unoserver command (e.g. "/usr/lib/libreoffice/program/python -m unoserver.server") that keeps
+# one warm soffice per worker when `import uno` is not available in this Python
+UNOSERVER_PATH = os.getenv("UNOSERVER_PATH", "unoserver")
+# Resolution of the sheet captures rasterized from the unoserver PDF export
+RENDER_PDF_DPI = int(os.getenv("RENDER_PDF_DPI", "96"))
+# Capture backend: "soffice" (render service) or "pil" (sheet_rasterizer, no LibreOffice)
+RENDER_BACKEND = os.getenv("RENDER_BACKEND", "soffice")
+# TrueType/OpenType font (with Japanese glyphs) used by the PIL rasterizer
+RASTER_FONT_PATH = os.getenv("RASTER_FONT_PATH", "")
+# Measure peak memory of workbook parsing with tracemalloc (slows parsing down, off by default)
+TRACE_WORKBOOK_MEMORY = os.getenv("TRACE_WORKBOOK_MEMORY", "0") == "1"
+# OpenAI rate-limit budget per model, shared by the async LLM calls (see rate_limit.py)
+OPENAI_RPM = int(os.getenv("OPENAI_RPM", "500"))
+OPENAI_TPM = int(os.getenv("OPENAI_TPM", "200000"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "5"))
+LLM_RETRY_BASE_SECONDS = float(os.getenv("LLM_RETRY_BASE_SECONDS", "1"))
+LLM_RETRY_MAX_SECONDS = float(os.getenv("LLM_RETRY_MAX_SECONDS", "30"))
+
+# Chat models by role (see llm_registry.py). Each role can be overridden with
+# LLM_MODEL_<ROLE>, LLM_TIMEOUT_<ROLE> (seconds) and LLM_MAX_CONNECTIONS_<ROLE>.
+def _llm_role(role: str, model: str, timeout: float, max_connections: int) -> dict:
+    key = role.upper()
+    return {
+        "model": os.getenv(f"LLM_MODEL_{key}", model),
+        "timeout": float(os.getenv(f"LLM_TIMEOUT_{key}", str(timeout))),
+        "max_connections": int(os.getenv(f"LLM_MAX_CONNECTIONS_{key}", str(max_connections))),
+    }
+
+LLM_ROLES = {
+    "estimator": _llm_role("estimator", "gpt-4.1-mini", 180, 4),
+    "validator": _llm_role("validator", "gpt-4.1-mini", 120, 8),
+    "corrector": _llm_role("corrector", "gpt-4.1-mini", 180, 4),
+    "writer": _llm_role("writer", "gpt-4.1", 180, 4),
+    "agent": _llm_role("agent", "gpt-4.1-mini", 120, SAMPLE_CONCURRENCY * 2),
+    "vision": _llm_role("vision", "gpt-4.1-mini", 90, SAMPLE_CONCURRENCY * 2),
+}
+LLM_KEEPALIVE_SECONDS = float(os.getenv("LLM_KEEPALIVE_SECONDS", "60"))
+
+# Memoized analyze_image_tool answers (see vision_cache.py)
+VISION_CACHE_PATH = Path(os.getenv("VISION_CACHE_PATH", CACHE_DIR / "vision_cache.sqlite3"))
+VISION_CACHE_TTL = float(os.getenv("VISION_CACHE_TTL", str(7 * 24 * 3600)))
+VISION_CACHE_MEMORY_ENTRIES = int(os.getenv("VISION_CACHE_MEMORY_ENTRIES", "512"))
+
+# Pre-rendered, base64-encoded PDF pages of the sample evidence (see pdf_page_cache.py)
+PDF_PAGE_CACHE_DIR = Path(os.getenv("PDF_PAGE_CACHE_DIR", CACHE_DIR / "pdf_pages"))
+
+# Downscaling / re-encoding of every image sent to a vision model (see image_prep.py)
+IMAGE_PREP_ENABLED = os.getenv("IMAGE_PREP_ENABLED", "1") == "1"
+# "jpeg", "webp" or "png"
+IMAGE_PREP_FORMAT = os.getenv("IMAGE_PREP_FORMAT", "webp")
+IMAGE_PREP_QUALITY = int(os.getenv("IMAGE_PREP_QUALITY", "85"))
+
+# Streaming uploads (see webapp.py)
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(1024 * 1024)))
+UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", "4"))
+UPLOAD_MAX_FILE_BYTES = int(os.getenv("UPLOAD_MAX_FILE_BYTES", str(200 * 1024 * 1024)))
+UPLOAD_MAX_REQUEST_BYTES = int(os.getenv("UPLOAD_MAX_REQUEST_BYTES", str(1024 * 1024 * 1024)))
+
+# Content-addressed store for uploaded files (see blob_store.py)
+BLOB_DIR = Path(os.getenv("BLOB_DIR", DATA_DIR / "blobs"))
+# Resumable upload sessions (see upload_sessions.py)
+UPLOAD_SESSION_DIR = Path(os.getenv("UPLOAD_SESSION_DIR", BLOB_DIR / "sessions"))
+UPLOAD_SESSION_MAX_CHUNK_BYTES = int(os.getenv("UPLOAD_SESSION_MAX_CHUNK_BYTES", str(16 * 1024 * 1024)))
+UPLOAD_SESSION_TTL = float(os.getenv("UPLOAD_SESSION_TTL", str(24 * 3600)))
+
+# In-process progress events streamed to clients over SSE (see progress.py)
+PROGRESS_BUFFER_EVENTS = int(os.getenv("PROGRESS_BUFFER_EVENTS", "256"))
+PROGRESS_MAX_THREADS = int(os.getenv("PROGRESS_MAX_THREADS", "100"))
+PROGRESS_HEARTBEAT_SECONDS = float(os.getenv("PROGRESS_HEARTBEAT_SECONDS", "15"))
+
+# LangGraph API used by webapp.py to read thread state (unset: the in-process server it is mounted in)
+LANGGRAPH_API_URL = os.getenv("LANGGRAPH_API_URL") or None
+
+# Durable checkpoints for local / batch runs (see local_runner.py)
+CHECKPOINT_DB_PATH = Path(os.getenv("CHECKPOINT_DB_PATH", DATA_DIR / "checkpoints.sqlite3"))
+
+# Per-task journal of node preparation steps, replayed when a node re-runs after an interrupt (see step_journal.py)
+STEP_JOURNAL_PATH = Path(os.getenv("STEP_JOURNAL_PATH", CACHE_DIR / "step_journal.sqlite3"))
+STEP_JOURNAL_TTL = float(os.getenv("STEP_JOURNAL_TTL", str(7 * 24 * 3600)))
+
+# Sorted index of the sample folders built once per run (see sample_index.py)
+SAMPLE_INDEX_DIR = Path(os.getenv("SAMPLE_INDEX_DIR", CACHE_DIR / "sample_index"))
+# Set to 0 to skip the SHA-256 of every evidence file (e.g. very large network-mounted folders)
+SAMPLE_INDEX_DIGESTS = os.getenv("SAMPLE_INDEX_DIGESTS", "1") == "1"
+
+# Write numeric / percent / date strings to the output workpaper as native Excel values (see excel_writer.py)
+EXCEL_WRITE_NATIVE_TYPES = os.getenv("EXCEL_WRITE_NATIVE_TYPES", "1") == "1"
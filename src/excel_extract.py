@@ -0,0 +1,141 @@
+"""
+Excelのセルデータをテキスト（LLMへの入力）として書き出す抽出エンジン
+
+行単位でストリーミングし、出力ファイルへ直接書き込む。書式情報はセルごとではなく
+(fontId, fillId) のスタイルID単位で一度だけ解決してキャッシュする。
+
+出力形式:
+    markdown: | セル | 値 | 書式 | の表（従来形式）
+    columnar: セル<TAB>値<TAB>書式ID の行と、末尾の書式一覧（プロンプトを小さくするための形式）
+"""
+
+import logging
+import xml.etree.ElementTree as ET
+from typing import Dict, List, Optional, TextIO, Tuple
+
+import openpyxl
+
+logger = logging.getLogger(__name__)
+
+EXTRACT_FORMATS = ("markdown", "columnar")
+
+_SHEET_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+
+class _StyleResolver:
+    """(fontId, fillId) -> 書式文字列 を解決してキャッシュする"""
+
+    def __init__(self, workbook):
+        self.workbook = workbook
+        self._cache: Dict[Tuple[int, int], str] = {}
+        # columnar 形式用: 書式文字列 -> 書式ID（S1, S2, ...）
+        self.legend: Dict[str, str] = {}
+
+    def format_of(self, cell) -> str:
+        # 読み取り専用モードのセルは style_array、通常のセルは _style が StyleArray
+        style = getattr(cell, "style_array", None) if not hasattr(cell, "_style") else cell._style
+        key = (style.fontId, style.fillId) if style is not None else (0, 0)
+        format_str = self._cache.get(key)
+        if format_str is None:
+            format_str = self._cache[key] = self._resolve(*key)
+        return format_str
+
+    def _resolve(self, font_id: int, fill_id: int) -> str:
+        format_info = []
+        font = self.workbook._fonts[font_id] if font_id < len(self.workbook._fonts) else None
+        if font is not None and font.bold:
+            format_info.append("太字")
+        fill = self.workbook._fills[fill_id] if fill_id < len(self.workbook._fills) else None
+        if fill is not None and getattr(fill, "fill_type", None) == "solid":
+            fill_color = fill.start_color.index
+            if fill_color != "00000000":  # デフォルト色でない場合
+                format_info.append(f"背景色:{fill_color}")
+        return ", ".join(format_info) if format_info else "-"
+
+    def legend_id(self, format_str: str) -> str:
+        if format_str == "-":
+            return "-"
+        style_id = self.legend.get(format_str)
+        if style_id is None:
+            style_id = self.legend[format_str] = f"S{len(self.legend) + 1}"
+        return style_id
+
+def _merged_ranges(sheet) -> List[str]:
+    """結合セル範囲を返す（読み取り専用モードではシートXMLの mergeCell 要素を直接読む）"""
+    if hasattr(sheet, "merged_cells"):
+        return [str(merged_cell_range) for merged_cell_range in sheet.merged_cells.ranges]
+    ranges = []
+    with sheet.parent._archive.open(sheet._worksheet_path) as xml_file:
+        for _, element in ET.iterparse(xml_file):
+            if element.tag == f"{_SHEET_NS}mergeCell":
+                ranges.append(element.get("ref"))
+            element.clear()
+    return ranges
+
+def write_cell_table(workbook, out: TextIO, extract_format: str = "markdown") -> int:
+    """
+    ワークブックの全シートのセルデータを out に書き出し、出力したセル数を返す
+    """
+    if extract_format not in EXTRACT_FORMATS:
+        raise ValueError(f"不明な抽出形式です: {extract_format}")
+    resolver = _StyleResolver(workbook)
+    columnar = extract_format == "columnar"
+    cell_count = 0
+
+    for sheet_name in workbook.sheetnames:
+        sheet = workbook[sheet_name]
+
+        # シート名の追加
+        out.write(f"## シート名: {sheet_name}\n")
+
+        # 結合セル情報の抽出
+        merged_cells = _merged_ranges(sheet)
+        if merged_cells:
+            out.write("### 結合セル情報:\n")
+            out.writelines(f"- {cell_range}\n" for cell_range in merged_cells)
+
+        # セルデータの抽出
+        if columnar:
+            out.write("### セルデータ (セル\t値\t書式ID):\n")
+        else:
+            out.write("### セルデータ:\n")
+            out.write("| セル | 値 | 書式 |\n")
+            out.write("|-----|----|--------|\n")
+
+        for row in sheet.iter_rows():
+            lines = []
+            for cell in row:
+                # セルが空でない場合のみ処理（読み取り専用モードの EmptyCell は value が None）
+                if cell.value is None:
+                    continue
+                cell_addr = f"{cell.column_letter}{cell.row}"
+                format_str = resolver.format_of(cell)
+                if columnar:
+                    cell_value = str(cell.value).replace("\t", " ").replace("\n", " ")
+                    lines.append(f"{cell_addr}\t{cell_value}\t{resolver.legend_id(format_str)}\n")
+                else:
+                    lines.append(f"| {cell_addr} | {cell.value} | {format_str} |\n")
+            if lines:
+                out.writelines(lines)
+                cell_count += len(lines)
+
+    if columnar and resolver.legend:
+        out.write("## 書式一覧:\n")
+        out.writelines(f"- {style_id}: {format_str}\n" for format_str, style_id in resolver.legend.items())
+    return cell_count
+
+def extract_to_file(excel_file: str, out_path: str, extract_format: str = "markdown", workbook: Optional[object] = None) -> int:
+    """
+    セルデータを out_path に書き出し、出力したセル数を返す。
+    解析済みのワークブックが渡されない場合は読み取り専用モードでストリーミングする
+    """
+    close_after = workbook is None
+    if workbook is None:
+        workbook = openpyxl.load_workbook(excel_file, read_only=True)
+    try:
+        with open(out_path, "w", encoding="utf-8") as out:
+            cell_count = write_cell_table(workbook, out, extract_format)
+    finally:
+        if close_after:
+            workbook.close()
+    logger.info(f"セルデータを抽出しました ({extract_format}, {cell_count}セル): {out_path}")
+    return cell_count
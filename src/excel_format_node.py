@@ -1,11 +1,35 @@
+import logging
 from state import State
-from understand_format import build_workflow, ExcelFormFields, ValidationResult
+from understand_format import build_workflow, ExcelFormFields, ValidationResult, FORMAT_LLM_MODEL, FORMAT_PROMPT_VERSION
+import format_cache
+import progress
+from workbook_session import session_scope
+
+logger = logging.getLogger(__name__)
 
 def run_excel_format_workflow_node(state: State) -> dict:
     """
     StateからExcelファイルパス・出力先・反復回数を取得し、Excel入力欄特定ワークフローを実行。
     結果（最終JSONや構造化データ）をStateに格納して返す。
+    同じテンプレート・プロンプト・モデルの結果がキャッシュにあればサブグラフを実行せずに返す。
     """
+    cache_key = format_cache.compute_cache_key(
+        state.excel_file,
+        f"{FORMAT_PROMPT_VERSION}:{FORMAT_LLM_MODEL}:{state.excel_max_iterations}:{state.excel_extract_format}:{state.excel_render_backend}"
+    )
+    if state.refresh_format_cache:
+        format_cache.invalidate(cache_key)
+    else:
+        cached = format_cache.load(cache_key)
+        if cached:
+            logger.info(f"入力欄キャッシュにヒットしました: {cache_key}")
+            progress.publish("format_finished", status="完了", cached=True)
+            return {
+                "excel_format_result": cached["estimated_fields"],
+                "excel_format_json_path": cached["final_json"],
+                "highlighted_captures": cached["highlighted_captures"]
+            }
+
     # 子グラフの初期状態を作成
     initial_state = {
         "excel_file": state.excel_file,
@@ -23,15 +47,48 @@ def run_excel_format_workflow_node(state: State) -> dict:
         "validation_status": "OK",
         "final_json": "",
         "status": "進行中",
-        "error_message": ""
+        "error_message": "",
+        "render_backend": state.excel_render_backend,
+        "extract_format": state.excel_extract_format,
+        "sheet_names": [],
+        "original_sheet_captures": {},
+        "sheet_fields": {},
+        "dirty_sheets": [],
+        "sheet_captures": {},
+        "sheet_verdicts": {}
     }
     # 子グラフを構築・実行
+    # ワークブックセッションは実行の終了時（失敗時も）に解放する
     workflow = build_workflow()
     app = workflow.compile()
-    result = app.invoke(initial_state)
+    with session_scope(state.excel_file):
+        result = app.invoke(initial_state)
+    progress.publish(
+        "format_finished",
+        status=result.get("status"),
+        cached=False,
+        iterations=result.get("current_iteration"),
+        error=result.get("error_message") or None,
+    )
+
+    # 正常に完了した結果のみキャッシュする
+    if result.get("status") == "完了":
+        cached = format_cache.store(
+            cache_key,
+            result.get("estimated_fields", {}),
+            result.get("final_json", ""),
+            result.get("highlighted_captures", [])
+        )
+        if cached:
+            return {
+                "excel_format_result": cached["estimated_fields"],
+                "excel_format_json_path": cached["final_json"],
+                "highlighted_captures": cached["highlighted_captures"]
+            }
+
     # Stateに結果を格納して返す
     return {
         "excel_format_result": result.get("estimated_fields", {}),
         "excel_format_json_path": result.get("final_json", ""),
         "highlighted_captures": result.get("highlighted_captures", "")
-    } 
\ No newline at end of file
+    }
@@ -0,0 +1,211 @@
+"""
+Excelフォーマットへの一括書き込み
+
+テンプレートを1回だけ読み込み、全てのセルの書き込みをシート・行・列の順にまとめて適用して、
+出力先に直接保存する（テンプレートのコピーと再読み込みは行わない）。
+    - セル番号は "C3" のほか "Sheet2!C3"・"'監査 結果'!C3" のようにシートを指定できる
+      （シートの指定が無い場合はアクティブシート）
+    - "B5:B20" のような範囲や values（複数の値）を指定すると、表の行に上から順に記入する
+    - 数値・パーセント・日付の文字列は数値・日付としてセルに書き込む（EXCEL_WRITE_NATIVE_TYPES）。
+      テンプレートで表示形式が設定されているセルはその形式を使い、文字列（@）のセルには文字列のまま書き込む
+結合セルの左上以外のセルへの書き込みは、結合範囲の左上のセルに書き込む。
+"""
+
+import datetime
+import logging
+import os
+import re
+import tempfile
+import time
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import openpyxl
+from openpyxl.cell.cell import MergedCell
+from openpyxl.utils.cell import range_boundaries
+
+from config import EXCEL_WRITE_NATIVE_TYPES
+from workbook_session import MAX_COLUMN, MAX_ROW, merged_anchor
+
+logger = logging.getLogger(__name__)
+
+# 先頭が0の数字（コード・番号）と15桁を超える数字（精度が失われる）は文字列のまま書き込む
+NUMBER_PATTERN = re.compile(r"^[+-]?(0|[1-9]\d{0,14}|[1-9]\d{0,2}(,\d{3}){1,4})(\.\d+)?$")
+PERCENT_PATTERN = re.compile(r"^([+-]?\d+(\.\d+)?)\s*[%％]$")
+# (strptime の書式, セルの表示形式)
+DATE_FORMATS = [
+    ("%Y-%m-%d", "yyyy-mm-dd"),
+    ("%Y/%m/%d", "yyyy/mm/dd"),
+    ("%Y年%m月%d日", 'yyyy"年"m"月"d"日"'),
+    ("%Y-%m-%d %H:%M", "yyyy-mm-dd hh:mm"),
+    ("%Y-%m-%d %H:%M:%S", "yyyy-mm-dd hh:mm:ss"),
+    ("%Y-%m-%dT%H:%M:%S", "yyyy-mm-dd hh:mm:ss"),
+    ("%Y/%m/%d %H:%M", "yyyy/mm/dd hh:mm"),
+]
+
+class CellWrite(NamedTuple):
+    sheet: str
+    row: int
+    column: int
+    value: Any
+    number_format: Optional[str]
+    # 変換前の値（表示形式が文字列（@）のセルにはこちらを書き込む）
+    raw: Any
+
+def convert_value(value: Any) -> Tuple[Any, Optional[str]]:
+    """
+    文字列を数値・日付に変換し (値, 表示形式) を返す（表示形式が不要な場合は None）。
+    空文字は空のセル（None）、変換できない文字列はそのまま返す
+    """
+    if not isinstance(value, str):
+        return value, None
+    text = value.strip()
+    if not text:
+        return None, None
+    if not EXCEL_WRITE_NATIVE_TYPES:
+        return value, None
+    if NUMBER_PATTERN.match(text):
+        number = text.replace(",", "")
+        if "." in number:
+            return float(number), None
+        return int(number), ("#,##0" if "," in text else None)
+    match = PERCENT_PATTERN.match(text)
+    if match:
+        decimals = len(match.group(2)) - 1 if match.group(2) else 0
+        return float(match.group(1)) / 100, "0." + "0" * decimals + "%" if decimals else "0%"
+    for date_format, number_format in DATE_FORMATS:
+        try:
+            parsed = datetime.datetime.strptime(text, date_format)
+        except ValueError:
+            continue
+        if "%H" not in date_format:
+            return parsed.date(), number_format
+        return parsed, number_format
+    return value, None
+
+def parse_address(address: str) -> Tuple[Optional[str], Tuple[int, int, int, int]]:
+    """
+    セル番号を (シート名, (min_col, min_row, max_col, max_row)) に分解する（シートの指定が無い場合は None）。
+    不正なセル番号の場合は ValueError
+    """
+    sheet_name, _, cell_range = address.strip().rpartition("!")
+    if sheet_name.startswith("'") and sheet_name.endswith("'") and len(sheet_name) >= 2:
+        sheet_name = sheet_name[1:-1].replace("''", "'")
+    cell_range = cell_range.replace("$", "").strip().upper()
+    try:
+        min_col, min_row, max_col, max_row = range_boundaries(cell_range)
+    except (TypeError, ValueError):
+        raise ValueError(f"セル番号として解釈できません: {address}")
+    if None in (min_col, min_row, max_col, max_row) or not (
+        1 <= min_row <= max_row <= MAX_ROW and 1 <= min_col <= max_col <= MAX_COLUMN
+    ):
+        raise ValueError(f"セル番号として解釈できません: {address}")
+    return sheet_name or None, (min_col, min_row, max_col, max_row)
+
+def expand(address: str, value: Any = None, values: Optional[List[Any]] = None, default_sheet: Optional[str] = None) -> List[CellWrite]:
+    """
+    1件の書き込み指定をセルごとの書き込みに展開する。
+      - values が無い場合: 範囲の全てのセルに value を書き込む
+      - values があり範囲の場合: 範囲のセルに行ごと（左から右、上から下）に順に書き込む（範囲を超える値は無視）
+      - values がありセル1つの場合: そのセルから下の行に順に書き込む
+    """
+    sheet_name, (min_col, min_row, max_col, max_row) = parse_address(address)
+    sheet_name = sheet_name or default_sheet
+    if not values:
+        converted, number_format = convert_value(value)
+        return [
+            CellWrite(sheet_name, row, col, converted, number_format, value)
+            for row in range(min_row, max_row + 1)
+            for col in range(min_col, max_col + 1)
+        ]
+    if (min_col, min_row) == (max_col, max_row):
+        max_row = min(min_row + len(values) - 1, MAX_ROW)
+    cells = [(row, col) for row in range(min_row, max_row + 1) for col in range(min_col, max_col + 1)]
+    if len(values) > len(cells):
+        logger.warning(f"{address} の範囲（{len(cells)}セル）を超える {len(values) - len(cells)} 件の値は書き込みません")
+    writes = []
+    for (row, col), item in zip(cells, values):
+        converted, number_format = convert_value(item)
+        writes.append(CellWrite(sheet_name, row, col, converted, number_format, item))
+    return writes
+
+def _item_fields(item: Any) -> Tuple[str, Any, Optional[List[Any]]]:
+    # CellValue（pydantic）・dict のどちらも受け付ける
+    if isinstance(item, dict):
+        return item["cell_id"], item.get("value"), item.get("values")
+    return item.cell_id, getattr(item, "value", None), getattr(item, "values", None)
+
+def write_cells(template_path: str, output_path: str, items: Iterable[Any]) -> Dict[str, Any]:
+    """
+    テンプレートを読み込み、items（cell_id・value・values を持つ CellValue または dict）を書き込んで
+    output_path に保存する。解釈できないセル番号・存在しないシートの指定は警告してスキップする。
+    戻り値は書き込んだセル数・シート・スキップした指定・所要時間
+    """
+    started = time.perf_counter()
+    keep_vba = os.path.splitext(template_path)[1].lower() == ".xlsm"
+    workbook = openpyxl.load_workbook(template_path, keep_vba=keep_vba)
+    loaded = time.perf_counter()
+    default_sheet = workbook.active.title
+
+    by_sheet: Dict[str, Dict[Tuple[int, int], CellWrite]] = defaultdict(dict)
+    skipped = []
+    for item in items:
+        cell_id, value, values = _item_fields(item)
+        try:
+            writes = expand(cell_id, value, values, default_sheet)
+        except ValueError as e:
+            logger.warning(f"{e}（スキップします）")
+            skipped.append(cell_id)
+            continue
+        if writes and writes[0].sheet not in workbook.sheetnames:
+            logger.warning(f"シート '{writes[0].sheet}' が存在しないため {cell_id} をスキップします")
+            skipped.append(cell_id)
+            continue
+        for write in writes:
+            # 同じセルへの指定が複数ある場合は後の指定を優先する
+            by_sheet[write.sheet][(write.row, write.column)] = write
+
+    cell_count = 0
+    for sheet_name, writes in by_sheet.items():
+        sheet = workbook[sheet_name]
+        for (row, col) in sorted(writes):
+            write = writes[(row, col)]
+            cell = sheet.cell(row=row, column=col)
+            if isinstance(cell, MergedCell):
+                cell = sheet.cell(*merged_anchor(sheet, row, col))
+            # 値を代入すると日付の表示形式が設定されるため、テンプレートの表示形式は代入前に読む
+            template_format = cell.number_format
+            if template_format == "@" and isinstance(write.raw, str) and write.raw.strip():
+                # 表示形式が文字列のセルには変換せずに書き込む
+                cell.value = write.raw
+            else:
+                cell.value = write.value
+                # テンプレートで表示形式が設定されているセルはその形式を使う
+                if write.number_format and template_format == "General":
+                    cell.number_format = write.number_format
+            cell_count += 1
+
+    # 書き込み途中のファイルが残らないよう、同じフォルダの一時ファイルに保存してから置き換える
+    output_dir = os.path.dirname(os.path.abspath(output_path))
+    fd, tmp_path = tempfile.mkstemp(dir=output_dir, suffix=os.path.splitext(output_path)[1])
+    os.close(fd)
+    try:
+        workbook.save(tmp_path)
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    stats = {
+        "cells": cell_count,
+        "sheets": sorted(by_sheet),
+        "skipped": skipped,
+        "load_seconds": round(loaded - started, 3),
+        "total_seconds": round(time.perf_counter() - started, 3),
+    }
+    logger.info(
+        f"Excelファイルに書き込みました: {output_path} ({cell_count}セル、シート: {', '.join(stats['sheets']) or 'なし'}、"
+        f"読み込み {stats['load_seconds']:.3f}秒、合計 {stats['total_seconds']:.3f}秒)"
+    )
+    return stats
@@ -0,0 +1,134 @@
+"""
+Excel入力欄特定ワークフローの結果キャッシュ
+
+テンプレートのバイト列のSHA-256とプロンプト/モデルのバージョンをキーとして、
+final_form_definition.json・final_structured_form_definition.json・ハイライト済みキャプチャ・
+estimated_fields をディスクに保存する。ヒットした場合はサブグラフを実行せずに結果を返す。
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from config import FORMAT_CACHE_DIR, FORMAT_CACHE_MAX_BYTES
+
+logger = logging.getLogger(__name__)
+
+ENTRY_FILE = "entry.json"
+
+def compute_cache_key(excel_file: str, version: str) -> str:
+    """
+    ワークブックのバイト列のSHA-256とバージョン文字列からキャッシュキーを生成する
+    """
+    digest = hashlib.sha256()
+    with open(excel_file, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return hashlib.sha256(f"{digest.hexdigest()}:{version}".encode("utf-8")).hexdigest()
+
+def _entry_dir(key: str) -> Path:
+    return FORMAT_CACHE_DIR / key
+
+def _dir_size(path: Path) -> int:
+    return sum(p.stat().st_size for p in path.rglob("*") if p.is_file())
+
+def load(key: str) -> Optional[Dict]:
+    """
+    キャッシュエントリを読み込む。存在しない・破損している場合は None を返す
+    """
+    entry_dir = _entry_dir(key)
+    entry_file = entry_dir / ENTRY_FILE
+    if not entry_file.exists():
+        return None
+    try:
+        with open(entry_file, "r", encoding="utf-8") as f:
+            entry = json.load(f)
+        paths = [entry["final_json"], entry["final_structured_json"], *entry["highlighted_captures"]]
+        if not all((entry_dir / p).exists() for p in paths):
+            raise FileNotFoundError("キャッシュエントリのファイルが不足しています")
+    except Exception as e:
+        logger.warning(f"入力欄キャッシュ {key} が破損しているため削除します: {e}")
+        invalidate(key)
+        return None
+
+    # LRU判定用に最終アクセス時刻を更新
+    os.utime(entry_file)
+    return {
+        "estimated_fields": entry["estimated_fields"],
+        "final_json": str(entry_dir / entry["final_json"]),
+        "final_structured_json": str(entry_dir / entry["final_structured_json"]),
+        "highlighted_captures": [str(entry_dir / p) for p in entry["highlighted_captures"]],
+    }
+
+def store(key: str, estimated_fields: Dict[str, str], final_json: str, highlighted_captures: List[str]) -> Optional[Dict]:
+    """
+    ワークフローの最終結果をキャッシュに保存し、保存後のエントリ（load と同じ形式）を返す
+    """
+    FORMAT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    final_structured_json = Path(final_json).with_name("final_structured_form_definition.json")
+    tmp_dir = Path(tempfile.mkdtemp(prefix=f".{key[:12]}_", dir=FORMAT_CACHE_DIR))
+    try:
+        shutil.copy2(final_json, tmp_dir / "final_form_definition.json")
+        shutil.copy2(final_structured_json, tmp_dir / "final_structured_form_definition.json")
+        (tmp_dir / "captures").mkdir()
+        capture_names = []
+        for idx, capture in enumerate(highlighted_captures, 1):
+            name = f"captures/sheet{idx}{Path(capture).suffix}"
+            shutil.copy2(capture, tmp_dir / name)
+            capture_names.append(name)
+        with open(tmp_dir / ENTRY_FILE, "w", encoding="utf-8") as f:
+            json.dump({
+                "key": key,
+                "created_at": time.time(),
+                "estimated_fields": estimated_fields,
+                "final_json": "final_form_definition.json",
+                "final_structured_json": "final_structured_form_definition.json",
+                "highlighted_captures": capture_names,
+            }, f, ensure_ascii=False, indent=2)
+
+        # 同じキーのエントリを置き換える
+        invalidate(key)
+        os.replace(tmp_dir, _entry_dir(key))
+    except Exception as e:
+        logger.warning(f"入力欄キャッシュ {key} の保存に失敗しました: {e}")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return None
+
+    logger.info(f"入力欄キャッシュを保存しました: {_entry_dir(key)}")
+    evict()
+    return load(key)
+
+def invalidate(key: Optional[str] = None) -> None:
+    """
+    指定したキーのエントリを削除する。key を省略した場合はキャッシュ全体を削除する
+    """
+    target = _entry_dir(key) if key else FORMAT_CACHE_DIR
+    if target.exists():
+        shutil.rmtree(target, ignore_errors=True)
+        logger.info(f"入力欄キャッシュを削除しました: {target}")
+
+def evict(max_bytes: int = FORMAT_CACHE_MAX_BYTES) -> None:
+    """
+    キャッシュの合計サイズが max_bytes 以下になるまで、最終アクセスが古いエントリから削除する
+    """
+    if not FORMAT_CACHE_DIR.exists():
+        return
+    entries = []
+    for entry_dir in FORMAT_CACHE_DIR.iterdir():
+        entry_file = entry_dir / ENTRY_FILE
+        if entry_dir.is_dir() and entry_file.exists():
+            entries.append((entry_file.stat().st_mtime, _dir_size(entry_dir), entry_dir))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry_dir in sorted(entries):
+        if total <= max_bytes:
+            break
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        total -= size
+        logger.info(f"入力欄キャッシュのエントリを削除しました（容量上限）: {entry_dir.name}")
@@ -11,18 +11,14 @@ logging.basicConfig(
 """Module for defining the agent's workflow graph and human interaction nodes."""
 
 from langgraph.graph import StateGraph
+from langgraph.types import Send
 from state import State
-from react_node import react_node
+from react_node import index_samples_node, pdf_render_options, react_node, run_sample_index, sample_worker_node
+import sample_index
 from update_format_node import update_format_node
 from excel_format_node import run_excel_format_workflow_node
 
-# Define a new graph
-workflow = StateGraph(State)
-
-# Add the node to the graph. This node will interrupt when it is invoked.
-workflow.add_node("react_node", react_node)
-workflow.add_node("update_format_node", update_format_node)
-workflow.add_node("run_excel_format_workflow_node", run_excel_format_workflow_node)
+logger = logging.getLogger(__name__)
 
 # Define the conditional edge function
 def should_continue(state: State) -> str:
@@ -32,21 +28,94 @@ def should_continue(state: State) -> str:
     else:
         return "continue"
 
-# Set the entrypoint as `react_node`
-workflow.add_edge("__start__", "react_node")
-# Add the conditional edge
-workflow.add_conditional_edges(
-    "react_node",
-    should_continue,
-    {
-        "continue": "react_node",  # Loop back to react_node if should_continue returns "continue"
-        "end": "run_excel_format_workflow_node"  # "end" の場合に run_excel_format_workflow_node へ遷移
-    }
-)
+def completed_samples(state: State) -> set:
+    """Sample folders (or iter_ids, for entries recorded without a name) that already have a result in iter_data."""
+    done = set()
+    for item in state.iter_data:
+        if isinstance(item, dict):
+            done.add(item.get("sample") or item.get("iter_id"))
+    return done
+
+def dispatch_samples(state: State):
+    """Routes to the sequential loop, or fans out one `Send` per sample folder in parallel mode.
+
+    Samples that already have a result in `iter_data` (e.g. when a crashed run is started again on
+    the same thread) are not dispatched again.
+    """
+    if not state.sample_data_path:
+        return "react_node"
+    index = run_sample_index(state)
+    sample_dirs = sample_index.sample_names(index)
+    if not state.parallel_samples:
+        # The sequential loop resumes from iteration_count; nothing is left once every sample has run
+        if sample_dirs and state.iteration_count >= len(sample_dirs):
+            return "run_excel_format_workflow_node"
+        return "react_node"
+    done = completed_samples(state)
+    pending = [
+        (iter_id, sample_name)
+        for iter_id, sample_name in enumerate(sample_dirs, 1)
+        if sample_name not in done and iter_id not in done
+    ]
+    if len(pending) < len(sample_dirs):
+        logger.info(f"Skipping {len(sample_dirs) - len(pending)} sample(s) already in iter_data")
+    if not pending:
+        return "run_excel_format_workflow_node"
+    return [
+        Send("sample_worker_node", {
+            "procedure": state.procedure,
+            "sample_data_path": state.sample_data_path,
+            "sample_name": sample_name,
+            "files": sample_index.sample_files(index, iter_id),
+            "iter_id": iter_id,
+            "sample_count": len(sample_dirs),
+            "pdf_options": pdf_render_options(state),
+            "evidence_mode": state.evidence_mode,
+        })
+        for iter_id, sample_name in pending
+    ]
+
+def build_graph(checkpointer=None):
+    """Build and compile the workflow.
+
+    The LangGraph server supplies its own checkpointer, so `graph` below is compiled without one.
+    Local and batch runs pass a durable checkpointer (see local_runner.py) to be able to resume.
+    """
+    workflow = StateGraph(State)
+
+    # Add the node to the graph. This node will interrupt when it is invoked.
+    workflow.add_node("index_samples_node", index_samples_node)
+    workflow.add_node("react_node", react_node)
+    workflow.add_node("sample_worker_node", sample_worker_node)
+    workflow.add_node("update_format_node", update_format_node)
+    workflow.add_node("run_excel_format_workflow_node", run_excel_format_workflow_node)
+
+    # Index the sample folders once, then run `react_node` (sequential) or `sample_worker_node` x N (fan-out)
+    workflow.add_edge("__start__", "index_samples_node")
+    workflow.add_conditional_edges(
+        "index_samples_node",
+        dispatch_samples,
+        ["react_node", "sample_worker_node", "run_excel_format_workflow_node"]
+    )
+    # Add the conditional edge
+    workflow.add_conditional_edges(
+        "react_node",
+        should_continue,
+        {
+            "continue": "react_node",  # Loop back to react_node if should_continue returns "continue"
+            "end": "run_excel_format_workflow_node"  # "end" の場合に run_excel_format_workflow_node へ遷移
+        }
+    )
+
+    # All fanned-out samples join before the Excel format workflow
+    workflow.add_edge("sample_worker_node", "run_excel_format_workflow_node")
+
+    # Add edge from run_excel_format_workflow_node to update_format_node
+    workflow.add_edge("run_excel_format_workflow_node", "update_format_node")
 
-# Add edge from run_excel_format_workflow_node to update_format_node
-workflow.add_edge("run_excel_format_workflow_node", "update_format_node")
+    # Compile the workflow into an executable graph
+    compiled = workflow.compile(checkpointer=checkpointer)
+    compiled.name = "Agent Inbox Example"  # This defines the custom name in LangSmith
+    return compiled
 
-# Compile the workflow into an executable graph
-graph = workflow.compile()
-graph.name = "Agent Inbox Example"  # This defines the custom name in LangSmith
+graph = build_graph()
@@ -0,0 +1,214 @@
+"""
+ビジョンモデルに送る画像の前処理
+
+Excelのキャプチャ・PDFのページ画像・アップロードされた画像を送信前に次の手順で小さくする。
+    1. 余白（周囲の単色部分）の切り取り（キャプチャ用。印刷範囲の外側の余白を除く）
+    2. モデルごとの上限解像度への縮小（モデル側で縮小される分を送信前に行う）
+    3. タイル（512px）・パッチ（32px）の境界をわずかに超える場合は、数が1つ減るサイズまで縮小
+    4. JPEG / WebP への再エンコード（PNGの方が小さい場合はPNG、元より大きくなる場合は元のデータを使う）
+データURLのMIMEタイプは実際の画像形式に合わせる。削減できたバイト数・トークン数はログと stats() で確認できる。
+"""
+
+import base64
+import hashlib
+import io
+import logging
+import math
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Tuple
+
+from PIL import Image, ImageChops
+
+from config import IMAGE_PREP_ENABLED, IMAGE_PREP_FORMAT, IMAGE_PREP_QUALITY
+from llm_registry import model_name
+
+logger = logging.getLogger(__name__)
+
+# モデルごとの画像のトークン計算方式
+#   tile:  長辺 max_side・短辺 short_side に縮小後、512pxタイル1枚あたり per_tile + base
+#   patch: 32pxパッチ数（上限 max_patches）× multiplier
+MODEL_PROFILES = {
+    "gpt-4.1-mini": {"kind": "patch", "unit": 32, "max_patches": 1536, "multiplier": 1.62},
+    "gpt-4.1-nano": {"kind": "patch", "unit": 32, "max_patches": 1536, "multiplier": 2.46},
+    "o4-mini": {"kind": "patch", "unit": 32, "max_patches": 1536, "multiplier": 1.72},
+    "gpt-4.1": {"kind": "tile", "unit": 512, "max_side": 2048, "short_side": 768, "base": 85, "per_tile": 170},
+    "gpt-4o": {"kind": "tile", "unit": 512, "max_side": 2048, "short_side": 768, "base": 85, "per_tile": 170},
+    "gpt-4o-mini": {"kind": "tile", "unit": 512, "max_side": 2048, "short_side": 768, "base": 2833, "per_tile": 5667},
+}
+DEFAULT_PROFILE = MODEL_PROFILES["gpt-4.1"]
+# タイル（パッチ）境界をこの割合以内で超える場合は、タイル数が減るサイズまで縮小する
+TILE_SLACK = 0.15
+# 余白とみなす背景色との差の閾値
+AUTOCROP_THRESHOLD = 12
+AUTOCROP_MARGIN = 8
+
+MIME_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp", "GIF": "image/gif"}
+
+@dataclass
+class PreparedImage:
+    data: str  # base64
+    mime_type: str
+    size: Tuple[int, int]
+    original_bytes: int
+    bytes: int
+    original_tokens: int
+    tokens: int
+
+    @property
+    def data_url(self) -> str:
+        return f"data:{self.mime_type};base64,{self.data}"
+
+_totals = {"images": 0, "original_bytes": 0, "bytes": 0, "original_tokens": 0, "tokens": 0}
+_prepared: "OrderedDict[tuple, PreparedImage]" = OrderedDict()
+_lock = threading.Lock()
+# 同じ画像（同じ設定）の前処理結果を使い回す件数
+_MEMO_ENTRIES = 64
+
+def _profile(model: str) -> dict:
+    return MODEL_PROFILES.get(model, DEFAULT_PROFILE)
+
+def _fit_size(width: int, height: int, profile: dict) -> Tuple[int, int]:
+    """モデル側で行われる縮小を適用したサイズ"""
+    if profile["kind"] == "patch":
+        unit = profile["unit"]
+        if math.ceil(width / unit) * math.ceil(height / unit) <= profile["max_patches"]:
+            return width, height
+        # パッチ数が上限に収まるように縮小し、幅・高さをパッチの整数倍に揃える
+        scale = math.sqrt(unit * unit * profile["max_patches"] / (width * height))
+        scale *= min(
+            math.floor(width * scale / unit) / (width * scale / unit),
+            math.floor(height * scale / unit) / (height * scale / unit),
+        )
+        return max(1, int(width * scale)), max(1, int(height * scale))
+    scale = min(1.0, profile["max_side"] / max(width, height))
+    short_side = min(width, height) * scale
+    if short_side > profile["short_side"]:
+        scale *= profile["short_side"] / short_side
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+def estimate_tokens(width: int, height: int, model: str) -> int:
+    """high detail の画像の入力トークン数の見積もり"""
+    profile = _profile(model)
+    fit_width, fit_height = _fit_size(width, height, profile)
+    units = math.ceil(fit_width / profile["unit"]) * math.ceil(fit_height / profile["unit"])
+    if profile["kind"] == "patch":
+        return math.ceil(min(units, profile["max_patches"]) * profile["multiplier"])
+    return profile["base"] + profile["per_tile"] * units
+
+def _target_size(width: int, height: int, profile: dict) -> Tuple[int, int]:
+    """送信する画像のサイズ（モデル側の縮小を先に行い、タイル境界をわずかに超える分を削る）"""
+    fit_width, fit_height = _fit_size(width, height, profile)
+    unit = profile["unit"]
+    scale = 1.0
+    for side in (fit_width, fit_height):
+        units = math.ceil(side / unit)
+        overshoot = side - (units - 1) * unit
+        if units > 1 and overshoot <= unit * TILE_SLACK:
+            scale = min(scale, (units - 1) * unit / side)
+    if scale < 1.0 - TILE_SLACK:
+        scale = 1.0
+    return max(1, int(fit_width * scale)), max(1, int(fit_height * scale))
+
+def _autocrop(image: Image.Image) -> Image.Image:
+    """左上の画素の色を背景とみなし、周囲の余白を切り取る"""
+    rgb = image.convert("RGB")
+    background = Image.new("RGB", rgb.size, rgb.getpixel((0, 0)))
+    diff = ImageChops.difference(rgb, background).convert("L").point(lambda value: 255 if value > AUTOCROP_THRESHOLD else 0)
+    bbox = diff.getbbox()
+    if not bbox:
+        return image
+    left, top, right, bottom = bbox
+    return image.crop((
+        max(0, left - AUTOCROP_MARGIN),
+        max(0, top - AUTOCROP_MARGIN),
+        min(image.width, right + AUTOCROP_MARGIN),
+        min(image.height, bottom + AUTOCROP_MARGIN),
+    ))
+
+def _encode(image: Image.Image, image_format: str) -> Tuple[bytes, str]:
+    buffer = io.BytesIO()
+    if image_format == "png":
+        image.save(buffer, format="PNG", optimize=True)
+        return buffer.getvalue(), "image/png"
+    if image.mode not in ("RGB", "L"):
+        # 透過部分は白で塗りつぶす
+        flattened = Image.new("RGB", image.size, "white")
+        flattened.paste(image, mask=image.convert("RGBA").getchannel("A"))
+        image = flattened
+    if image_format == "webp":
+        image.save(buffer, format="WEBP", quality=IMAGE_PREP_QUALITY, method=4)
+        return buffer.getvalue(), "image/webp"
+    image.save(buffer, format="JPEG", quality=IMAGE_PREP_QUALITY, optimize=True)
+    return buffer.getvalue(), "image/jpeg"
+
+def prepare_image(image_base64: str, model: str, autocrop: bool = False) -> PreparedImage:
+    """base64の画像を前処理し、送信用の PreparedImage を返す"""
+    memo_key = (hashlib.sha256(image_base64.encode("ascii")).hexdigest(), model, autocrop, IMAGE_PREP_FORMAT)
+    with _lock:
+        prepared = _prepared.get(memo_key)
+        if prepared is not None:
+            _prepared.move_to_end(memo_key)
+            return prepared
+
+    raw = base64.b64decode(image_base64)
+    with Image.open(io.BytesIO(raw)) as source:
+        source.load()
+        original_mime = MIME_TYPES.get(source.format, "image/png")
+        original_size = source.size
+        original_tokens = estimate_tokens(*original_size, model)
+        prepared = PreparedImage(
+            image_base64, original_mime, original_size, len(raw), len(raw), original_tokens, original_tokens
+        )
+        if IMAGE_PREP_ENABLED:
+            image = _autocrop(source) if autocrop else source
+            target = _target_size(*image.size, _profile(model))
+            if target != image.size:
+                image = image.resize(target, Image.LANCZOS)
+            encoded, mime_type = _encode(image, IMAGE_PREP_FORMAT)
+            if IMAGE_PREP_FORMAT != "png" and source.format == "PNG":
+                # 単色の多いキャプチャ等はPNGの方が小さいことがあるため、小さい方を使う
+                encoded_png, mime_png = _encode(image, "png")
+                if len(encoded_png) < len(encoded):
+                    encoded, mime_type = encoded_png, mime_png
+            # 縮小も切り取りもしておらず、再エンコードで大きくなる場合は元のデータを使う
+            if image.size != original_size or len(encoded) < len(raw):
+                prepared = PreparedImage(
+                    base64.b64encode(encoded).decode("utf-8"), mime_type, image.size,
+                    len(raw), len(encoded), original_tokens, estimate_tokens(*image.size, model),
+                )
+
+    with _lock:
+        _totals["images"] += 1
+        _totals["original_bytes"] += prepared.original_bytes
+        _totals["bytes"] += prepared.bytes
+        _totals["original_tokens"] += prepared.original_tokens
+        _totals["tokens"] += prepared.tokens
+        _prepared[memo_key] = prepared
+        while len(_prepared) > _MEMO_ENTRIES:
+            _prepared.popitem(last=False)
+    logger.info(
+        f"画像を前処理しました: {original_size[0]}x{original_size[1]} -> {prepared.size[0]}x{prepared.size[1]} "
+        f"({prepared.original_bytes:,} -> {prepared.bytes:,} bytes, "
+        f"{prepared.original_tokens} -> {prepared.tokens} tokens, {prepared.mime_type})"
+    )
+    return prepared
+
+def image_data_url(image_base64: str, role: str, autocrop: bool = False) -> str:
+    """llm_registry のロールのモデル向けに前処理した画像のデータURLを返す"""
+    return prepare_image(image_base64, model_name(role), autocrop).data_url
+
+def image_file_data_url(image_path: str, role: str, autocrop: bool = False) -> str:
+    """画像ファイルを読み込み、前処理した画像のデータURLを返す"""
+    with open(image_path, "rb") as image_file:
+        return image_data_url(base64.b64encode(image_file.read()).decode("utf-8"), role, autocrop)
+
+def stats() -> dict:
+    """前処理した画像の累計（バイト数・推定トークン数の削減量）"""
+    with _lock:
+        return {
+            **_totals,
+            "saved_bytes": _totals["original_bytes"] - _totals["bytes"],
+            "saved_tokens": _totals["original_tokens"] - _totals["tokens"],
+        }
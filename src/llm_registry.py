@@ -0,0 +1,240 @@
+"""
+用途（ロール）ごとに設定済みのChatOpenAIを払い出すプロセス共通のレジストリ
+
+呼び出しのたびにChatOpenAIを生成すると毎回新しいHTTPクライアントが作られ、接続の再利用や
+TLSセッションの再開ができない。ここではロールごとに1つずつ、コネクションプール付きの
+httpx.Client / httpx.AsyncClient（h2 がインストールされていればHTTP/2）を保持して使い回す。
+
+ロール: estimator, validator, corrector, writer, agent, vision
+（モデル・タイムアウト・同時接続数は config.LLM_ROLES で設定する）
+払い出すモデルは、メッセージ内のブロブ参照（message_blobs.py）を送信時に画像のデータURLに戻す。
+use_transport() で全ロールの通信先を差し替えられる（ネットワークを使わないベンチマーク用）。
+"""
+
+import logging
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+import httpx
+from langchain_openai import ChatOpenAI
+
+from config import LLM_KEEPALIVE_SECONDS, LLM_ROLES
+from message_blobs import restore_messages
+from rate_limit import run_sync
+
+logger = logging.getLogger(__name__)
+
+try:  # HTTP/2 は h2 パッケージ（httpx[http2]）がある場合のみ有効にする
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+class _PoolMetrics:
+    """トランスポートのラッパー（_MeteredTransport）で集計するロールごとのリクエスト統計"""
+
+    def __init__(self, role: str):
+        self.role = role
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.total_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def _started(self) -> float:
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        return time.perf_counter()
+
+    def _finished(self, started: float, failed: bool) -> None:
+        # 接続エラー・タイムアウト（例外）の場合も必ず呼び出す
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.in_flight -= 1
+            self.total_seconds += elapsed
+            if failed:
+                self.errors += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "errors": self.errors,
+                "in_flight": self.in_flight,
+                "peak_in_flight": self.peak_in_flight,
+                "mean_seconds": round(self.total_seconds / self.requests, 3) if self.requests else None,
+            }
+
+class _MeteredTransport(httpx.BaseTransport):
+    """同期トランスポートのラッパー。例外で終わったリクエストもエラーとして集計する"""
+
+    def __init__(self, transport: httpx.BaseTransport, metrics: _PoolMetrics):
+        self.transport = transport
+        self.metrics = metrics
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        started = self.metrics._started()
+        failed = True
+        try:
+            response = self.transport.handle_request(request)
+            failed = response.status_code >= 400
+            return response
+        finally:
+            self.metrics._finished(started, failed)
+
+    def close(self) -> None:
+        self.transport.close()
+
+class _AsyncMeteredTransport(httpx.AsyncBaseTransport):
+    """非同期トランスポートのラッパー。例外で終わったリクエストもエラーとして集計する"""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, metrics: _PoolMetrics):
+        self.transport = transport
+        self.metrics = metrics
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        started = self.metrics._started()
+        failed = True
+        try:
+            response = await self.transport.handle_async_request(request)
+            failed = response.status_code >= 400
+            return response
+        finally:
+            self.metrics._finished(started, failed)
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+def _open_connections(client) -> Optional[int]:
+    """プール内の接続数（httpcoreの内部構造に依存するため取得できない場合は None）"""
+    try:
+        return len(client._transport.transport._pool.connections)
+    except AttributeError:
+        return None
+
+class BlobAwareChatOpenAI(ChatOpenAI):
+    """リクエストの作成時に、メッセージ内のブロブ参照をデータURLに戻すChatOpenAI"""
+
+    def _get_request_payload(self, input_, *, stop=None, **kwargs) -> dict:
+        messages = restore_messages(self._convert_input(input_).to_messages())
+        return super()._get_request_payload(messages, stop=stop, **kwargs)
+
+class _RoleClients:
+    """1ロール分のHTTPクライアントとChatOpenAI"""
+
+    def __init__(self, role: str, settings: dict):
+        self.role = role
+        self.settings = settings
+        self.metrics = _PoolMetrics(role)
+        timeout = httpx.Timeout(settings["timeout"], connect=10.0)
+        # 同時接続数の上限がそのままロールの同時実行数の上限になる
+        limits = httpx.Limits(
+            max_connections=settings["max_connections"],
+            max_keepalive_connections=settings["max_connections"],
+            keepalive_expiry=LLM_KEEPALIVE_SECONDS,
+        )
+        transport, async_transport = _transports or (
+            httpx.HTTPTransport(http2=HTTP2_AVAILABLE, limits=limits),
+            httpx.AsyncHTTPTransport(http2=HTTP2_AVAILABLE, limits=limits),
+        )
+        self.http_client = httpx.Client(
+            http2=HTTP2_AVAILABLE, timeout=timeout, limits=limits,
+            transport=_MeteredTransport(transport, self.metrics),
+        )
+        self.http_async_client = httpx.AsyncClient(
+            http2=HTTP2_AVAILABLE, timeout=timeout, limits=limits,
+            transport=_AsyncMeteredTransport(async_transport, self.metrics),
+        )
+        self._models: Dict[tuple, ChatOpenAI] = {}
+        self._lock = threading.Lock()
+
+    def chat_model(self, temperature: Optional[float], max_retries: Optional[int]) -> ChatOpenAI:
+        key = (temperature, max_retries)
+        with self._lock:
+            model = self._models.get(key)
+            if model is None:
+                kwargs = {}
+                if temperature is not None:
+                    kwargs["temperature"] = temperature
+                if max_retries is not None:
+                    kwargs["max_retries"] = max_retries
+                model = self._models[key] = BlobAwareChatOpenAI(
+                    model=self.settings["model"],
+                    timeout=self.settings["timeout"],
+                    http_client=self.http_client,
+                    http_async_client=self.http_async_client,
+                    **kwargs,
+                )
+            return model
+
+    def close(self) -> None:
+        """同期・非同期のHTTPクライアントを閉じる（非同期クライアントは常駐イベントループで閉じる）"""
+        self.http_client.close()
+        try:
+            run_sync(self.http_async_client.aclose())
+        except Exception as e:
+            logger.warning(f"非同期HTTPクライアントを閉じられませんでした: role={self.role}, {e}")
+
+_roles: Dict[str, _RoleClients] = {}
+_roles_lock = threading.Lock()
+# 差し替え後の (同期, 非同期) トランスポート（None の場合は通常のネットワーク接続）
+_transports: Optional[Tuple[httpx.BaseTransport, httpx.AsyncBaseTransport]] = None
+
+def use_transport(transport: Optional[httpx.BaseTransport], async_transport: Optional[httpx.AsyncBaseTransport] = None) -> None:
+    """
+    全ロールのHTTPクライアントの通信先を差し替える（httpx.MockTransport 等。None で元に戻す）。
+    作成済みのクライアントは破棄し、以降の get_chat_model() から新しい通信先を使う
+    """
+    global _transports
+    with _roles_lock:
+        _transports = (transport, async_transport or transport) if transport is not None else None
+        clients = list(_roles.values())
+        _roles.clear()
+    for c in clients:
+        c.close()
+    logger.info(f"LLMの通信先を{'差し替えました' if transport is not None else '元に戻しました'}")
+
+def _role_clients(role: str) -> _RoleClients:
+    if role not in LLM_ROLES:
+        raise ValueError(f"不明なLLMロールです: {role}")
+    with _roles_lock:
+        clients = _roles.get(role)
+        if clients is None:
+            clients = _roles[role] = _RoleClients(role, LLM_ROLES[role])
+            logger.info(
+                f"LLMクライアントを作成しました: role={role}, model={clients.settings['model']}, "
+                f"http2={HTTP2_AVAILABLE}, max_connections={clients.settings['max_connections']}"
+            )
+        return clients
+
+def model_name(role: str) -> str:
+    """ロールに設定されているモデル名を返す"""
+    if role not in LLM_ROLES:
+        raise ValueError(f"不明なLLMロールです: {role}")
+    return LLM_ROLES[role]["model"]
+
+def get_chat_model(role: str, temperature: Optional[float] = None, max_retries: Optional[int] = None) -> ChatOpenAI:
+    """
+    ロールに対応する設定済みのChatOpenAIを返す（同じ引数には同じインスタンスを返す）
+    temperature / max_retries を省略した場合はChatOpenAIの既定値を使う
+    """
+    return _role_clients(role).chat_model(temperature, max_retries)
+
+def stats() -> dict:
+    """ロールごとのリクエスト数・同時実行数・プール内の接続数"""
+    with _roles_lock:
+        clients = dict(_roles)
+    return {
+        role: {
+            **c.metrics.snapshot(),
+            "model": c.settings["model"],
+            "max_connections": c.settings["max_connections"],
+            "open_connections": _open_connections(c.http_client),
+            "open_async_connections": _open_connections(c.http_async_client),
+        }
+        for role, c in clients.items()
+    }
@@ -0,0 +1,136 @@
+"""
+LangGraphサーバーを使わずにグラフを実行するローカル実行・再開
+
+チェックポイントを SQLite（WAL）の CHECKPOINT_DB_PATH に保存するため、多数のサンプルの実行が途中で
+異常終了しても、同じ thread_id で再実行すると最後のチェックポイントから再開する。
+    - 逐次モード: 完了したサンプル（iteration）ごとにチェックポイントが保存され、次のサンプルから再開する
+    - ファンアウトモード: 同じステップで完了したサンプルの結果はチェックポイントに書き込み済みのため、
+      未完了のサンプルのみ再実行される（既に iter_data にあるサンプルは dispatch_samples が除外する）
+    - 入力欄特定（run_excel_format_workflow_node）は完了後は再実行されない（結果は format_cache にも残る）
+query_to_human の問い合わせで停止した場合は、--answer で回答を渡して再開する。
+
+使い方:
+    python src/local_runner.py --thread-id audit-2025 --sample-data-path <フォルダ> --procedure "..." [--parallel]
+    python src/local_runner.py --thread-id audit-2025 --answer "回答"
+"""
+
+import argparse
+import json
+import logging
+import sqlite3
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from langgraph.checkpoint.sqlite import SqliteSaver
+from langgraph.types import Command
+
+from config import CHECKPOINT_DB_PATH
+
+logger = logging.getLogger(__name__)
+
+def open_checkpointer(db_path: Path = CHECKPOINT_DB_PATH) -> SqliteSaver:
+    """WALモードのSQLiteに保存するチェックポインター（ファンアウトのワーカースレッドからも書き込む）"""
+    db_path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(db_path), check_same_thread=False, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    checkpointer = SqliteSaver(conn)
+    checkpointer.setup()
+    return checkpointer
+
+def pending_interrupts(snapshot) -> List[Any]:
+    """停止中のスレッドの問い合わせ（interrupt の値）"""
+    return [interrupt.value for task in snapshot.tasks for interrupt in task.interrupts]
+
+def run(
+    graph,
+    thread_id: str,
+    inputs: Optional[Dict[str, Any]] = None,
+    answer: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    スレッドを実行する。
+      - answer を渡した場合: 問い合わせへの回答として再開する
+      - スレッドに未完了のチェックポイントがある場合: inputs を無視して最後のチェックポイントから再開する
+      - それ以外: inputs で新しく実行する
+    戻り値は実行後のスレッドの状態（values）・未完了のノード・問い合わせ
+    """
+    config = {"configurable": {"thread_id": thread_id}}
+    snapshot = graph.get_state(config)
+    if answer is not None:
+        if not pending_interrupts(snapshot):
+            raise ValueError(f"スレッド {thread_id} に回答待ちの問い合わせはありません")
+        logger.info(f"問い合わせへの回答で再開します: {thread_id}")
+        graph.invoke(Command(resume=[{"type": "response", "args": answer}]), config)
+    elif snapshot.next:
+        done = len(snapshot.values.get("iter_data") or [])
+        logger.info(f"チェックポイントから再開します: {thread_id} (次のノード: {', '.join(snapshot.next)}、完了済みサンプル: {done})")
+        graph.invoke(None, config)
+    else:
+        if inputs is None:
+            raise ValueError(f"スレッド {thread_id} に再開できるチェックポイントがありません（入力を指定してください）")
+        graph.invoke(inputs, config)
+
+    snapshot = graph.get_state(config)
+    return {
+        "thread_id": thread_id,
+        "values": snapshot.values,
+        "next": list(snapshot.next),
+        "interrupts": pending_interrupts(snapshot),
+    }
+
+def build_inputs(
+    procedure: Optional[str] = None,
+    sample_data_path: Optional[str] = None,
+    format_path: Optional[str] = None,
+    parallel: Optional[bool] = None,
+    evidence_mode: Optional[str] = None,
+) -> Dict[str, Any]:
+    """グラフの入力（指定されなかった項目は State の既定値を使う）"""
+    return {
+        key: value for key, value in {
+            "procedure": procedure,
+            "sample_data_path": sample_data_path,
+            "format_path": format_path,
+            "excel_file": format_path,
+            "parallel_samples": parallel or None,
+            "evidence_mode": evidence_mode,
+        }.items() if value is not None
+    }
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="グラフをローカルで実行・再開する（SQLiteチェックポイント）")
+    parser.add_argument("--thread-id", help="スレッドID（再開時は前回と同じIDを指定。省略時は新規に発行）")
+    parser.add_argument("--procedure", help="監査手続き")
+    parser.add_argument("--sample-data-path", help="SAMPLE_DATA_DIR からのサンプルフォルダのパス")
+    parser.add_argument("--format-path", help="Excelフォーマットのパス")
+    parser.add_argument("--parallel", action="store_true", help="サンプルを並列に実行する（ファンアウトモード）")
+    parser.add_argument("--evidence-mode", choices=["eager", "lazy"], help="証跡の渡し方")
+    parser.add_argument("--answer", help="問い合わせ（query_to_human）への回答")
+    parser.add_argument("--db", type=Path, default=CHECKPOINT_DB_PATH, help="チェックポイントのSQLiteファイル")
+    args = parser.parse_args(argv)
+
+    # グラフの読み込みはLLMクライアント等の初期化を伴うため、引数の解析後に行う
+    from graph import build_graph
+
+    inputs = build_inputs(args.procedure, args.sample_data_path, args.format_path, args.parallel, args.evidence_mode)
+    thread_id = args.thread_id or uuid.uuid4().hex
+    graph = build_graph(checkpointer=open_checkpointer(args.db))
+    result = run(graph, thread_id, inputs, args.answer)
+
+    if result["interrupts"]:
+        print(json.dumps({"thread_id": thread_id, "status": "interrupted", "interrupts": result["interrupts"]}, ensure_ascii=False, default=str, indent=2))  # noqa: T201
+        print(f"回答して再開: python src/local_runner.py --thread-id {thread_id} --answer \"...\"")  # noqa: T201
+        return 2
+    values = result["values"]
+    print(json.dumps({  # noqa: T201
+        "thread_id": thread_id,
+        "status": "completed" if not result["next"] else "incomplete",
+        "samples": len(values.get("iter_data") or []),
+        "output_excel_path": values.get("output_excel_path"),
+    }, ensure_ascii=False, indent=2))
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
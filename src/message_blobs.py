@@ -0,0 +1,102 @@
+"""
+メッセージに含まれる画像のブロブストアへの退避
+
+証跡の画像はデータURL（base64）としてメッセージに含まれるため、そのままではチェックポイントのたびに
+全ての画像が保存・読み込みされる。offload_* は画像をブロブストア（blob_store.py）に保存し、
+データURLを参照（blob:<MIMEタイプ>;sha256,<SHA-256>）に置き換える。
+restore_* は参照をデータURLに戻す（LLMに渡す直前に使う）。
+参照は webapp.py の /blobs/<SHA-256> から画像として取得できる。
+"""
+
+import base64
+import logging
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, List, Optional
+
+from langchain_core.messages import BaseMessage
+
+import blob_store
+
+logger = logging.getLogger(__name__)
+
+DATA_URL_PATTERN = re.compile(r"^data:(?P<mime>[\w.+-]+/[\w.+-]+);base64,(?P<data>.+)$", re.DOTALL)
+BLOB_REF_PATTERN = re.compile(r"^blob:(?P<mime>[\w.+-]+/[\w.+-]+);sha256,(?P<digest>[0-9a-f]{64})$")
+
+# 参照から復元したデータURL（同じ画像はモデルの呼び出しごとに復元されるため）
+_restored: "OrderedDict[str, str]" = OrderedDict()
+_RESTORED_ENTRIES = 64
+_restored_lock = threading.Lock()
+
+def blob_ref(mime_type: str, digest: str) -> str:
+    return f"blob:{mime_type};sha256,{digest}"
+
+def parse_blob_ref(url: str) -> Optional[tuple]:
+    """参照であれば (MIMEタイプ, SHA-256) を返す"""
+    match = BLOB_REF_PATTERN.match(url or "")
+    return (match.group("mime"), match.group("digest")) if match else None
+
+def offload_url(url: str) -> str:
+    """base64のデータURLであれば画像をブロブストアに保存して参照を返す（それ以外はそのまま）"""
+    match = DATA_URL_PATTERN.match(url or "")
+    if not match:
+        return url
+    digest = blob_store.put_bytes(base64.b64decode(match.group("data")))
+    return blob_ref(match.group("mime"), digest)
+
+def restore_url(url: str) -> str:
+    """参照であればブロブストアから読み込んでデータURLに戻す（それ以外はそのまま）"""
+    parsed = parse_blob_ref(url)
+    if parsed is None:
+        return url
+    with _restored_lock:
+        restored = _restored.get(url)
+        if restored is not None:
+            _restored.move_to_end(url)
+            return restored
+    mime_type, digest = parsed
+    restored = f"data:{mime_type};base64,{base64.b64encode(blob_store.read_bytes(digest)).decode('ascii')}"
+    with _restored_lock:
+        _restored[url] = restored
+        while len(_restored) > _RESTORED_ENTRIES:
+            _restored.popitem(last=False)
+    return restored
+
+def _map_content(content: Any, convert) -> Any:
+    # image_url 形式の要素の url のみを置き換える（テキストはそのまま）
+    if not isinstance(content, list):
+        return content
+    mapped = []
+    changed = False
+    for part in content:
+        if isinstance(part, dict) and part.get("type") == "image_url":
+            image_url = part.get("image_url")
+            url = image_url.get("url") if isinstance(image_url, dict) else image_url
+            new_url = convert(url)
+            if new_url != url:
+                new_image_url = {**image_url, "url": new_url} if isinstance(image_url, dict) else new_url
+                part = {**part, "image_url": new_image_url}
+                changed = True
+        mapped.append(part)
+    return mapped if changed else content
+
+def _map_message(message: Any, convert) -> Any:
+    if isinstance(message, BaseMessage):
+        content = _map_content(message.content, convert)
+        return message if content is message.content else message.model_copy(update={"content": content})
+    if isinstance(message, dict) and "content" in message:
+        content = _map_content(message["content"], convert)
+        return message if content is message["content"] else {**message, "content": content}
+    return message
+
+def offload_message(message: Any) -> Any:
+    return _map_message(message, offload_url)
+
+def offload_messages(messages: List[Any]) -> List[Any]:
+    """メッセージ内の画像のデータURLを参照に置き換えたリストを返す（元のメッセージは変更しない）"""
+    return [offload_message(message) for message in messages]
+
+def restore_messages(messages: List[Any]) -> List[Any]:
+    """メッセージ内の参照をデータURLに戻したリストを返す（元のメッセージは変更しない）"""
+    return [_map_message(message, restore_url) for message in messages]
@@ -0,0 +1,190 @@
+"""
+サンプルのPDFをページ画像（base64エンコード済み）に変換してキャッシュする
+
+キャッシュは PDF_PAGE_CACHE_DIR/<PDFのSHA-256>/ に置き、ページ番号・DPI・形式（PNG / JPEG品質）ごとに
+base64文字列のファイルとして保存する。スレッドの再実行や interrupt からの再開では、
+キャッシュ済みのページを読み込むだけでPDFを開かない。
+meta.json にはページ数と、遅延読み込みモードの目録で使ったページのテキストレイヤーだけを保存する。
+"""
+
+import base64
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import fitz
+
+from config import PDF_PAGE_CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+IMAGE_FORMATS = ("png", "jpeg")
+
+# (絶対パス, mtime_ns, サイズ) -> PDFのSHA-256（同じファイルを毎回ハッシュしないため）
+_digests: Dict[Tuple[str, int, int], str] = {}
+_digests_lock = threading.Lock()
+
+def pdf_digest(pdf_path: str) -> str:
+    """PDFのバイト列のSHA-256（ファイルが更新されていなければ計算済みの値を返す）"""
+    stat = os.stat(pdf_path)
+    key = (os.path.abspath(pdf_path), stat.st_mtime_ns, stat.st_size)
+    with _digests_lock:
+        digest = _digests.get(key)
+    if digest is None:
+        sha256 = hashlib.sha256()
+        with open(pdf_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                sha256.update(chunk)
+        digest = sha256.hexdigest()
+        with _digests_lock:
+            _digests[key] = digest
+    return digest
+
+def _page_file(entry_dir: Path, page_num: int, dpi: int, image_format: str, jpeg_quality: int) -> Path:
+    suffix = "png" if image_format == "png" else f"q{jpeg_quality}.jpg"
+    return entry_dir / f"p{page_num}_{dpi}dpi.{suffix}.b64"
+
+def _write_atomic(path: Path, data: str) -> None:
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def _entry_dir(pdf_path: str) -> Path:
+    return PDF_PAGE_CACHE_DIR / pdf_digest(pdf_path)
+
+def _encode_page(page, dpi: int, image_format: str, jpeg_quality: int) -> str:
+    pix = page.get_pixmap(dpi=dpi)
+    # メモリ上で画像のバイト列に変換してbase64エンコード
+    if image_format == "png":
+        image_bytes = pix.tobytes("png")
+    else:
+        image_bytes = pix.tobytes("jpeg", jpg_quality=jpeg_quality)
+    return base64.b64encode(image_bytes).decode("utf-8")
+
+def _read_meta(entry_dir: Path) -> Optional[dict]:
+    meta_file = entry_dir / "meta.json"
+    if not meta_file.exists():
+        return None
+    with open(meta_file, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def _page_texts(meta: Optional[dict]) -> Dict[str, str]:
+    # ページ番号（文字列）-> テキスト。以前の形式（全ページのリスト）も読み込む
+    texts = (meta or {}).get("texts") or {}
+    if isinstance(texts, list):
+        return {str(page_num): text for page_num, text in enumerate(texts, 1)}
+    return texts
+
+def _page_range(page_count: int, max_pages: Optional[int]) -> range:
+    return range(1, min(page_count, max_pages or page_count) + 1)
+
+def _write_meta(entry_dir: Path, pdf_path: str, doc, texts: Optional[Dict[str, str]] = None) -> dict:
+    """ページ数と抽出済みのページのテキスト（テキストレイヤー）を meta.json に保存する"""
+    meta = {
+        "page_count": len(doc),
+        "source": os.path.basename(pdf_path),
+        "texts": texts or {},
+    }
+    entry_dir.mkdir(parents=True, exist_ok=True)
+    _write_atomic(entry_dir / "meta.json", json.dumps(meta, ensure_ascii=False))
+    return meta
+
+def pdf_info(pdf_path: str, max_pages: Optional[int] = None) -> dict:
+    """
+    PDFのページ数と先頭 max_pages ページ（省略時は全ページ）のテキストを返す。
+    テキストは未抽出のページだけPDFを開いて抽出する（全てキャッシュ済みならPDFを開かない）
+    """
+    entry_dir = _entry_dir(pdf_path)
+    meta = _read_meta(entry_dir)
+    texts = _page_texts(meta)
+    if meta is None or any(str(page_num) not in texts for page_num in _page_range(meta["page_count"], max_pages)):
+        doc = fitz.open(pdf_path)
+        try:
+            for page_num in _page_range(len(doc), max_pages):
+                if str(page_num) not in texts:
+                    texts[str(page_num)] = doc[page_num - 1].get_text()
+            meta = _write_meta(entry_dir, pdf_path, doc, texts)
+        finally:
+            doc.close()
+    return {
+        "page_count": meta["page_count"],
+        "source": meta["source"],
+        "texts": [texts[str(page_num)] for page_num in _page_range(meta["page_count"], max_pages)],
+    }
+
+def render_pdf_page(
+    pdf_path: str,
+    page_num: int,
+    dpi: int = 72,
+    image_format: str = "png",
+    jpeg_quality: int = 85,
+) -> str:
+    """
+    PDFの1ページ（page_num は1から始まる）を画像化し、base64エンコードした文字列を返す
+    """
+    if image_format not in IMAGE_FORMATS:
+        raise ValueError(f"不明な画像形式です: {image_format}")
+    entry_dir = _entry_dir(pdf_path)
+    page_file = _page_file(entry_dir, page_num, dpi, image_format, jpeg_quality)
+    if page_file.exists():
+        return page_file.read_text(encoding="ascii")
+    entry_dir.mkdir(parents=True, exist_ok=True)
+    doc = fitz.open(pdf_path)
+    try:
+        encoded = _encode_page(doc[page_num - 1], dpi, image_format, jpeg_quality)
+    finally:
+        doc.close()
+    _write_atomic(page_file, encoded)
+    return encoded
+
+def render_pdf_pages(
+    pdf_path: str,
+    dpi: int = 72,
+    max_pages: int = 5,
+    image_format: str = "png",
+    jpeg_quality: int = 85,
+) -> List[str]:
+    """
+    PDFの先頭 max_pages ページを画像化し、base64エンコードした文字列のリストを返す
+    """
+    if image_format not in IMAGE_FORMATS:
+        raise ValueError(f"不明な画像形式です: {image_format}")
+    entry_dir = _entry_dir(pdf_path)
+
+    # ページ数が分かっていて、必要なページが全てキャッシュ済みならPDFを開かずに返す
+    meta = _read_meta(entry_dir)
+    if meta is not None:
+        page_files = [
+            _page_file(entry_dir, page_num, dpi, image_format, jpeg_quality)
+            for page_num in range(1, min(meta["page_count"], max_pages) + 1)
+        ]
+        if all(page_file.exists() for page_file in page_files):
+            logger.info(f"PDFページキャッシュにヒットしました: {pdf_path} ({len(page_files)}ページ)")
+            return [page_file.read_text(encoding="ascii") for page_file in page_files]
+
+    entry_dir.mkdir(parents=True, exist_ok=True)
+    images = []
+    # PyMuPDFでPDFをページごとに画像化
+    doc = fitz.open(pdf_path)
+    try:
+        logger.info(f"doc_length: {len(doc)}")
+        if meta is None:
+            # テキストは目録で使う時に必要なページだけ抽出する（pdf_info）
+            _write_meta(entry_dir, pdf_path, doc)
+        for page_num, page in enumerate(doc[:max_pages], 1):
+            page_file = _page_file(entry_dir, page_num, dpi, image_format, jpeg_quality)
+            if page_file.exists():
+                images.append(page_file.read_text(encoding="ascii"))
+                continue
+            encoded = _encode_page(page, dpi, image_format, jpeg_quality)
+            _write_atomic(page_file, encoded)
+            images.append(encoded)
+    finally:
+        doc.close()
+    return images
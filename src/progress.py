@@ -0,0 +1,128 @@
+"""
+実行中のスレッドの進捗イベント
+
+各ノードは publish() で小さなイベント（サンプルの開始・終了、入力欄特定の反復、検証結果、interrupt、出力ファイル）を
+スレッドIDごとに発行し、webapp.py の /threads/{thread_id}/progress がSSEとしてクライアントに送る。
+クライアントはスレッドの状態全体（画像を含むメッセージ・iter_data）をポーリングせずに進捗を表示できる。
+
+イベントはスレッドごとにリングバッファ（直近 PROGRESS_BUFFER_EVENTS 件）に保持し、連番（id）を付ける。
+接続し直したクライアントは Last-Event-ID 以降のイベントを受け取れる。
+グラフと webapp.py は同じプロセスで動作する前提（langgraph.json の http.app）で、プロセス間では共有しない。
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from config import PROGRESS_BUFFER_EVENTS, PROGRESS_MAX_THREADS
+
+logger = logging.getLogger(__name__)
+
+class _ThreadChannel:
+    """1スレッド分のイベントのリングバッファと購読者"""
+
+    def __init__(self):
+        self.next_id = 1
+        self.events: deque = deque(maxlen=PROGRESS_BUFFER_EVENTS)
+        self.subscribers: List[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]] = []
+
+_channels: "OrderedDict[str, _ThreadChannel]" = OrderedDict()
+_lock = threading.Lock()
+
+def _channel(thread_id: str) -> _ThreadChannel:
+    # 呼び出し元で _lock を取得していること
+    channel = _channels.get(thread_id)
+    if channel is None:
+        channel = _channels[thread_id] = _ThreadChannel()
+    _channels.move_to_end(thread_id)
+    # 購読者のいない古いスレッドのバッファから破棄する
+    for stale_id in list(_channels):
+        if len(_channels) <= PROGRESS_MAX_THREADS:
+            break
+        if stale_id != thread_id and not _channels[stale_id].subscribers:
+            del _channels[stale_id]
+    return channel
+
+def current_thread_id() -> Optional[str]:
+    """実行中のグラフの設定（configurable.thread_id）からスレッドIDを返す（グラフの外では None）"""
+    try:
+        from langgraph.config import get_config
+        config = get_config()
+    except RuntimeError:
+        return None
+    thread_id = config.get("configurable", {}).get("thread_id")
+    return str(thread_id) if thread_id else None
+
+def publish(event: str, thread_id: Optional[str] = None, **data: Any) -> Optional[dict]:
+    """
+    イベントを発行する。thread_id を省略した場合は実行中のグラフのスレッドIDを使い、
+    スレッドIDが分からない場合（ローカル実行など）は何もしない
+    """
+    thread_id = thread_id or current_thread_id()
+    if not thread_id:
+        return None
+    with _lock:
+        channel = _channel(thread_id)
+        message = {"id": channel.next_id, "event": event, "time": time.time(), "data": data}
+        channel.next_id += 1
+        channel.events.append(message)
+        subscribers = list(channel.subscribers)
+    for loop, queue in subscribers:
+        # 購読者のイベントループのスレッドでキューに入れる（ノードは別スレッドで実行される）
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, message)
+        except RuntimeError:
+            # イベントループが既に閉じている
+            pass
+    return message
+
+def recent(thread_id: str, after_id: int = 0) -> List[dict]:
+    """バッファに残っている after_id より後のイベント"""
+    with _lock:
+        channel = _channels.get(thread_id)
+        if channel is None:
+            return []
+        return [message for message in channel.events if message["id"] > after_id]
+
+async def subscribe(thread_id: str, after_id: int = 0, heartbeat: Optional[float] = None) -> AsyncIterator[Optional[dict]]:
+    """
+    after_id より後のイベントを、バッファの分から順に返し続ける非同期イテレータ。
+    heartbeat 秒イベントが無い場合は None を返す（SSEの接続維持用）
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    with _lock:
+        channel = _channel(thread_id)
+        backlog = [message for message in channel.events if message["id"] > after_id]
+        channel.subscribers.append((loop, queue))
+    try:
+        last_id = after_id
+        for message in backlog:
+            last_id = message["id"]
+            yield message
+        while True:
+            try:
+                message = await asyncio.wait_for(queue.get(), timeout=heartbeat)
+            except asyncio.TimeoutError:
+                yield None
+                continue
+            # バッファから送った分と重複するイベントは飛ばす
+            if message["id"] <= last_id:
+                continue
+            last_id = message["id"]
+            yield message
+    finally:
+        with _lock:
+            if (loop, queue) in channel.subscribers:
+                channel.subscribers.remove((loop, queue))
+
+def stats() -> Dict[str, Any]:
+    with _lock:
+        return {
+            "threads": len(_channels),
+            "buffered_events": sum(len(channel.events) for channel in _channels.values()),
+            "subscribers": sum(len(channel.subscribers) for channel in _channels.values()),
+        }
@@ -0,0 +1,161 @@
+"""
+OpenAI APIのレート制限（RPM/TPM）を考慮した非同期スケジューラ
+
+モデルごとにリクエスト数（RPM）とトークン数（TPM）のトークンバケットを持ち、
+呼び出し前に推定トークン数分の枠を確保してから送信する。429 (RateLimitError) が返った場合は
+Retry-After を優先し、無ければジッター付きの指数バックオフで再試行する。
+"""
+
+import asyncio
+import logging
+import random
+import threading
+import time
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+import openai
+
+from config import (
+    LLM_MAX_RETRIES,
+    LLM_RETRY_BASE_SECONDS,
+    LLM_RETRY_MAX_SECONDS,
+    OPENAI_RPM,
+    OPENAI_TPM,
+)
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# 画像1枚あたりのトークン数の見積もり（detail=auto の大きめの画像を想定）
+IMAGE_TOKEN_ESTIMATE = 1100
+
+class TokenBucket:
+    """容量 capacity、毎秒 refill_rate ずつ回復するトークンバケット"""
+
+    def __init__(self, capacity: float, refill_rate: float):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_rate)
+        self.updated = now
+
+    def try_acquire(self, amount: float) -> float:
+        """
+        amount 分を確保できれば消費して 0 を、できなければ確保できるまでの待ち秒数を返す
+        （容量を超える要求は容量いっぱいまで溜まった時点で確保する）
+        """
+        amount = min(amount, self.capacity)
+        with self._lock:
+            self._refill()
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return 0.0
+            return (amount - self.tokens) / self.refill_rate
+
+class RateLimiter:
+    """1モデル分のRPM/TPMの制限"""
+
+    def __init__(self, rpm: int, tpm: int):
+        self.requests = TokenBucket(rpm, rpm / 60.0)
+        self.tokens = TokenBucket(tpm, tpm / 60.0)
+
+    async def acquire(self, estimated_tokens: int) -> None:
+        """リクエスト1件分と推定トークン数分の枠が空くまで待つ"""
+        while True:
+            wait = self.requests.try_acquire(1)
+            if wait == 0:
+                wait = self.tokens.try_acquire(estimated_tokens)
+                if wait == 0:
+                    return
+                # トークン枠が足りない場合はリクエスト枠を返却して待つ
+                with self.requests._lock:
+                    self.requests.tokens = min(self.requests.capacity, self.requests.tokens + 1)
+            await asyncio.sleep(wait)
+
+_limiters: Dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+def get_limiter(model: str) -> RateLimiter:
+    """モデルごとのプロセス共通のRateLimiterを返す"""
+    with _limiters_lock:
+        limiter = _limiters.get(model)
+        if limiter is None:
+            limiter = _limiters[model] = RateLimiter(OPENAI_RPM, OPENAI_TPM)
+        return limiter
+
+def estimate_tokens(messages, max_output_tokens: int = 1000) -> int:
+    """メッセージの入力トークン数（文字数/2、画像は1枚あたり固定値）に出力分を加えた概算を返す"""
+    total = max_output_tokens
+    for message in messages:
+        content = message.content if hasattr(message, "content") else message
+        parts = content if isinstance(content, list) else [content]
+        for part in parts:
+            if isinstance(part, str):
+                total += len(part) // 2
+            elif part.get("type") == "text":
+                total += len(part.get("text", "")) // 2
+            elif part.get("type") == "image_url":
+                total += IMAGE_TOKEN_ESTIMATE
+    return total
+
+def _retry_after(error: openai.RateLimitError) -> Optional[float]:
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    value = response.headers.get("retry-after")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+async def call_with_rate_limit(
+    model: str,
+    estimated_tokens: int,
+    call: Callable[[], Awaitable[T]],
+    max_retries: int = LLM_MAX_RETRIES,
+) -> T:
+    """
+    レート制限の枠を確保してから call() を実行する。
+    429 の場合は Retry-After またはジッター付き指数バックオフ（full jitter）で待って再試行する
+    """
+    limiter = get_limiter(model)
+    attempt = 0
+    while True:
+        await limiter.acquire(estimated_tokens)
+        try:
+            return await call()
+        except openai.RateLimitError as e:
+            if attempt >= max_retries:
+                raise
+            delay = _retry_after(e)
+            if delay is None:
+                delay = random.uniform(0, min(LLM_RETRY_MAX_SECONDS, LLM_RETRY_BASE_SECONDS * 2 ** attempt))
+            attempt += 1
+            logger.warning(f"レート制限 (429) のため {delay:.1f}秒後に再試行します ({attempt}/{max_retries}): {model}")
+            await asyncio.sleep(delay)
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+def _background_loop() -> asyncio.AbstractEventLoop:
+    """
+    非同期のLLM呼び出しを実行する常駐イベントループ。
+    httpx.AsyncClient の接続はイベントループに紐づくため、毎回 asyncio.run で新しいループを作ると
+    プールされた接続を再利用できない。全ての呼び出しを同じループで実行する
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="llm-event-loop", daemon=True).start()
+        return _loop
+
+def run_sync(coro: Awaitable[T]) -> T:
+    """同期ノードからコルーチンを常駐イベントループで実行し、結果を待って返す"""
+    return asyncio.run_coroutine_threadsafe(coro, _background_loop()).result()
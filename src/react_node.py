@@ -2,10 +2,18 @@ from langgraph.prebuilt import create_react_agent
 from pydantic import BaseModel, Field
 from state import State
 from langchain_core.runnables import RunnableConfig
-from typing import Any, Dict, Sequence, TypedDict, Union
-from langchain_core.messages import HumanMessage, BaseMessage
+from typing import Any, Dict, List, Optional, Sequence, Tuple, TypedDict, Union
+from langchain_core.messages import HumanMessage, BaseMessage, message_to_dict, messages_from_dict
+from langgraph.graph.message import add_messages
 from langchain_community.tools import tool
-from langchain_openai import ChatOpenAI
+from llm_registry import get_chat_model, model_name
+from vision_cache import get_vision_cache
+from image_prep import image_data_url
+from pdf_page_cache import pdf_info, render_pdf_page, render_pdf_pages
+import progress
+from message_blobs import offload_message, offload_messages
+import step_journal
+import sample_index
 
 from langgraph.prebuilt.interrupt import (
     ActionRequest,
@@ -13,18 +21,32 @@ from langgraph.prebuilt.interrupt import (
     HumanInterruptConfig,
     HumanResponse,
 )
+from langgraph.errors import GraphInterrupt
 from langgraph.types import interrupt
 import base64
+import io
+import json
 import os
-import fitz
+from PIL import Image
 import logging
+import threading
+import time
 
-from config import SAMPLE_DATA_DIR
+from config import SAMPLE_CONCURRENCY, SAMPLE_DATA_DIR
 from langgraph.managed import IsLastStep, RemainingSteps
 from typing_extensions import Annotated
 
 logger = logging.getLogger(__name__)
 
+# ファンアウトモードで同時に実行するサンプル数の上限
+_sample_slots = threading.BoundedSemaphore(SAMPLE_CONCURRENCY)
+
+# 遅延読み込みモードの目録: テキスト抜粋の最大文字数と、サムネイルを付けるページの判定・サイズ
+SNIPPET_CHARS = 300
+MIN_SNIPPET_CHARS = 20
+THUMBNAIL_DPI = 36
+THUMBNAIL_SIZE = 256
+
 StructuredResponse = Union[dict, BaseModel]
 class AgentState_custom(TypedDict):
     """The state of the agent."""
@@ -68,7 +90,12 @@ def query_to_human(query: str, purpose: str) -> str:
         action_request=action_request, config=interrupt_config
     )
 
-    human_response: HumanResponse = interrupt([async_request])[0]
+    try:
+        human_response: HumanResponse = interrupt([async_request])[0]
+    except GraphInterrupt:
+        # 再開時（回答済み）は interrupt が値を返すため、実際に問い合わせた場合のみ通知する
+        progress.publish("interrupt", message=query, purpose=purpose)
+        raise
 
     message = ""
     if human_response.get("type") == "response":
@@ -98,41 +125,194 @@ def get_base64_from_image(image_path: str) -> str:
     with open(image_path, "rb") as image_file:
         return base64.b64encode(image_file.read()).decode("utf-8")
 
-def react_node(state: State, config: RunnableConfig) -> Dict[str, Any]:
-    # Increment iteration count
-    current_iteration = int(state.iteration_count) + 1
-    logger.info(f"--- Iteration {current_iteration}/{state.max_iterations} ---")
+def run_sample_index(state: State) -> Dict[str, Any]:
+    """
+    State に保存された実行中のサンプル索引を返す関数（索引の無い古いスレッドではその場で作成する）
+    """
+    data_path = os.path.join(SAMPLE_DATA_DIR, state.sample_data_path)
+    if sample_index.matches(state.sample_index, data_path):
+        return state.sample_index
+    return sample_index.build_index(data_path)
 
-    if state.sample_data_path:
-        data_path = os.path.join(SAMPLE_DATA_DIR, state.sample_data_path)
-        sample_num = len(os.listdir(data_path))
+def index_samples_node(state: State) -> Dict[str, Any]:
+    """
+    実行の最初にサンプルフォルダの索引を作成して State に保存するノード。
+    同じフォルダの索引が既にあれば（再開・同じスレッドでの再実行）そのまま使い、
+    refresh_sample_index が True の場合は変更のあったファイルのみ読み直して作り直す
+    """
+    if not state.sample_data_path:
+        return {}
+    data_path = os.path.join(SAMPLE_DATA_DIR, state.sample_data_path)
+    if sample_index.matches(state.sample_index, data_path) and not state.refresh_sample_index:
+        return {}
+    previous = state.sample_index if state.sample_index else None
+    return {"sample_index": sample_index.build_index(data_path, previous)}
 
+def pdf_render_options(state: State) -> Dict[str, Any]:
+    """
+    手続き（State）ごとのPDF画像化の設定を返す関数
+    """
+    return {
+        "dpi": state.pdf_dpi,
+        "max_pages": state.pdf_max_pages,
+        "image_format": state.pdf_image_format,
+        "jpeg_quality": state.pdf_jpeg_quality,
+    }
+
+def load_sample_data(
+    sample_dir: str,
+    pdf_options: Optional[Dict[str, Any]] = None,
+    files: Optional[List[str]] = None,
+) -> Tuple[List[str], List[str]]:
+    """
+    サンプルフォルダ内のファイルを名前順に読み込み、画像データ（base64）とテキストデータを返す関数
+    files（サンプル索引のファイル名）を渡した場合はフォルダを走査しない。
+    PDFはページ画像のキャッシュ（pdf_page_cache）を経由して画像化する
+    """
     image_data = []
     txt_data = []
-    if state.sample_data_path:
-        sample_data = os.listdir(data_path)[current_iteration-1]
-        logger.info(f"sample_data: {sample_data}")
-        for file in os.listdir(os.path.join(data_path, sample_data)):
-            file_path = os.path.join(data_path, sample_data, file)
-            logger.info(f"file_path: {file_path}")
-            if file.endswith(".pdf"):
-                # PyMuPDFでPDFをページごとに画像化
-                doc = fitz.open(file_path)
-                logger.info(f"doc_length: {len(doc)}")
-                for page in doc[:5]:
-                    pix = page.get_pixmap()
-                    # メモリ上でPNGバイト列に変換
-                    image_bytes = pix.tobytes("png")
-                    # base64エンコード
-                    image_data.append(base64.b64encode(image_bytes).decode("utf-8"))
-                doc.close()
-            elif file.endswith(".jpg") or file.endswith(".png"):
-                image_data.append(get_base64_from_image(file_path))
-            else:
-                with open(file_path, "r", encoding="utf-8") as f:
-                    txt_data.append(f.read())
-                
-    # analyze_image_tool を react_node のスコープ内で定義し、image_data をクロージャでキャプチャ
+    for file in files if files is not None else sorted(os.listdir(sample_dir)):
+        file_path = os.path.join(sample_dir, file)
+        logger.info(f"file_path: {file_path}")
+        if file.endswith(".pdf"):
+            image_data.extend(render_pdf_pages(file_path, **(pdf_options or {})))
+        elif file.endswith(".jpg") or file.endswith(".png"):
+            image_data.append(get_base64_from_image(file_path))
+        else:
+            with open(file_path, "r", encoding="utf-8") as f:
+                txt_data.append(f.read())
+    return image_data, txt_data
+
+def _image_thumbnail(image_path: str) -> str:
+    """
+    画像ファイルの縮小版（JPEG）をbase64エンコードして返す関数
+    """
+    with Image.open(image_path) as image:
+        image = image.convert("RGB")
+        image.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=60)
+    return base64.b64encode(buffer.getvalue()).decode("utf-8")
+
+def load_sample_manifest(
+    sample_dir: str,
+    pdf_options: Optional[Dict[str, Any]] = None,
+    files: Optional[List[str]] = None,
+) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """
+    遅延読み込みモード用に、サンプルフォルダ内の画像・PDFページの目録とテキストデータを返す関数
+    目録の各項目は file / path / page / size と、テキスト抜粋（snippet）またはサムネイル（thumbnail）を持つ。
+    PDFのページは読み込み順に並べ、番号は load_sample_data の画像の番号と一致する
+    """
+    max_pages = (pdf_options or {}).get("max_pages", 5)
+    manifest = []
+    txt_data = []
+    for file in files if files is not None else sorted(os.listdir(sample_dir)):
+        file_path = os.path.join(sample_dir, file)
+        logger.info(f"file_path: {file_path}")
+        if file.endswith(".pdf"):
+            info = pdf_info(file_path, max_pages)
+            size = os.path.getsize(file_path)
+            for page_num in range(1, min(info["page_count"], max_pages) + 1):
+                text = " ".join(info["texts"][page_num - 1].split())
+                entry = {"file": file, "path": file_path, "page": page_num, "size": size, "snippet": text[:SNIPPET_CHARS]}
+                # テキストレイヤーが無い（スキャン画像の）ページはサムネイルを付ける
+                if len(text) < MIN_SNIPPET_CHARS:
+                    entry["thumbnail"] = render_pdf_page(file_path, page_num, dpi=THUMBNAIL_DPI, image_format="jpeg", jpeg_quality=60)
+                manifest.append(entry)
+        elif file.endswith(".jpg") or file.endswith(".png"):
+            manifest.append({
+                "file": file,
+                "path": file_path,
+                "page": None,
+                "size": os.path.getsize(file_path),
+                "snippet": "",
+                "thumbnail": _image_thumbnail(file_path),
+            })
+        else:
+            with open(file_path, "r", encoding="utf-8") as f:
+                txt_data.append(f.read())
+    return manifest, txt_data
+
+def load_evidence_image(entry: Dict[str, Any], pdf_options: Optional[Dict[str, Any]] = None) -> str:
+    """
+    目録の1項目に対応する画像（フル解像度）をbase64エンコードして返す関数
+    """
+    if entry["page"] is None:
+        return get_base64_from_image(entry["path"])
+    pdf_options = {key: value for key, value in (pdf_options or {}).items() if key != "max_pages"}
+    return render_pdf_page(entry["path"], entry["page"], **pdf_options)
+
+def format_manifest(manifest: List[Dict[str, Any]]) -> str:
+    """
+    目録をエージェントに渡すテキストに変換する関数
+    """
+    lines = []
+    for num, entry in enumerate(manifest, 1):
+        location = f"{entry['file']} {entry['page']}ページ" if entry["page"] else entry["file"]
+        line = f"- 画像{num}: {location} ({entry['size']:,} bytes)"
+        if entry["snippet"]:
+            line += f" テキスト抜粋: {entry['snippet']}"
+        elif entry.get("thumbnail"):
+            line += " (サムネイルを添付)"
+        lines.append(line)
+    return "\n".join(lines)
+
+def build_first_message(
+    procedure: str,
+    image_data: List[str],
+    txt_data: List[str],
+    manifest: Optional[List[Dict[str, Any]]] = None,
+) -> HumanMessage:
+    """
+    エージェントに渡す最初のメッセージ（手続き・テキストデータ・画像または目録）を作成する関数
+    """
+    format = "以下のフォーマットに従って回答してください。"
+    if manifest:
+        # 遅延読み込みモード: 画像の代わりに目録（テキスト抜粋・サムネイル）だけを渡す
+        procedure_with_txtdata = "以下の手続きを実施し、結果と根拠を明確に示してください。監査人として手続きを実施してください。情報不備がある場合や複数の解釈が考えられる場合は自分の力で考えず、**必ず**query_to_humanツールで人間に問い合わせてください。\n" + procedure + "\n" + format + "\n" + "以下はこの手続きに使用する画像の目録です。画像の内容は analyze_image_tool に画像の番号を指定して確認してください。\n" + format_manifest(manifest) + "\n" + "以下はこの手続きに使用するテキストデータです。\n" + "\n".join(txt_data)
+        thumbnails = []
+        for num, entry in enumerate(manifest, 1):
+            if entry.get("thumbnail"):
+                thumbnails.append({"type":"text","text":f"画像{num}のサムネイル"})
+                thumbnails.append({"type":"image_url","image_url": {"url": f"data:image/jpeg;base64,{entry['thumbnail']}", "detail": "low"}})
+        message = HumanMessage(
+            content=[
+                {"type":"text","text":procedure_with_txtdata},
+                *thumbnails
+            ]
+        )
+    elif image_data:
+        procedure_with_txtdata = "以下の手続きを実施し、結果と根拠を明確に示してください。監査人として手続きを実施してください。情報不備がある場合や複数の解釈が考えられる場合は自分の力で考えず、**必ず**query_to_humanツールで人間に問い合わせてください。\n" + procedure + "\n" + format + "\n" + "以下はこの手続きに使用するテキストデータです。\n" + "\n".join(txt_data)
+        message = HumanMessage(
+            content=[
+                {"type":"text","text":procedure_with_txtdata},
+                *[{"type":"image_url","image_url": {"url": image_data_url(image, "agent")}} for image in image_data]
+            ]
+        )
+    else:
+        procedure_with_txtdata = "以下の手続きを実施し、結果と根拠を明確に示してください。\n" + procedure + "\n" + format + "\n" + "以下はこの手続きに使用するテキストデータです。\n" + "\n".join(txt_data)
+        message = HumanMessage(
+            content=[
+                {"type":"text","text":procedure_with_txtdata}
+            ]
+        )
+
+    return message
+
+def run_sample_agent(
+    procedure: str,
+    image_data: List[str],
+    txt_data: List[str],
+    manifest: Optional[List[Dict[str, Any]]] = None,
+    pdf_options: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """
+    1サンプル分のReActエージェントを構築・実行し、エージェントの実行結果を返す関数
+    manifest を渡した場合（遅延読み込みモード）は画像を最初のメッセージに含めず、
+    analyze_image_tool が呼ばれた時点で目録の画像を読み込む
+    """
+    # analyze_image_tool を関数スコープ内で定義し、image_data をクロージャでキャプチャ
     @tool
     def analyze_image_tool(image_data_num: int, query: str) -> str:
         """
@@ -143,55 +323,144 @@ def react_node(state: State, config: RunnableConfig) -> Dict[str, Any]:
         return:
             str: 分析結果
         """
-        nonlocal image_data # react_node スコープの image_data を参照
-        if not image_data or not (0 < image_data_num <= len(image_data)):
+        nonlocal image_data # run_sample_agent スコープの image_data を参照
+        image_count = len(manifest) if manifest is not None else len(image_data)
+        if not image_count or not (0 < image_data_num <= image_count):
             return "指定された番号の画像データが見つからないか、番号が範囲外です。"
         
-        image_data_base64 = image_data[image_data_num-1]
+        if manifest is not None:
+            # 遅延読み込みモードでは、要求された時点でフル解像度の画像を読み込む（PDFはページキャッシュを経由）
+            image_data_base64 = load_evidence_image(manifest[image_data_num-1], pdf_options)
+        else:
+            image_data_base64 = image_data[image_data_num-1]
+
+        # 同じ画像への同じ質問はキャッシュから回答する
+        vision_cache = get_vision_cache()
+        cached_answer = vision_cache.get(image_data_base64, query, model_name("vision"))
+        if cached_answer is not None:
+            return cached_answer
         
-        llm_for_tool = ChatOpenAI(model="gpt-4.1-mini") 
+        llm_for_tool = get_chat_model("vision")
         tool_message_content = HumanMessage(
             content=[
                 {"type": "text", "text": query},
-                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_data_base64}"}}
+                {"type": "image_url", "image_url": {"url": image_data_url(image_data_base64, "vision")}}
             ]
         )
         result = llm_for_tool.invoke([tool_message_content])
         # print(f"analyze_image_tool result: {result.content}") # デバッグ用
+        vision_cache.put(image_data_base64, query, model_name("vision"), result.content)
         return result.content
 
     agent = create_react_agent(
-        model="gpt-4.1-mini",
+        model=get_chat_model("agent"),
         tools=[query_to_human, analyze_image_tool],
         prompt="必ず日本語で回答してください。監査人として手続きを実施してください。情報不備がある場合や複数の解釈が考えられる場合は自分の力で考えず、**必ず**query_to_humanツールで人間に問い合わせてください。",
         state_schema=AgentState_custom,
         response_format=Result
     )
 
-    procedure = state.procedure
-    format = "以下のフォーマットに従って回答してください。"
     # Run the agent
-    if image_data:
-        procedure_with_txtdata = "以下の手続きを実施し、結果と根拠を明確に示してください。監査人として手続きを実施してください。情報不備がある場合や複数の解釈が考えられる場合は自分の力で考えず、**必ず**query_to_humanツールで人間に問い合わせてください。\n" + procedure + "\n" + format + "\n" + "以下はこの手続きに使用するテキストデータです。\n" + "\n".join(txt_data)
-        message = HumanMessage(
-            content=[
-                {"type":"text","text":procedure_with_txtdata},
-                *[{"type":"image_url","image_url": {"url": f"data:image/jpeg;base64,{image}"}} for image in image_data]
-            ]
-        )
-    else:
-        procedure_with_txtdata = "以下の手続きを実施し、結果と根拠を明確に示してください。\n" + procedure + "\n" + format + "\n" + "以下はこの手続きに使用するテキストデータです。\n" + "\n".join(txt_data)
-        message = HumanMessage(
-            content=[
-                {"type":"text","text":procedure_with_txtdata}
-            ]
-        )
-
+    # 画像はブロブストアに退避し、メッセージ（エージェントのチェックポイントを含む）には参照のみを残す
+    # （参照は llm_registry のモデルが送信時にデータURLに戻す）。
+    # interrupt から再開した場合は、画像の前処理をやり直さずにジャーナルに記録したメッセージを使う
+    message = step_journal.replay(
+        "first_message",
+        lambda: offload_message(build_first_message(procedure, image_data, txt_data, manifest)),
+        dumps=lambda message: json.dumps(message_to_dict(message), ensure_ascii=False),
+        loads=lambda value: messages_from_dict([json.loads(value)])[0],
+    )
     inputs = {"messages": [message]}
     result = agent.invoke(inputs)
+    logger.info(f"画像分析キャッシュ: {get_vision_cache().stats()}")
+    return result
+
+def run_sample(
+    procedure: str,
+    sample_dir: str,
+    pdf_options: Dict[str, Any],
+    evidence_mode: str = "eager",
+    files: Optional[List[str]] = None,
+) -> Dict[str, Any]:
+    """
+    サンプルフォルダを読み込み、evidence_mode（eager: 画像を全て添付 / lazy: 目録のみ）に従ってエージェントを実行する関数
+    files はサンプル索引のファイル名（省略時はフォルダを走査する）
+    """
+    if evidence_mode == "lazy":
+        manifest, txt_data = load_sample_manifest(sample_dir, pdf_options, files)
+        return run_sample_agent(procedure, [], txt_data, manifest, pdf_options)
+    image_data, txt_data = load_sample_data(sample_dir, pdf_options, files)
+    return run_sample_agent(procedure, image_data, txt_data)
+
+def publish_sample_finished(iter_id: int, total: int, sample_name: str, result: Dict[str, Any], elapsed: float) -> None:
+    """サンプルの完了イベント（判定結果のみ。メッセージは含めない）を発行する"""
+    structured = result.get("structured_response")
+    progress.publish(
+        "sample_finished",
+        iter_id=iter_id,
+        total=total,
+        sample=sample_name,
+        result=getattr(structured, "result", None),
+        seconds=round(elapsed, 2),
+    )
+
+def react_node(state: State, config: RunnableConfig) -> Dict[str, Any]:
+    # Increment iteration count
+    current_iteration = int(state.iteration_count) + 1
+    logger.info(f"--- Iteration {current_iteration}/{state.max_iterations} ---")
+
+    sample_num = state.max_iterations
+    sample_data = None
+    if state.sample_data_path:
+        data_path = os.path.join(SAMPLE_DATA_DIR, state.sample_data_path)
+        index = run_sample_index(state)
+        sample_num = len(index["samples"])
+        sample_data = index["samples"][current_iteration-1]["name"]
+        logger.info(f"sample_data: {sample_data}")
+        progress.publish("sample_started", iter_id=current_iteration, total=sample_num, sample=sample_data)
+        started = time.perf_counter()
+        result = run_sample(
+            state.procedure, os.path.join(data_path, sample_data), pdf_render_options(state), state.evidence_mode,
+            sample_index.sample_files(index, current_iteration),
+        )
+        publish_sample_finished(current_iteration, sample_num, sample_data, result, time.perf_counter() - started)
+    else:
+        result = run_sample_agent(state.procedure, [], [])
 
     # eval_prompt = "以下は監査結果が論理的に妥当な内容か評価してください。\n" + f"監査手続き:{procedure}\n" + "以下は監査結果です。\n" + str(result["structured_response"])
     # eval_result = agent.invoke({"messages": [("human", eval_prompt)]})
 
+    # サンプルが完了したため、再開用に記録したステップは不要
+    step_journal.clear()
+
     # Update state with new messages and incremented count
-    return {"messages": result["messages"], "iteration_count": current_iteration, "max_iterations": sample_num, "iter_data": {"iter_id":current_iteration, "result": result["structured_response"]}}
\ No newline at end of file
+    return {"messages": offload_messages(result["messages"]), "iteration_count": current_iteration, "max_iterations": sample_num, "iter_data": {"iter_id":current_iteration, "sample": sample_data, "result": result["structured_response"]}}
+
+def sample_worker_node(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    ファンアウトモードで1サンプル分の手続きを実行するノード。
+    graph.py の dispatch_samples から Send で呼び出され、payload には
+    procedure / sample_data_path / sample_name / files / iter_id / sample_count / pdf_options / evidence_mode が入る。
+
+    並列実行中は messages・iteration_count を書き込まず（同一ステップでの競合を避けるため）、
+    結果は iter_data のみに追加する。query_to_human の interrupt はサンプル単位で発生し、
+    他のサンプルの実行は継続される。
+    """
+    iter_id = payload["iter_id"]
+    sample_name = payload["sample_name"]
+    logger.info(f"--- Sample {iter_id}: {sample_name} ---")
+
+    sample_dir = os.path.join(SAMPLE_DATA_DIR, payload["sample_data_path"], sample_name)
+    # 同時に実行するエージェント数を SAMPLE_CONCURRENCY に制限
+    total = payload.get("sample_count")
+    with _sample_slots:
+        progress.publish("sample_started", iter_id=iter_id, total=total, sample=sample_name)
+        started = time.perf_counter()
+        result = run_sample(
+            payload["procedure"], sample_dir, payload.get("pdf_options"), payload.get("evidence_mode", "eager"),
+            payload.get("files"),
+        )
+    publish_sample_finished(iter_id, total, sample_name, result, time.perf_counter() - started)
+    step_journal.clear()
+
+    return {"iter_data": {"iter_id": iter_id, "sample": sample_name, "result": result["structured_response"]}}
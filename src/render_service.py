@@ -0,0 +1,437 @@
+"""
+LibreOfficeによるExcel→PNGレンダリングサービス
+
+起動済み（ウォーム）のheadless LibreOfficeプロセスを固定数のワーカーとしてプールし、
+キューに積まれたレンダリング要求を順に処理してシートごとのPNGを返す。
+各ワーカーはスロット（ポートとユーザープロファイルの組）をロックファイルで確保するため、
+同じマシンの複数のプロセスで実行してもポートやプロファイルが衝突しない。
+
+Python から UNO (`import uno`) が利用できる場合はソケット接続したリスナープロセスで変換する。
+利用できない場合は unoserver（LibreOffice 同梱の Python で動くサーバー）をワーカーごとに常駐させ、
+ワークブックを1シート1ページのPDFに変換してから PyMuPDF でシートごとのPNGにする。
+"""
+
+import atexit
+import logging
+import os
+import queue
+import shlex
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+from typing import IO, List, Optional, Tuple
+
+import fitz
+import openpyxl
+
+from config import (
+    CACHE_DIR,
+    RENDER_BACKEND,
+    RENDER_BASE_PORT,
+    RENDER_HEALTHCHECK_INTERVAL,
+    RENDER_PDF_DPI,
+    RENDER_TIMEOUT,
+    RENDER_WORKERS,
+    SOFFICE_PATH,
+    UNOSERVER_PATH,
+)
+
+try:  # UNOブリッジはLibreOffice同梱のPythonでのみ利用可能
+    import uno
+    from com.sun.star.beans import PropertyValue
+except ImportError:
+    uno = None
+
+try:  # unoserver のクライアント（XML-RPC）は通常の Python で利用できる
+    from unoserver.client import UnoClient
+except ImportError:
+    UnoClient = None
+
+logger = logging.getLogger(__name__)
+
+PROFILES_DIR = CACHE_DIR / "lo_profiles"
+# 確保を試みるスロットの数（スロット n はポート RENDER_BASE_PORT + 2n, + 2n + 1 を使う）
+MAX_SLOTS = 64
+
+class RenderError(RuntimeError):
+    """レンダリングに失敗した場合の例外"""
+
+def _try_lock(handle: IO) -> bool:
+    # プロセスが終了するとロックは自動的に解放される
+    try:
+        if os.name == "nt":
+            import msvcrt
+            handle.seek(0)
+            msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+def _port_free(port: int) -> bool:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            sock.bind(("127.0.0.1", port))
+            return True
+        except OSError:
+            return False
+
+def _port_open(port: int) -> bool:
+    try:
+        with socket.create_connection(("127.0.0.1", port), timeout=2):
+            return True
+    except OSError:
+        return False
+
+def _claim_slot() -> Tuple[int, IO]:
+    """
+    他のワーカー・他のプロセスが使用していないスロットをロックファイルで確保し、
+    (スロット番号, ロックファイル) を返す（ロックファイルを閉じるまで確保したままになる）
+    """
+    PROFILES_DIR.mkdir(parents=True, exist_ok=True)
+    for slot in range(MAX_SLOTS):
+        handle = open(PROFILES_DIR / f"slot{slot}.lock", "a+")
+        if not _try_lock(handle):
+            handle.close()
+            continue
+        # ロックファイルを使わない別のプログラムがポートを使っている場合は次のスロットにする
+        if _port_free(RENDER_BASE_PORT + 2 * slot) and _port_free(RENDER_BASE_PORT + 2 * slot + 1):
+            return slot, handle
+        handle.close()
+    raise RenderError(f"LibreOfficeワーカーの空きスロットがありません（{MAX_SLOTS}スロット使用中）")
+
+def _visible_sheet_numbers(excel_path: str) -> List[int]:
+    # PDFエクスポートは非表示のシートを出力しないため、ページとシート番号（1から始まる）の対応に使う
+    workbook = openpyxl.load_workbook(excel_path, read_only=True)
+    try:
+        return [num for num, sheet in enumerate(workbook.worksheets, 1) if sheet.sheet_state == "visible"]
+    finally:
+        workbook.close()
+
+def _props(**kwargs):
+    props = []
+    for name, value in kwargs.items():
+        prop = PropertyValue()
+        prop.Name = name
+        prop.Value = value
+        props.append(prop)
+    return tuple(props)
+
+class OfficeWorker:
+    """専用のスロット（ポート・プロファイル）を持つLibreOfficeプロセス1つ分のワーカー"""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.slot: Optional[int] = None
+        self.port: Optional[int] = None
+        self.profile_dir: Optional[Path] = None
+        self._slot_lock: Optional[IO] = None
+        self.process: Optional[subprocess.Popen] = None
+        self.desktop = None
+        self.client = None
+        self.render_count = 0
+        self.restart_count = 0
+
+    def _base_command(self) -> List[str]:
+        return [
+            SOFFICE_PATH,
+            "--headless",
+            "--invisible",
+            "--nologo",
+            "--norestore",
+            "--nolockcheck",
+            f"-env:UserInstallation={self.profile_dir.resolve().as_uri()}",
+        ]
+
+    def _claim(self) -> None:
+        # スロットは再起動しても保持し、release() で解放する
+        if self._slot_lock is not None:
+            return
+        self.slot, self._slot_lock = _claim_slot()
+        self.port = RENDER_BASE_PORT + 2 * self.slot
+        self.profile_dir = PROFILES_DIR / f"slot{self.slot}"
+
+    def release(self) -> None:
+        """プロセスを終了してスロットを解放する"""
+        self.stop()
+        if self._slot_lock is not None:
+            self._slot_lock.close()
+            self._slot_lock = None
+
+    def start(self) -> None:
+        """スロットを確保し、リスナープロセス（UNOが無い場合は unoserver）を起動して接続する"""
+        self._claim()
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        if uno is None:
+            self._start_unoserver()
+            return
+
+        command = self._base_command() + [
+            f"--accept=socket,host=127.0.0.1,port={self.port};urp;StarOffice.ComponentContext"
+        ]
+        logger.info(f"LibreOfficeワーカー{self.index}を起動します (slot={self.slot}, port={self.port})")
+        self.process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        local_context = uno.getComponentContext()
+        resolver = local_context.ServiceManager.createInstanceWithContext(
+            "com.sun.star.bridge.UnoUrlResolver", local_context
+        )
+        deadline = time.monotonic() + RENDER_TIMEOUT
+        while True:
+            try:
+                context = resolver.resolve(
+                    f"uno:socket,host=127.0.0.1,port={self.port};urp;StarOffice.ComponentContext"
+                )
+                break
+            except Exception:
+                if self.process.poll() is not None or time.monotonic() > deadline:
+                    self.stop()
+                    raise RenderError(f"LibreOfficeワーカー{self.index}に接続できませんでした")
+                time.sleep(0.5)
+        self.desktop = context.ServiceManager.createInstanceWithContext("com.sun.star.frame.Desktop", context)
+
+    def _start_unoserver(self) -> None:
+        if UnoClient is None:
+            raise RenderError("UNO・unoserver のどちらも利用できません。unoserver をインストールしてください")
+        # unoserver は LibreOffice を port（UNO）で起動し、port + 1 で変換要求（XML-RPC）を受け付ける
+        rpc_port = self.port + 1
+        command = shlex.split(UNOSERVER_PATH) + [
+            "--interface", "127.0.0.1",
+            "--port", str(rpc_port),
+            "--uno-port", str(self.port),
+            "--executable", SOFFICE_PATH,
+            "--user-installation", str(self.profile_dir.resolve()),
+            "--conversion-timeout", str(int(RENDER_TIMEOUT)),
+            "--quiet",
+        ]
+        logger.info(f"LibreOfficeワーカー{self.index}を unoserver で起動します (slot={self.slot}, port={rpc_port})")
+        self.process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + RENDER_TIMEOUT
+        while not _port_open(rpc_port):
+            if self.process.poll() is not None or time.monotonic() > deadline:
+                self.stop()
+                raise RenderError(f"LibreOfficeワーカー{self.index}（unoserver）に接続できませんでした")
+            time.sleep(0.5)
+        self.client = UnoClient(server="127.0.0.1", port=str(rpc_port), host_location="local")
+
+    def stop(self) -> None:
+        """リスナープロセスを終了する"""
+        if self.desktop is not None:
+            try:
+                self.desktop.terminate()
+            except Exception:
+                pass
+            self.desktop = None
+        self.client = None
+        if self.process is not None:
+            if uno is None:
+                # unoserver は SIGTERM で LibreOffice を終了してから終了する
+                self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+            self.process = None
+
+    def restart(self) -> None:
+        logger.warning(f"LibreOfficeワーカー{self.index}を再起動します")
+        self.stop()
+        self.restart_count += 1
+        self.start()
+
+    def is_healthy(self) -> bool:
+        """プロセスが生存し、UNO呼び出し（unoserver の場合は接続）に応答するかを確認する"""
+        if self.process is None or self.process.poll() is not None:
+            return False
+        if uno is None:
+            return self.client is not None and _port_open(self.port + 1)
+        if self.desktop is None:
+            return False
+        try:
+            self.desktop.getComponents()
+            return True
+        except Exception:
+            return False
+
+    def render(self, excel_path: str, out_dir: str, sheets: Optional[List[int]] = None) -> List[str]:
+        """ワークブックの各シート（sheets 指定時はそのシートのみ）をPNGに変換し、シート順のパスのリストを返す"""
+        out_dir_path = Path(out_dir)
+        out_dir_path.mkdir(parents=True, exist_ok=True)
+        basename = Path(excel_path).stem
+        if uno is None:
+            captures = self._render_with_unoserver(excel_path, out_dir_path, basename, sheets)
+        else:
+            captures = self._render_with_uno(excel_path, out_dir_path, basename, sheets)
+        self.render_count += 1
+        return captures
+
+    def _render_with_uno(self, excel_path: str, out_dir: Path, basename: str, sheets: Optional[List[int]]) -> List[str]:
+        document = self.desktop.loadComponentFromURL(
+            Path(excel_path).resolve().as_uri(), "_blank", 0, _props(Hidden=True, ReadOnly=True)
+        )
+        if document is None:
+            raise RenderError(f"ワークブックを開けませんでした: {excel_path}")
+        try:
+            controller = document.getCurrentController()
+            sheets_uno = document.getSheets()
+            captures = []
+            # PNGエクスポートはアクティブシートの1ページ目を出力するため、シートを切り替えながら出力する
+            for sheet_idx in range(sheets_uno.getCount()):
+                if sheets and sheet_idx + 1 not in sheets:
+                    continue
+                controller.setActiveSheet(sheets_uno.getByIndex(sheet_idx))
+                capture_path = out_dir / f"{basename}_sheet{sheet_idx + 1}.png"
+                document.storeToURL(capture_path.resolve().as_uri(), _props(FilterName="calc_png_Export"))
+                captures.append(str(capture_path))
+            return captures
+        finally:
+            document.close(True)
+
+    def _render_with_unoserver(self, excel_path: str, out_dir: Path, basename: str, sheets: Optional[List[int]]) -> List[str]:
+        # 1シート1ページ（SinglePageSheets）のPDFに変換し、各ページをシートのPNGとして書き出す
+        visible = _visible_sheet_numbers(excel_path)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            pdf_path = os.path.join(tmp_dir, f"{basename}.pdf")
+            self.client.convert(
+                inpath=str(Path(excel_path).resolve()),
+                outpath=pdf_path,
+                convert_to="pdf",
+                filter_options=["SinglePageSheets=true"],
+            )
+            if not os.path.exists(pdf_path):
+                raise RenderError(f"PDF変換後、ファイルが見つかりませんでした: {pdf_path}")
+            document = fitz.open(pdf_path)
+            try:
+                if len(document) != len(visible):
+                    logger.warning(f"PDFのページ数（{len(document)}）と表示シート数（{len(visible)}）が一致しません: {excel_path}")
+                captures = []
+                for page, sheet_num in zip(document, visible):
+                    if sheets and sheet_num not in sheets:
+                        continue
+                    capture_path = out_dir / f"{basename}_sheet{sheet_num}.png"
+                    page.get_pixmap(dpi=RENDER_PDF_DPI).save(str(capture_path))
+                    captures.append(str(capture_path))
+                return captures
+            finally:
+                document.close()
+
+class RenderService:
+    """OfficeWorkerのプールとレンダリング要求キュー"""
+
+    def __init__(self, num_workers: int = RENDER_WORKERS):
+        self.requests: "queue.Queue" = queue.Queue()
+        self.workers = [OfficeWorker(index) for index in range(num_workers)]
+        self._stopped = threading.Event()
+        self._threads = []
+        for worker in self.workers:
+            thread = threading.Thread(
+                target=self._run_worker, args=(worker,), name=f"render-worker-{worker.index}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, excel_path: str, out_dir: str, sheets: Optional[List[int]] = None) -> Future:
+        """レンダリング要求をキューに積み、結果（PNGパスのリスト）のFutureを返す"""
+        future: Future = Future()
+        self.requests.put((excel_path, out_dir, sheets, future))
+        return future
+
+    def render(self, excel_path: str, out_dir: str, sheets: Optional[List[int]] = None) -> List[str]:
+        return self.submit(excel_path, out_dir, sheets).result()
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.requests.qsize(),
+            "workers": [
+                {"index": w.index, "slot": w.slot, "renders": w.render_count, "restarts": w.restart_count, "healthy": w.is_healthy()}
+                for w in self.workers
+            ],
+        }
+
+    def shutdown(self) -> None:
+        self._stopped.set()
+        for _ in self._threads:
+            self.requests.put(None)
+        for thread in self._threads:
+            thread.join(timeout=5)
+        for worker in self.workers:
+            worker.release()
+
+    def _run_worker(self, worker: OfficeWorker) -> None:
+        try:
+            worker.start()
+        except Exception as e:
+            logger.error(f"LibreOfficeワーカー{worker.index}の起動に失敗しました: {e}")
+
+        while not self._stopped.is_set():
+            try:
+                request = self.requests.get(timeout=RENDER_HEALTHCHECK_INTERVAL)
+            except queue.Empty:
+                # 待機中に定期的にヘルスチェックし、クラッシュしていれば再起動する
+                if not worker.is_healthy():
+                    self._restart(worker)
+                continue
+            if request is None:
+                break
+
+            excel_path, out_dir, sheets, future = request
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                if not worker.is_healthy():
+                    self._restart(worker)
+                try:
+                    captures = worker.render(excel_path, out_dir, sheets)
+                except Exception as e:
+                    # 接続が切れた場合は再起動して1回だけ再試行する
+                    logger.warning(f"LibreOfficeワーカー{worker.index}でのレンダリングに失敗したため再試行します: {e}")
+                    self._restart(worker)
+                    captures = worker.render(excel_path, out_dir, sheets)
+                future.set_result(captures)
+            except Exception as e:
+                future.set_exception(e)
+
+    def _restart(self, worker: OfficeWorker) -> None:
+        try:
+            worker.restart()
+        except Exception as e:
+            logger.error(f"LibreOfficeワーカー{worker.index}の再起動に失敗しました: {e}")
+
+_service: Optional[RenderService] = None
+_service_lock = threading.Lock()
+
+def get_render_service() -> RenderService:
+    """プロセス共通のRenderServiceを返す（初回呼び出し時にワーカーを起動する）"""
+    global _service
+    with _service_lock:
+        if _service is None:
+            if shutil.which(SOFFICE_PATH) is None and not os.path.exists(SOFFICE_PATH):
+                logger.warning(f"LibreOffice ({SOFFICE_PATH}) が見つかりません。SOFFICE_PATH を確認してください。")
+            _service = RenderService()
+            atexit.register(_service.shutdown)
+        return _service
+
+def render_workbook(excel_path: str, out_dir: str, backend: Optional[str] = None, sheets: Optional[List[int]] = None) -> List[str]:
+    """
+    ワークブックの各シートをPNGに変換し、シート順のPNGパスのリストを返す
+    出力ファイル名は <ワークブック名>_sheet<N>.png（Nは1から始まる）
+    sheets: 変換するシート番号（1から始まる）のリスト。省略時は全シート
+
+    backend: "soffice"（LibreOfficeレンダリングサービス）または "pil"（sheet_rasterizer による簡易描画）。
+             省略時は RENDER_BACKEND の設定に従う
+    """
+    backend = backend or RENDER_BACKEND
+    if backend == "pil":
+        from sheet_rasterizer import rasterize_workbook
+        return rasterize_workbook(excel_path, out_dir, sheets=sheets)
+    if backend != "soffice":
+        raise ValueError(f"不明なレンダリングバックエンドです: {backend}")
+    return get_render_service().render(excel_path, out_dir, sheets)
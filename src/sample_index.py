@@ -0,0 +1,128 @@
+"""
+サンプルフォルダの索引
+
+実行の最初に1回だけサンプルフォルダを走査し、サンプル（サブフォルダ）とファイルを名前順に並べた索引を作る。
+索引は State.sample_index に保存されるため、各反復・各ワーカーは番号から O(1) でサンプルを参照でき、
+実行中にフォルダへファイルが追加されてもサンプルの順序や件数は変わらない（再開時も同じ索引を使う）。
+
+各ファイルは種類（pdf / image / text）・サイズ・更新時刻・SHA-256 を持つ。索引は
+SAMPLE_INDEX_DIR/<フォルダの絶対パスのSHA-256>.json にも保存し、再作成時はサイズと更新時刻が
+変わっていないファイルのダイジェストを再利用する（変更されたファイルのみ読み直す）。
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from config import SAMPLE_INDEX_DIGESTS, SAMPLE_INDEX_DIR
+
+logger = logging.getLogger(__name__)
+
+INDEX_VERSION = 1
+IMAGE_SUFFIXES = (".jpg", ".png")
+
+def file_kind(name: str) -> str:
+    """load_sample_data と同じ判定によるファイルの種類"""
+    if name.endswith(".pdf"):
+        return "pdf"
+    if name.endswith(IMAGE_SUFFIXES):
+        return "image"
+    return "text"
+
+def _file_digest(path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+def _index_path(root: str) -> Path:
+    return SAMPLE_INDEX_DIR / f"{hashlib.sha256(root.encode('utf-8')).hexdigest()}.json"
+
+def load_persisted(data_path: str) -> Optional[Dict[str, Any]]:
+    """保存済みの索引（無い場合・形式が古い場合は None）"""
+    index_file = _index_path(os.path.abspath(data_path))
+    if not index_file.exists():
+        return None
+    try:
+        with open(index_file, "r", encoding="utf-8") as f:
+            index = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"サンプル索引を読み込めません（作り直します）: {index_file} ({e})")
+        return None
+    return index if index.get("version") == INDEX_VERSION else None
+
+def _persist(index: Dict[str, Any]) -> None:
+    SAMPLE_INDEX_DIR.mkdir(parents=True, exist_ok=True)
+    index_file = _index_path(index["root"])
+    fd, tmp_path = tempfile.mkstemp(dir=SAMPLE_INDEX_DIR, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False)
+    os.replace(tmp_path, index_file)
+
+def build_index(data_path: str, previous: Optional[Dict[str, Any]] = None, persist: bool = True) -> Dict[str, Any]:
+    """
+    data_path 配下のサンプルフォルダの索引を作る。
+    previous（省略時は保存済みの索引）にサイズ・更新時刻が同じファイルがあれば、そのダイジェストを使う
+    """
+    started = time.perf_counter()
+    root = os.path.abspath(data_path)
+    if previous is None or previous.get("root") != root:
+        previous = load_persisted(data_path)
+    known = {}
+    for sample in (previous or {}).get("samples", []):
+        for entry in sample["files"]:
+            known[(sample["name"], entry["name"])] = entry
+
+    samples = []
+    hashed = 0
+    with os.scandir(root) as sample_entries:
+        sample_dirs = sorted(entry.name for entry in sample_entries if entry.is_dir())
+    for sample_name in sample_dirs:
+        files = []
+        with os.scandir(os.path.join(root, sample_name)) as file_entries:
+            for entry in sorted(file_entries, key=lambda entry: entry.name):
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+                previous_entry = known.get((sample_name, entry.name))
+                digest = None
+                if previous_entry and previous_entry["size"] == stat.st_size and previous_entry["mtime_ns"] == stat.st_mtime_ns:
+                    digest = previous_entry.get("sha256")
+                elif SAMPLE_INDEX_DIGESTS:
+                    digest = _file_digest(entry.path)
+                    hashed += 1
+                files.append({
+                    "name": entry.name,
+                    "kind": file_kind(entry.name),
+                    "size": stat.st_size,
+                    "mtime_ns": stat.st_mtime_ns,
+                    "sha256": digest,
+                })
+        samples.append({"name": sample_name, "files": files})
+
+    index = {"version": INDEX_VERSION, "root": root, "built": time.time(), "samples": samples}
+    if persist:
+        _persist(index)
+    logger.info(
+        f"サンプル索引を作成しました: {root} ({len(samples)}サンプル、"
+        f"{sum(len(sample['files']) for sample in samples)}ファイル、ダイジェスト計算 {hashed}件、"
+        f"{time.perf_counter() - started:.2f}秒)"
+    )
+    return index
+
+def sample_names(index: Dict[str, Any]) -> List[str]:
+    return [sample["name"] for sample in index.get("samples", [])]
+
+def sample_files(index: Dict[str, Any], iter_id: int) -> List[str]:
+    """iter_id（1から始まる）番目のサンプルのファイル名（名前順）"""
+    return [entry["name"] for entry in index["samples"][iter_id - 1]["files"]]
+
+def matches(index: Optional[Dict[str, Any]], data_path: str) -> bool:
+    """index が data_path の索引か"""
+    return bool(index) and index.get("version") == INDEX_VERSION and index.get("root") == os.path.abspath(data_path)
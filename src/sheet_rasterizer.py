@@ -0,0 +1,253 @@
+"""
+openpyxlのワークシートを直接PNGに描画する簡易レンダラー（LibreOffice不要）
+
+入力欄特定ワークフローの検証に必要な「グリッドの概観」（列幅・行高・結合セル・塗りつぶし・罫線・
+太字ラベル・ハイライトとセル番地の文字列）だけを描画する。印刷と同等の正確さは目指さない代わりに、
+プロセス起動なしで数十ミリ秒程度で描画できる。
+"""
+
+import logging
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import openpyxl
+from openpyxl.styles.colors import COLOR_INDEX
+from openpyxl.utils import range_boundaries
+from PIL import Image, ImageDraw, ImageFont
+
+from config import RASTER_FONT_PATH
+
+logger = logging.getLogger(__name__)
+
+# 列幅（文字数）・行高（ポイント）の既定値と描画サイズの上限
+DEFAULT_COL_WIDTH = 8.43
+DEFAULT_ROW_HEIGHT = 15.0
+MAX_IMAGE_SIDE = 4000
+FONT_SIZE = 13
+MIN_FONT_SIZE = 6
+
+GRID_COLOR = (218, 220, 224)
+TEXT_COLOR = (0, 0, 0)
+BACKGROUND_COLOR = (255, 255, 255)
+
+# 日本語を含むラベルを描画するためのフォント候補（RASTER_FONT_PATH が最優先）
+_FONT_CANDIDATES = [
+    "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/noto-cjk/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/truetype/fonts-japanese-gothic.ttf",
+    "C:/Windows/Fonts/meiryo.ttc",
+    "C:/Windows/Fonts/msgothic.ttc",
+    "/System/Library/Fonts/ヒラギノ角ゴシック W3.ttc",
+]
+_BOLD_FONT_CANDIDATES = [
+    "/usr/share/fonts/opentype/noto/NotoSansCJK-Bold.ttc",
+    "/usr/share/fonts/noto-cjk/NotoSansCJK-Bold.ttc",
+    "C:/Windows/Fonts/meiryob.ttc",
+    "/System/Library/Fonts/ヒラギノ角ゴシック W6.ttc",
+]
+
+_fonts: Dict[Tuple[bool, int], ImageFont.ImageFont] = {}
+
+def _load_font(bold: bool, size: int) -> ImageFont.ImageFont:
+    if (bold, size) in _fonts:
+        return _fonts[(bold, size)]
+    candidates = ([RASTER_FONT_PATH] if RASTER_FONT_PATH else []) + (_BOLD_FONT_CANDIDATES if bold else []) + _FONT_CANDIDATES
+    font = None
+    for candidate in candidates:
+        if candidate and os.path.exists(candidate):
+            try:
+                font = ImageFont.truetype(candidate, size)
+                break
+            except OSError:
+                continue
+    if font is None:
+        if not _fonts:
+            logger.warning("日本語フォントが見つからないため既定フォントで描画します。RASTER_FONT_PATH を設定してください。")
+        font = ImageFont.load_default(size=size)
+    _fonts[(bold, size)] = font
+    return font
+
+def _to_rgb(color) -> Optional[Tuple[int, int, int]]:
+    """openpyxlのColorをRGBタプルに変換する（テーマ色は解決できないため None）"""
+    if color is None:
+        return None
+    value = None
+    if color.type == "rgb":
+        value = color.rgb
+    elif color.type == "indexed" and color.indexed is not None and color.indexed < len(COLOR_INDEX):
+        value = COLOR_INDEX[color.indexed]
+    if not isinstance(value, str) or len(value) < 6:
+        return None
+    value = value[-6:]
+    return (int(value[0:2], 16), int(value[2:4], 16), int(value[4:6], 16))
+
+def _column_widths(ws, min_col: int, max_col: int) -> List[int]:
+    default_width = ws.sheet_format.defaultColWidth or DEFAULT_COL_WIDTH
+    widths = {}
+    # column_dimensions は min..max の範囲でまとめて定義される場合がある
+    for dim in ws.column_dimensions.values():
+        if dim.hidden:
+            width = 0
+        else:
+            width = dim.width or default_width
+        for col in range(dim.min or 0, (dim.max or 0) + 1):
+            widths[col] = width
+    pixels = []
+    for col in range(min_col, max_col + 1):
+        width = widths.get(col, default_width)
+        pixels.append(int(width * 7 + 5) if width else 0)
+    return pixels
+
+def _row_heights(ws, min_row: int, max_row: int) -> List[int]:
+    default_height = ws.sheet_format.defaultRowHeight or DEFAULT_ROW_HEIGHT
+    heights = []
+    for row in range(min_row, max_row + 1):
+        dim = ws.row_dimensions.get(row)
+        if dim is not None and dim.hidden:
+            heights.append(0)
+        else:
+            height = dim.ht if dim is not None and dim.ht else default_height
+            heights.append(int(height * 4 / 3))
+    return heights
+
+def _sheet_bounds(ws) -> Tuple[int, int, int, int]:
+    """描画範囲（印刷範囲、なければ使用範囲）を (min_col, min_row, max_col, max_row) で返す"""
+    if ws.print_area:
+        area = ws.print_area.split(",")[0].split("!")[-1].replace("$", "")
+        return range_boundaries(area)
+    return range_boundaries(ws.calculate_dimension())
+
+def render_worksheet(ws, out_path: str) -> str:
+    """
+    ワークシート1枚をPNGに描画して保存し、保存先のパスを返す
+    """
+    min_col, min_row, max_col, max_row = _sheet_bounds(ws)
+    col_widths = _column_widths(ws, min_col, max_col)
+    row_heights = _row_heights(ws, min_row, max_row)
+
+    # 大きすぎるシートは描画後に縮小せず、最初から縮尺を掛けて描画する
+    scale = min(1.0, MAX_IMAGE_SIDE / max(sum(col_widths), sum(row_heights), 1))
+    font_size = max(int(FONT_SIZE * scale), 1)
+
+    # セル境界のピクセル座標（累積和）
+    xs = [0]
+    total = 0
+    for width in col_widths:
+        total += width
+        xs.append(int(total * scale))
+    ys = [0]
+    total = 0
+    for height in row_heights:
+        total += height
+        ys.append(int(total * scale))
+
+    image = Image.new("RGB", (max(xs[-1], 1) + 1, max(ys[-1], 1) + 1), BACKGROUND_COLOR)
+    draw = ImageDraw.Draw(image)
+
+    # 目盛り線
+    for x in xs:
+        draw.line([(x, 0), (x, ys[-1])], fill=GRID_COLOR)
+    for y in ys:
+        draw.line([(0, y), (xs[-1], y)], fill=GRID_COLOR)
+
+    # 結合セル: 左上セル -> 範囲、その他のセル -> 描画しない
+    merged_anchor = {}
+    merged_hidden = set()
+    for merged_range in ws.merged_cells.ranges:
+        r_min_col, r_min_row, r_max_col, r_max_row = merged_range.bounds
+        merged_anchor[(r_min_row, r_min_col)] = (min(r_max_row, max_row), min(r_max_col, max_col))
+        for row in range(r_min_row, r_max_row + 1):
+            for col in range(r_min_col, r_max_col + 1):
+                if (row, col) != (r_min_row, r_min_col):
+                    merged_hidden.add((row, col))
+
+    # スタイルは同じ組み合わせのセルが多いため、StyleArray 単位で解決結果をキャッシュする
+    style_cache = {}
+
+    for row_cells in ws.iter_rows(min_row=min_row, max_row=max_row, min_col=min_col, max_col=max_col):
+        for cell in row_cells:
+            row, col = cell.row, cell.column
+            if (row, col) in merged_hidden:
+                continue
+            end_row, end_col = merged_anchor.get((row, col), (row, col))
+            x0, y0 = xs[col - min_col], ys[row - min_row]
+            x1, y1 = xs[end_col - min_col + 1], ys[end_row - min_row + 1]
+            if x1 <= x0 or y1 <= y0:
+                continue
+
+            # 書式の無いセル（iter_rows で補完された空セルなど）は StyleArray を持たない
+            style_key = tuple(cell._style) if cell.has_style else None
+            style = style_cache.get(style_key)
+            if style is None and style_key is None:
+                style = style_cache[None] = (None, False, (None, None, None, None), None)
+            elif style is None:
+                fill_rgb = _to_rgb(cell.fill.fgColor) if cell.fill.fill_type == "solid" else None
+                border = cell.border
+                style = style_cache[style_key] = (
+                    fill_rgb,
+                    bool(cell.font.bold),
+                    tuple(
+                        side.style if side is not None else None
+                        for side in (border.left, border.right, border.top, border.bottom)
+                    ),
+                    cell.alignment.horizontal,
+                )
+            fill_rgb, bold, border_styles, horizontal = style
+
+            if fill_rgb:
+                draw.rectangle([x0 + 1, y0 + 1, x1 - 1, y1 - 1], fill=fill_rgb)
+
+            left, right, top, bottom = border_styles
+            for side_style, line in (
+                (left, [(x0, y0), (x0, y1)]),
+                (right, [(x1, y0), (x1, y1)]),
+                (top, [(x0, y0), (x1, y0)]),
+                (bottom, [(x0, y1), (x1, y1)]),
+            ):
+                if side_style:
+                    draw.line(line, fill=TEXT_COLOR, width=2 if side_style in ("medium", "thick", "double") else 1)
+
+            # 縮小により判読できない大きさの文字は描画しない
+            if cell.value is None or font_size < MIN_FONT_SIZE:
+                continue
+            text = str(cell.value).replace("\n", " ")
+            font = _load_font(bold, font_size)
+            text_width = draw.textlength(text, font=font)
+            if horizontal == "center" or horizontal == "centerContinuous":
+                tx = x0 + max((x1 - x0 - text_width) / 2, 2)
+            elif horizontal == "right" or (horizontal is None and isinstance(cell.value, (int, float))):
+                tx = x0 + max(x1 - x0 - text_width - 3, 2)
+            else:
+                tx = x0 + 3
+            ty = y0 + max((y1 - y0 - font_size) / 2 - 1, 1)
+            if text_width + 3 <= x1 - x0 and font_size + 2 <= y1 - y0:
+                draw.text((tx, ty), text, font=font, fill=TEXT_COLOR)
+            else:
+                # 収まらない文字列は隣のセルにはみ出さないようにセル内でクリップ
+                text_image = Image.new("RGBA", (x1 - x0, y1 - y0), (0, 0, 0, 0))
+                ImageDraw.Draw(text_image).text((tx - x0, ty - y0), text, font=font, fill=TEXT_COLOR + (255,))
+                image.paste(text_image, (x0, y0), text_image)
+
+    # 圧縮率よりも速度を優先する
+    image.save(out_path, format="PNG", compress_level=1)
+    return out_path
+
+def rasterize_workbook(excel_path: str, out_dir: str, workbook=None, sheets: Optional[List[int]] = None) -> List[str]:
+    """
+    ワークブックの各シート（sheets 指定時はそのシートのみ）をPNGに描画し、シート順のPNGパスのリストを返す
+    出力ファイル名は render_service.render_workbook と同じ <ワークブック名>_sheet<N>.png
+    """
+    out_dir_path = Path(out_dir)
+    out_dir_path.mkdir(parents=True, exist_ok=True)
+    basename = Path(excel_path).stem
+    if workbook is None:
+        workbook = openpyxl.load_workbook(excel_path)
+    captures = []
+    for sheet_idx, ws in enumerate(workbook.worksheets, 1):
+        if sheets and sheet_idx not in sheets:
+            continue
+        capture_path = out_dir_path / f"{basename}_sheet{sheet_idx}.png"
+        render_worksheet(ws, str(capture_path))
+        captures.append(str(capture_path))
+    return captures
@@ -5,7 +5,7 @@ from __future__ import annotations
 from typing import Annotated
 from langchain_core.pydantic_v1 import BaseModel, Field
 
-from config import DEFAULT_FORMAT_FILE, FORMAT_DIR
+from config import DEFAULT_FORMAT_FILE, FORMAT_DIR, RENDER_BACKEND
 
 # _DEFAULT_EXCEL_FORMAT_DIR = Path("C:/Users/nyham/work/sampletest_3/agent-inbox-langgraph-example/data/format") # コメントアウト
 
@@ -25,9 +25,15 @@ def append_iter_data(current, update):
     if current is None:
         current = []
     if isinstance(update, list):
-        return current + update
+        merged = current + update
     else:
-        return current + [update]
+        merged = current + [update]
+    # 並列実行時は完了順に追加されるため、iter_id 順に並べ替えて順序を固定する
+    # （再開時に同じサンプルを再実行した場合は、後の結果で置き換える）
+    if all(isinstance(item, dict) and "iter_id" in item for item in merged):
+        latest = {item["iter_id"]: item for item in merged}
+        merged = sorted(latest.values(), key=lambda item: item["iter_id"])
+    return merged
 
 class State(BaseModel):
     interrupt_response: str = Field(default="")
@@ -36,7 +42,15 @@ class State(BaseModel):
     max_iterations: int = Field(default=2)
     procedure: str = Field(default="2025年のデータか確認してください。")
     sample_data_path: str = Field(default="")
+    parallel_samples: bool = Field(default=False, description="サンプルごとのReActエージェントを並列に実行するか（ファンアウトモード）")
+    evidence_mode: str = Field(default="eager", description="証跡の渡し方（eager: 全画像を最初のメッセージに添付 / lazy: 目録のみを渡し、画像は analyze_image_tool で都度読み込む）")
+    pdf_dpi: int = Field(default=72, description="サンプルのPDFを画像化する解像度（DPI）")
+    pdf_max_pages: int = Field(default=5, description="サンプルのPDF1ファイルあたりに画像化する最大ページ数")
+    pdf_image_format: str = Field(default="png", description="PDFのページ画像の形式（png / jpeg）")
+    pdf_jpeg_quality: int = Field(default=85, description="pdf_image_format が jpeg の場合の品質（1-100）")
     iter_data: Annotated[list, append_iter_data] = Field(default=[])
+    sample_index: dict = Field(default_factory=dict, description="サンプルフォルダの索引（名前順のサンプルとファイルの種類・サイズ・SHA-256。実行の最初に作成する）")
+    refresh_sample_index: bool = Field(default=False, description="Trueの場合、既存の索引があってもサンプルフォルダを走査し直す（変更のないファイルのダイジェストは再利用）")
     data_info: dict = Field(default_factory=dict)
     format_path: str = Field(default=str(DEFAULT_FORMAT_FILE))
     df: list = Field(default=[])
@@ -44,6 +58,9 @@ class State(BaseModel):
     output_dir: str = Field(default=str(FORMAT_DIR), description="出力ディレクトリ（Excel入力欄特定ワークフロー用）")
     output_excel_path: str = Field(default="", description="出力Excelファイルパス（Excel入力欄特定ワークフロー用）")
     excel_max_iterations: int = Field(default=5, description="Excel入力欄特定ワークフローの最大反復回数")
+    excel_extract_format: str = Field(default="markdown", description="LLMに渡すセルデータの形式（markdown: 表形式 / columnar: 書式ID付きの簡易形式）")
+    excel_render_backend: str = Field(default=RENDER_BACKEND, description="Excelキャプチャのレンダリング方式（soffice: LibreOffice / pil: 簡易描画）")
+    refresh_format_cache: bool = Field(default=False, description="Trueの場合、入力欄特定結果のキャッシュを破棄して再実行する")
     excel_format_result: dict = Field(default_factory=dict, description="Excel入力欄特定ワークフローの最終結果（辞書形式）")
     excel_format_json_path: str = Field(default="", description="Excel入力欄特定ワークフローの最終JSONファイルパス")
     result: dict = Field(default_factory=dict, description="Excel入力欄特定ワークフローの最終結果（辞書形式）")
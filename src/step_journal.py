@@ -0,0 +1,95 @@
+"""
+interrupt からの再開時にノードの前処理を再実行しないためのステップジャーナル
+
+query_to_human の interrupt から再開すると、ノード（react_node / sample_worker_node）は先頭から再実行される。
+エージェント（サブグラフ）はチェックポイントから再開するため、interrupt 前のモデル・ツールの呼び出しは
+再実行されない（analyze_image_tool は vision_cache でも保護される）が、証跡の読み込み・画像の前処理・
+最初のメッセージの作成はノードを再実行するたびに行われる。
+
+replay(step, compute) はステップの結果を (スレッドID, ノードのタスクの checkpoint_ns, ステップ名) をキーとして
+SQLiteに記録し、同じタスクが再実行された場合は記録した結果を返す。タスクIDは再開時も同じになるため、
+キーは決定的に定まる。ノードが完了したら clear() で記録を削除する（残った記録は STEP_JOURNAL_TTL で削除）。
+グラフの外（スレッドIDが無い場合）では記録せずに compute を実行する。
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Optional
+
+from config import STEP_JOURNAL_PATH, STEP_JOURNAL_TTL
+
+logger = logging.getLogger(__name__)
+
+_conn: Optional[sqlite3.Connection] = None
+_lock = threading.Lock()
+
+def _connection() -> sqlite3.Connection:
+    # 呼び出し元で _lock を取得していること
+    global _conn
+    if _conn is None:
+        STEP_JOURNAL_PATH.parent.mkdir(parents=True, exist_ok=True)
+        _conn = sqlite3.connect(str(STEP_JOURNAL_PATH), check_same_thread=False, timeout=30)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute(
+            "CREATE TABLE IF NOT EXISTS steps ("
+            "scope TEXT NOT NULL, step TEXT NOT NULL, value TEXT NOT NULL, created REAL NOT NULL, "
+            "PRIMARY KEY (scope, step))"
+        )
+        # 完了しなかった（回答されなかった）スレッドの記録は起動時にまとめて削除する
+        _conn.execute("DELETE FROM steps WHERE created < ?", (time.time() - STEP_JOURNAL_TTL,))
+        _conn.commit()
+    return _conn
+
+def current_scope() -> Optional[str]:
+    """実行中のノードのタスクを表すキー（グラフの外では None）"""
+    try:
+        from langgraph.config import get_config
+        config = get_config()
+    except RuntimeError:
+        return None
+    configurable = config.get("configurable", {})
+    thread_id = configurable.get("thread_id")
+    if not thread_id:
+        return None
+    return f"{thread_id}|{configurable.get('checkpoint_ns', '')}"
+
+def replay(
+    step: str,
+    compute: Callable[[], Any],
+    dumps: Callable[[Any], str] = json.dumps,
+    loads: Callable[[str], Any] = json.loads,
+) -> Any:
+    """
+    同じタスクで step が記録済みであれば記録した結果を返し、無ければ compute() を実行して記録する。
+    結果は dumps / loads で文字列に変換して保存する
+    """
+    scope = current_scope()
+    if scope is None:
+        return compute()
+    with _lock:
+        row = _connection().execute("SELECT value FROM steps WHERE scope = ? AND step = ?", (scope, step)).fetchone()
+    if row is not None:
+        logger.info(f"ステップジャーナルから再生しました: {step} ({scope})")
+        return loads(row[0])
+    value = compute()
+    with _lock:
+        conn = _connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO steps (scope, step, value, created) VALUES (?, ?, ?, ?)",
+            (scope, step, dumps(value), time.time()),
+        )
+        conn.commit()
+    return value
+
+def clear(scope: Optional[str] = None) -> None:
+    """タスク（省略時は実行中のノードのタスク）の記録を削除する"""
+    scope = scope or current_scope()
+    if scope is None:
+        return
+    with _lock:
+        conn = _connection()
+        conn.execute("DELETE FROM steps WHERE scope = ?", (scope,))
+        conn.commit()
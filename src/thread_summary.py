@@ -0,0 +1,94 @@
+"""
+スレッドの状態の軽量な射影
+
+State の messages には証跡の画像（base64）を含むメッセージが全て残るため、スレッドの状態全体は大きくなる。
+画面の更新に必要な項目（反復回数・iter_data の結果・出力ファイル・interrupt など）だけを取り出し、
+iter_data はページ単位で返す。内容から ETag を計算し、変化が無い場合は webapp.py が 304 を返す。
+"""
+
+import hashlib
+import json
+from typing import Any, Dict, List, Optional
+
+from state import State
+
+# messages は件数（message_count）のみ返す
+EXCLUDED_FIELDS = {"messages"}
+# スレッドの状態（values）以外に選択できる項目
+DERIVED_FIELDS = {"status", "interrupts", "message_count", "updated_at"}
+SELECTABLE_FIELDS = (set(State.__fields__) - EXCLUDED_FIELDS) | DERIVED_FIELDS
+# fields を指定しない場合に返す項目
+SUMMARY_FIELDS = [
+    "status",
+    "iteration_count",
+    "max_iterations",
+    "iter_data",
+    "output_excel_path",
+    "interrupts",
+    "message_count",
+]
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+def parse_fields(fields: Optional[str]) -> List[str]:
+    """カンマ区切りの項目名を検証してリストにする（不明な項目は ValueError）"""
+    if not fields:
+        return list(SUMMARY_FIELDS)
+    selected = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in selected if name not in SELECTABLE_FIELDS]
+    if unknown:
+        raise ValueError(f"選択できない項目です: {', '.join(unknown)}（選択可能: {', '.join(sorted(SELECTABLE_FIELDS))}）")
+    return selected
+
+def project(thread: Dict[str, Any], fields: List[str], offset: int = 0, limit: int = DEFAULT_PAGE_SIZE) -> Dict[str, Any]:
+    """langgraph_sdk の Thread から fields の項目だけを取り出す（iter_data は offset から limit 件）"""
+    values = thread.get("values") or {}
+    if not isinstance(values, dict):
+        values = {}
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    offset = max(0, offset)
+
+    summary: Dict[str, Any] = {"thread_id": thread.get("thread_id")}
+    for name in fields:
+        if name == "status":
+            summary["status"] = thread.get("status")
+        elif name == "updated_at":
+            summary["updated_at"] = str(thread.get("updated_at") or "")
+        elif name == "interrupts":
+            # {タスクID: [Interrupt]} から値のみを取り出す
+            summary["interrupts"] = [
+                interrupt.get("value") if isinstance(interrupt, dict) else interrupt
+                for interrupts in (thread.get("interrupts") or {}).values()
+                for interrupt in interrupts
+            ]
+        elif name == "message_count":
+            summary["message_count"] = len(values.get("messages") or [])
+        elif name == "iter_data":
+            iter_data = values.get("iter_data") or []
+            page = iter_data[offset:offset + limit]
+            summary["iter_data"] = page
+            summary["iter_data_page"] = {
+                "offset": offset,
+                "limit": limit,
+                "total": len(iter_data),
+                "next_offset": offset + len(page) if offset + len(page) < len(iter_data) else None,
+            }
+        else:
+            summary[name] = values.get(name)
+    return summary
+
+def encode(summary: Dict[str, Any]) -> bytes:
+    return json.dumps(summary, ensure_ascii=False, sort_keys=True, default=str).encode("utf-8")
+
+def etag(body: bytes) -> str:
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+def etag_matches(if_none_match: Optional[str], current: str) -> bool:
+    """If-None-Match ヘッダー（カンマ区切り・弱いETag・* を含む）が現在の ETag に一致するか"""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == current:
+            return True
+    return False
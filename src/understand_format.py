@@ -4,7 +4,7 @@ Excel入力欄特定とJSON化
 
 import os
 import json
-import base64
+import asyncio
 import logging
 import tempfile
 from pathlib import Path
@@ -12,14 +12,18 @@ from typing import Dict, List, Literal, Optional, TypedDict
 
 # LangChain関連のインポート
 from langchain_core.messages import HumanMessage
-from langchain_openai import ChatOpenAI
 from langgraph.graph import StateGraph, END
 from pydantic import BaseModel, Field
 
 # Excel操作関連のインポート
-import openpyxl
 from openpyxl.styles import PatternFill
-import subprocess
+from render_service import render_workbook
+from workbook_session import get_session
+from excel_extract import extract_to_file
+from rate_limit import call_with_rate_limit, estimate_tokens, run_sync
+from llm_registry import get_chat_model, model_name
+from image_prep import image_file_data_url
+import progress
 
 # 環境変数の読み込み
 from dotenv import load_dotenv
@@ -27,6 +31,12 @@ load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+# 入力欄推定に使用するモデルとプロンプトのバージョン
+# プロンプトやモデルを変更した場合は FORMAT_PROMPT_VERSION を更新すること（結果キャッシュのキーに含まれる）
+# モデルは llm_registry の estimator / validator / corrector ロールの設定に従う
+FORMAT_LLM_MODEL = "/".join(sorted({model_name(role) for role in ("estimator", "validator", "corrector")}))
+FORMAT_PROMPT_VERSION = "1"
+
 # Pydanticモデル: 入力欄情報
 class ExcelField(BaseModel):
     """Excelの入力欄情報を表すモデル"""
@@ -70,6 +80,15 @@ class ExcelFormState(TypedDict):
     status: Literal["進行中", "完了", "エラー"]
     error_message: str
     temp_excel_for_capture: str
+    render_backend: str
+    extract_format: str
+    sheet_names: List[str]
+    # シート名 -> 元Excelのキャプチャ（レンダリングされないシートは含まない）
+    original_sheet_captures: Dict[str, str]
+    sheet_fields: Dict[str, List[str]]
+    dirty_sheets: List[str]
+    sheet_captures: Dict[str, str]
+    sheet_verdicts: Dict[str, dict]
 
 # 1. Excelデータのテキスト化と画像キャプチャ
 def extract_excel_data_and_capture(state: ExcelFormState) -> ExcelFormState:
@@ -109,29 +128,16 @@ def extract_excel_data_and_capture(state: ExcelFormState) -> ExcelFormState:
         #     except Exception as e:
         #         logger.warning(f"キャプチャファイルの削除に失敗: {png_file} ({e})")
         
-        # Excelファイルを開く (テキスト抽出用)
-        workbook_orig = openpyxl.load_workbook(state["excel_file"])
-        
-        # キャプチャ用にExcelを準備 (印刷範囲設定)
-        workbook_for_capture = openpyxl.load_workbook(state["excel_file"])
+        # ワークブックは1回だけ解析し、テキスト抽出・キャプチャ・ハイライトで共有する
+        session = get_session(state["excel_file"])
         
         try:
-            for sheet_capture in workbook_for_capture:
-                try:
-                    dimension = sheet_capture.calculate_dimension()
-                    if dimension:
-                        sheet_capture.print_area = dimension
-                        # LibreOffice が印刷範囲を確実に認識するよう fitToPage を有効化
-                        sheet_capture.page_setup.fitToPage = True
-                        logger.info(f"シート '{sheet_capture.title}' の印刷範囲を {dimension} に設定しました")
-                except Exception as e_dim:
-                    logger.warning(f"シート '{sheet_capture.title}' の印刷範囲設定エラー: {e_dim}")
-
-            # 印刷範囲設定済みのExcelを一時ファイルに保存
+            # 印刷範囲設定済みのExcelを一時ファイルに保存（印刷範囲はセッション作成時に設定済み）
             # delete=False にして、sofficeがファイルを使用後に手動で削除
             with tempfile.NamedTemporaryFile(delete=False, suffix=".xlsx", prefix="capture_") as tmp_excel_file:
-                workbook_for_capture.save(tmp_excel_file.name)
                 temp_excel_file_for_capture_path = tmp_excel_file.name # finally節で使うためにパスを保存
+            with session.clone() as overlay:
+                overlay.save(temp_excel_file_for_capture_path)
             
             logger.info(f"印刷範囲設定済みのExcelを一時ファイル '{temp_excel_file_for_capture_path}' に保存しました。")
 
@@ -139,87 +145,30 @@ def extract_excel_data_and_capture(state: ExcelFormState) -> ExcelFormState:
             logger.error(f"一時Excelファイルの保存中にエラーが発生しました: {e_save}")
             raise 
 
-        # 抽出結果を格納するテキスト
-        extracted_text = ""
-        
-        # 各シートの処理 (workbook_orig を使用)
-        for sheet_name in workbook_orig.sheetnames:
-            sheet = workbook_orig[sheet_name]
-            
-            # シート名の追加
-            extracted_text += f"## シート名: {sheet_name}\n"
-            
-            # 結合セル情報の抽出
-            merged_cells = []
-            for merged_cell_range in sheet.merged_cells.ranges:
-                merged_cells.append(str(merged_cell_range))
-            
-            if merged_cells:
-                extracted_text += "### 結合セル情報:\n"
-                for cell_range in merged_cells:
-                    extracted_text += f"- {cell_range}\n"
-            
-            # セルデータの抽出
-            extracted_text += "### セルデータ:\n"
-            extracted_text += "| セル | 値 | 書式 |\n"
-            extracted_text += "|-----|----|--------|\n"
-            
-            for row in sheet.iter_rows():
-                for cell in row:
-                    # セルが空でない場合のみ処理
-                    if cell.value is not None:
-                        cell_addr = f"{cell.column_letter}{cell.row}"
-                        cell_value = str(cell.value)
-                        
-                        # 書式情報の取得
-                        format_info = []
-                        if cell.font.bold:
-                            format_info.append("太字")
-                        if cell.fill.fill_type == "solid":
-                            fill_color = cell.fill.start_color.index
-                            if fill_color != "00000000":  # デフォルト色でない場合
-                                format_info.append(f"背景色:{fill_color}")
-                        
-                        format_str = ", ".join(format_info) if format_info else "-"
-                        
-                        # テーブルに行を追加
-                        extracted_text += f"| {cell_addr} | {cell_value} | {format_str} |\n"
-        
-        # 抽出結果をファイルに保存
+        # 各シートのセルデータを行単位で抽出し、ファイルに直接書き出す
         extracted_text_file = final_output_dir / "extracted_excel_text.md"
-        with open(extracted_text_file, "w", encoding="utf-8") as f:
-            f.write(extracted_text)
+        # 他の実行がオーバーレイでセルを変更している間は読み取らない
+        with session.read() as workbook:
+            extract_to_file(state["excel_file"], str(extracted_text_file), state.get("extract_format") or "markdown", workbook=workbook)
         
         logger.info(f"Excelテキスト抽出完了: {extracted_text_file}")
         
         original_capture_path = None
+        original_sheet_captures = {}
         if temp_excel_file_for_capture_path and os.path.exists(temp_excel_file_for_capture_path):
-            command = f"soffice --headless --convert-to png \"{str(temp_excel_file_for_capture_path)}\" --outdir \"{str(captures_dir)}\""
-            logger.info(f"実行コマンド: {command}")
-            subprocess.run(command, shell=True, check=True)
-            
-            temp_excel_basename = os.path.splitext(os.path.basename(temp_excel_file_for_capture_path))[0]
-            expected_capture_name = f"{temp_excel_basename}.png"
-            generated_capture_path = captures_dir / expected_capture_name
-
-            if not generated_capture_path.exists():
-                png_files_in_captures_dir = list(captures_dir.glob(f"{temp_excel_basename}*.png")) 
-                if png_files_in_captures_dir:
-                    generated_capture_path = png_files_in_captures_dir[0]
-                    logger.info(f"期待された名前 {expected_capture_name} が見つからず、代わりに {generated_capture_path.name} を使用します。")
-                else: 
-                    logger.warning(f"キャプチャファイル {expected_capture_name} または {temp_excel_basename}*.png が見つかりません。captures_dir: {captures_dir}")
-
-            if generated_capture_path and generated_capture_path.exists():
-                final_capture_name = "original_excel.png"
-                original_capture_path = captures_dir / final_capture_name
-                if generated_capture_path != original_capture_path: 
-                     if original_capture_path.exists(): 
-                        original_capture_path.unlink()
-                     os.rename(generated_capture_path, original_capture_path)
+            sheet_captures = render_workbook(temp_excel_file_for_capture_path, str(captures_dir), state.get("render_backend"))
+            if sheet_captures:
+                # 先頭のキャプチャを original_excel.png、以降を original_excel_sheet<N>.png として保存する。
+                # 非表示のシートはレンダリングされないため、シートはファイル名の末尾 _sheet<N> から特定する
+                for capture_idx, generated_capture_path in enumerate(sheet_captures):
+                    sheet_idx = int(Path(generated_capture_path).stem.rsplit("_sheet", 1)[1])
+                    final_capture_name = "original_excel.png" if capture_idx == 0 else f"original_excel_sheet{sheet_idx}.png"
+                    os.replace(generated_capture_path, captures_dir / final_capture_name)
+                    original_sheet_captures[session.sheet_names[sheet_idx - 1]] = str(captures_dir / final_capture_name)
+                original_capture_path = captures_dir / "original_excel.png"
                 logger.info(f"元Excelのキャプチャ完了: {original_capture_path}")
             else:
-                logger.error(f"SofficeによるPNG変換後、キャプチャファイルが見つかりませんでした。一時ファイル: {temp_excel_file_for_capture_path}")
+                logger.error(f"PNG変換後、キャプチャファイルが見つかりませんでした。一時ファイル: {temp_excel_file_for_capture_path}")
         else:
             logger.warning("印刷範囲設定済みの一時Excelファイルが見つからないため、キャプチャをスキップします。")
         
@@ -227,6 +176,8 @@ def extract_excel_data_and_capture(state: ExcelFormState) -> ExcelFormState:
             **state,
             "extracted_text_file": str(extracted_text_file),
             "original_excel_capture": str(original_capture_path) if original_capture_path else "", 
+            "original_sheet_captures": original_sheet_captures,
+            "sheet_names": list(session.sheet_names),
             "status": "進行中"
         }
         
@@ -260,15 +211,11 @@ def estimate_fields_with_multimodal_llm(state: ExcelFormState) -> ExcelFormState
         with open(state["extracted_text_file"], "r", encoding="utf-8") as f:
             extracted_text = f.read()
         
-        # 画像をbase64エンコード
-        with open(state["original_excel_capture"], "rb") as img_file:
-            base64_image = base64.b64encode(img_file.read()).decode("utf-8")
+        # 画像を前処理（余白の切り取り・縮小・再エンコード）してデータURLにする
+        image_url = image_file_data_url(state["original_excel_capture"], "estimator", autocrop=True)
         
         # マルチモーダルLLMクライアントの初期化（structured_output使用）
-        llm = ChatOpenAI(
-            model="gpt-4.1-mini",
-            temperature=0
-        ).with_structured_output(ExcelFormFields)
+        llm = get_chat_model("estimator", temperature=0).with_structured_output(ExcelFormFields)
         
         # プロンプトの作成
         prompt = f"""
@@ -296,7 +243,7 @@ def estimate_fields_with_multimodal_llm(state: ExcelFormState) -> ExcelFormState
                 {
                     "type": "image_url",
                     "image_url": {
-                        "url": f"data:image/png;base64,{base64_image}"
+                        "url": image_url
                     }
                 }
             ]),
@@ -354,6 +301,7 @@ def highlight_fields(state: ExcelFormState) -> ExcelFormState:
     推定された入力欄をハイライトする
     """
     logger.info(f"入力欄のハイライト開始 (v{state['current_iteration']})")
+    progress.publish("format_iteration", iteration=state["current_iteration"], max_iterations=state["max_iterations"])
     
     try:
         # 実際の保存先ベースディレクトリを決定
@@ -366,8 +314,8 @@ def highlight_fields(state: ExcelFormState) -> ExcelFormState:
         final_output_dir = base_save_path / "format_data"
         final_output_dir.mkdir(exist_ok=True, parents=True)
         
-        # 元のExcelファイルをコピー
-        workbook = openpyxl.load_workbook(state["excel_file"])
+        # 解析済みワークブックにコピーオンライトでハイライトを適用する（元のワークブックは変更しない）
+        session = get_session(state["excel_file"])
         
         # 黄色のハイライト用フィル
         highlight_fill = PatternFill(
@@ -376,27 +324,47 @@ def highlight_fields(state: ExcelFormState) -> ExcelFormState:
             fill_type="solid"
         )
         
-        # 推定された入力欄をハイライト
-        for sheet_name in workbook.sheetnames:
-            sheet = workbook[sheet_name]
-            
-            for cell_addr in state["estimated_fields"].keys():
-                try:
-                    # セルアドレスが有効かチェック
-                    if len(cell_addr) >= 2 and cell_addr[0].isalpha() and cell_addr[1:].isdigit():
-                        cell = sheet[cell_addr]
+        # 推定された入力欄をシートごとに振り分ける（"シート名!A1" 形式、またはそのセルを使用範囲に含むシート）
+        sheet_names = list(session.sheet_names)
+        sheet_fields = {sheet_name: set() for sheet_name in sheet_names}
+        for cell_id in state["estimated_fields"].keys():
+            locations = session.locate_field(cell_id)
+            if not locations:
+                logger.warning(f"セル {cell_id} はセル番号として解釈できないためスキップします")
+            for sheet_name, cell_addr in locations:
+                sheet_fields[sheet_name].add(cell_addr)
+        sheet_fields = {sheet_name: sorted(cells) for sheet_name, cells in sheet_fields.items()}
+
+        # 前回の検証時から入力欄が変わったシートだけを再キャプチャ・再検証の対象にする
+        previous_sheet_fields = state.get("sheet_fields") or {}
+        sheet_captures = state.get("sheet_captures") or {}
+        sheet_verdicts = state.get("sheet_verdicts") or {}
+        dirty_sheets = [
+            sheet_name for sheet_name in sheet_names
+            if sheet_fields[sheet_name] != previous_sheet_fields.get(sheet_name)
+            or sheet_name not in sheet_captures
+            or sheet_name not in sheet_verdicts
+        ]
+        logger.info(f"入力欄が変更されたシート: {dirty_sheets} / {sheet_names}")
+        
+        highlighted_excel = final_output_dir / f"highlighted_excel_v{state['current_iteration']}.xlsx"
+        with session.clone() as overlay:
+            # 推定された入力欄をハイライト（メモリ上の操作のため、成果物として全シート分を書き込む）
+            for sheet_name, cells in sheet_fields.items():
+                for cell_addr in cells:
+                    try:
+                        cell = overlay.cell(sheet_name, cell_addr)
                         original_value = cell.value # 元の値を取得
                         cell.fill = highlight_fill
                         if original_value is not None and str(original_value).strip() != "":
                             cell.value = f"{cell_addr}:{original_value}" # セルアドレスと元の値を連結
                         else:
                             cell.value = cell_addr # 元の値が空ならセルアドレスのみ設定
-                except Exception as cell_error:
-                    logger.warning(f"セル {cell_addr} のハイライトまたは値設定中にエラー: {str(cell_error)}")
-        
-        # ハイライト済みExcelを保存
-        highlighted_excel = final_output_dir / f"highlighted_excel_v{state['current_iteration']}.xlsx"
-        workbook.save(highlighted_excel)
+                    except Exception as cell_error:
+                        logger.warning(f"セル {cell_addr} のハイライトまたは値設定中にエラー: {str(cell_error)}")
+            
+            # ハイライト済みExcelを印刷範囲の設定込みで1回だけ保存
+            overlay.save(str(highlighted_excel))
         
         logger.info(f"入力欄のハイライト完了: {highlighted_excel}")
         
@@ -404,6 +372,8 @@ def highlight_fields(state: ExcelFormState) -> ExcelFormState:
         return {
             **state,
             "highlighted_excel": str(highlighted_excel),
+            "sheet_fields": sheet_fields,
+            "dirty_sheets": dirty_sheets,
             "status": "進行中"
         }
         
@@ -445,91 +415,28 @@ def capture_highlighted_excel(state: ExcelFormState) -> ExcelFormState:
         #     except Exception as e:
         #         logger.warning(f"キャプチャファイルの削除に失敗: {png_file} ({e})")
 
-        # ハイライト済みExcelファイルをロードし、印刷範囲を設定
+        # ハイライト済みExcelは highlight_fields で印刷範囲を設定して保存済み
         highlighted_excel_path_str = state["highlighted_excel"]
-        workbook_hl = openpyxl.load_workbook(highlighted_excel_path_str)
-        sheet_names_for_loop = list(workbook_hl.sheetnames) # PNGループ用にシート名を取得
-
-        for sheet_hl_obj in workbook_hl: # openpyxlのイテレータでシートオブジェクトを取得
-            try:
-                dimension_hl = sheet_hl_obj.calculate_dimension()
-                if dimension_hl:
-                    sheet_hl_obj.print_area = dimension_hl
-                    sheet_hl_obj.page_setup.fitToPage = True
-                    logger.info(f"ハイライト済みシート '{sheet_hl_obj.title}' の印刷範囲を {dimension_hl} に設定しました")
-            except Exception as e_dim_hl:
-                logger.warning(f"ハイライト済みシート '{sheet_hl_obj.title}' の印刷範囲設定エラー: {e_dim_hl}")
-        
-        workbook_hl.save(highlighted_excel_path_str) # 変更をハイライト済みファイルに保存
-        
-        # LibreOfficeを使用してPNGに変換
-        # highlighted_excel = state["highlighted_excel"] # highlighted_excel_path_str を使用
-        command = f"soffice --headless --convert-to png \"{highlighted_excel_path_str}\" --outdir \"{str(captures_dir)}\""
-        
-        logger.info(f"実行コマンド: {command}")
-        subprocess.run(command, shell=True, check=True)
-        
-        # 生成されたPNGファイルのパスを取得
-        excel_filename = os.path.basename(highlighted_excel_path_str)
-        excel_basename = os.path.splitext(excel_filename)[0]
-        
-        highlighted_captures = []
-
-        if len(sheet_names_for_loop) == 1:
-            # シートが1枚の場合
-            capture_path = captures_dir / f"{excel_basename}.png"
-            if capture_path.exists():
-                highlighted_captures.append(str(capture_path))
-                logger.info(f"単一シートのキャプチャファイルを発見: {capture_path}")
-            else:
-                # soffice がシート名を付与する場合も考慮 (例: excel_basename_Sheet1.png)
-                capture_path_with_sheet_name = captures_dir / f"{excel_basename}_{sheet_names_for_loop[0]}.png"
-                capture_path_with_sheet_index = captures_dir / f"{excel_basename}_sheet1.png" # 1ベースのインデックス
-                capture_path_with_sheet_index_0 = captures_dir / f"{excel_basename}_sheet0.png" # 0ベースのインデックス
-                
-                if capture_path_with_sheet_name.exists():
-                    highlighted_captures.append(str(capture_path_with_sheet_name))
-                    logger.info(f"単一シートのキャプチャファイルを発見 (シート名付き): {capture_path_with_sheet_name}")
-                elif capture_path_with_sheet_index.exists():
-                    highlighted_captures.append(str(capture_path_with_sheet_index))
-                    logger.info(f"単一シートのキャプチャファイルを発見 (シートインデックス付き): {capture_path_with_sheet_index}")
-                elif capture_path_with_sheet_index_0.exists():
-                    highlighted_captures.append(str(capture_path_with_sheet_index_0))
-                    logger.info(f"単一シートのキャプチャファイルを発見 (シートインデックス0付き): {capture_path_with_sheet_index_0}")
-                else:
-                    logger.error(f"単一シートのキャプチャファイルが見つかりません。期待されたパス: {capture_path} または {capture_path_with_sheet_name} や {capture_path_with_sheet_index}")
+        
+        # 入力欄が変わったシートだけをレンダリングサービス（LibreOffice）または簡易レンダラーでPNGに変換
+        sheet_names = state["sheet_names"]
+        dirty_sheets = state.get("dirty_sheets", sheet_names)
+        sheet_captures = dict(state.get("sheet_captures") or {})
+        if dirty_sheets:
+            dirty_indices = [sheet_names.index(sheet_name) + 1 for sheet_name in dirty_sheets]
+            new_captures = render_workbook(highlighted_excel_path_str, str(captures_dir), state.get("render_backend"), dirty_indices)
+            for capture_path in new_captures:
+                # ファイル名の末尾 _sheet<N> からシートを特定する
+                sheet_idx = int(Path(capture_path).stem.rsplit("_sheet", 1)[1])
+                sheet_captures[sheet_names[sheet_idx - 1]] = capture_path
         else:
-            # シートが複数枚の場合
-            for sheet_idx, sheet_name in enumerate(sheet_names_for_loop, 1):
-                # LibreOfficeが出力する可能性のあるファイル名パターン
-                # パターン1: <basename>_sheet<N>.png (Nは1から始まる)
-                capture_path_p1 = captures_dir / f"{excel_basename}_sheet{sheet_idx}.png"
-                # パターン2: <basename>-<N>.png (Nは1から始まる)
-                capture_path_p2 = captures_dir / f"{excel_basename}-{sheet_idx}.png"
-                # パターン3: <basename>_<シート名>.png
-                capture_path_p3 = captures_dir / f"{excel_basename}_{sheet_name}.png"
-                # パターン4: <basename>.png (LibreOfficeのバージョンによっては最初のシートのみこの名前になる可能性も稀にある)
-                # このパターンは単一シートの場合に主に処理されるが、複数シートの最初のシートで発生する可能性も考慮するなら、ここでチェックも可能
-                # capture_path_p4 = captures_dir / f"{excel_basename}.png"
-
-                actual_capture_path = None
-                if capture_path_p1.exists():
-                    actual_capture_path = capture_path_p1
-                elif capture_path_p2.exists():
-                    actual_capture_path = capture_path_p2
-                elif capture_path_p3.exists():
-                    actual_capture_path = capture_path_p3
-                # elif sheet_idx == 1 and capture_path_p4.exists(): # もし最初のシートがbasename.pngになる場合
-                #     actual_capture_path = capture_path_p4
-
-                if actual_capture_path:
-                    highlighted_captures.append(str(actual_capture_path))
-                    logger.info(f"シート '{sheet_name}' のキャプチャファイルを発見: {actual_capture_path}")
-                else:
-                    logger.warning(f"シート '{sheet_name}' (インデックス {sheet_idx}) のキャプチャファイルが見つかりません。試行したパターン: {capture_path_p1}, {capture_path_p2}, {capture_path_p3}")
-
-        if not highlighted_captures and sheet_names_for_loop:
-            logger.error(f"ハイライト済みExcelのキャプチャファイルが一つも生成されませんでした。Sofficeのコマンド出力を確認してください。コマンド: {command}")
+            logger.info("入力欄が変更されたシートが無いため、キャプチャを再利用します")
+
+        # 変更の無いシートは前回のキャプチャを引き継ぐ
+        highlighted_captures = [sheet_captures[sheet_name] for sheet_name in sheet_names if sheet_name in sheet_captures]
+
+        if not highlighted_captures:
+            logger.error(f"ハイライト済みExcelのキャプチャファイルが一つも生成されませんでした: {highlighted_excel_path_str}")
             
         logger.info(f"ハイライト済みExcelキャプチャ完了: {highlighted_captures}")
         
@@ -537,6 +444,7 @@ def capture_highlighted_excel(state: ExcelFormState) -> ExcelFormState:
         return {
             **state,
             "highlighted_captures": highlighted_captures,
+            "sheet_captures": sheet_captures,
             "status": "進行中"
         }
         
@@ -568,25 +476,17 @@ def validate_with_multimodal_llm(state: ExcelFormState) -> ExcelFormState:
         final_output_dir.mkdir(exist_ok=True, parents=True)
         
         # マルチモーダルLLMクライアントの初期化（structured_output使用）
-        llm = ChatOpenAI(
-            model="gpt-4.1-mini",
-            temperature=0
-        ).with_structured_output(ValidationResult)
-        
-        validation_results = []
-        structured_validations = []
+        # 429 の再試行はレート制限スケジューラ側で行う
+        llm = get_chat_model("validator", temperature=0, max_retries=0).with_structured_output(ValidationResult)
         
-        for capture_path in state["highlighted_captures"]:
-            # 画像をbase64エンコード
-            with open(capture_path, "rb") as img_file:
-                base64_image = base64.b64encode(img_file.read()).decode("utf-8")
-            
-            # 画像をbase64エンコード
-            with open(state["original_excel_capture"], "rb") as img_file_original:
-                base64_image_original = base64.b64encode(img_file_original.read()).decode("utf-8")
+        sheet_names = state["sheet_names"]
+        sheet_captures = state.get("sheet_captures") or {}
+        original_sheet_captures = state.get("original_sheet_captures") or {}
+        dirty_sheets = set(state.get("dirty_sheets", sheet_names))
+        sheet_verdicts = dict(state.get("sheet_verdicts") or {})
 
-            # プロンプトの作成
-            prompt = f"""
+        # プロンプトの作成
+        prompt = f"""
 以下は、Excelフォームの画像と、入力欄として推定されたセルをハイライト（yellow）した画像です。
 
 このハイライトされた箇所について、以下の観点で評価を行ってください。
@@ -596,42 +496,87 @@ def validate_with_multimodal_llm(state: ExcelFormState) -> ExcelFormState:
 問題がなければステータスを「OK」としてください。
 問題がある場合は、ステータスを「修正が必要」とし、具体的な問題点と修正案を説明してください。
 """
-            
-            # マルチモーダルLLMに問い合わせ
-            response = llm.invoke([
+
+        # 入力欄が変わったシートだけを検証し、変更の無いシートは前回の検証結果を引き継ぐ
+        requests = []
+        for sheet_name in sheet_names:
+            if sheet_name not in dirty_sheets or sheet_name not in sheet_captures:
+                continue
+            if sheet_name not in original_sheet_captures:
+                logger.error(f"シート '{sheet_name}' の元Excelのキャプチャが無いため検証をスキップします")
+                continue
+            # ハイライト済みのキャプチャと、同じシートの元のキャプチャを前処理してデータURLにする
+            image_url = image_file_data_url(sheet_captures[sheet_name], "validator", autocrop=True)
+            image_url_original = image_file_data_url(original_sheet_captures[sheet_name], "validator", autocrop=True)
+
+            messages = [
                 HumanMessage(content=[
                     {"type": "text", "text": prompt},
                     {
                         "type": "image_url",
                         "image_url": {
-                            "url": f"data:image/png;base64,{base64_image_original}"
+                            "url": image_url_original
                         }
                     },
                     {
                         "type": "image_url",
                         "image_url": {
-                            "url": f"data:image/png;base64,{base64_image}"
+                            "url": image_url
                         }
                     }
                 ])
-            ])
-            
+            ]
+            requests.append((sheet_name, messages))
+
+        async def validate_sheet(messages):
+            return await call_with_rate_limit(
+                model_name("validator"), estimate_tokens(messages), lambda: llm.ainvoke(messages)
+            )
+
+        async def validate_all():
+            # 全シートを同時に問い合わせる（同時実行数はレート制限の枠で調整される）
+            return await asyncio.gather(*(validate_sheet(messages) for _, messages in requests))
+
+        # gather の結果は要求順（シート順）に並ぶため、マージ結果は応答の到着順に依存しない
+        responses = run_sync(validate_all()) if requests else []
+        for (sheet_name, _), response in zip(requests, responses):
             # 構造化された検証結果を取得
-            structured_validation = response
+            sheet_verdicts[sheet_name] = response.model_dump()
+            
+            # 検証結果をログに記録
+            logger.info(f"検証結果 ({sheet_name}): {response.status}")
+        llm_calls = len(requests)
+
+        logger.info(f"LLMによる検証: {llm_calls}/{len(sheet_names)} シート")
+
+        validation_results = []
+        structured_validations = []
+        for sheet_name in sheet_names:
+            if sheet_name not in sheet_verdicts:
+                continue
+            structured_validation = ValidationResult(**sheet_verdicts[sheet_name])
             structured_validations.append(structured_validation)
             
             # 従来の形式のテキスト応答も生成（互換性のため）
-            validation_text = f"検証結果: {structured_validation.status}\n"
+            validation_text = f"[{sheet_name}]"
+            if sheet_name not in dirty_sheets:
+                validation_text += " (変更なしのため前回の結果を引き継ぎ)"
+            validation_text += f"\n検証結果: {structured_validation.status}\n"
             if structured_validation.issues:
                 validation_text += "問題点:\n" + "\n".join([f"- {issue}" for issue in structured_validation.issues]) + "\n"
             if structured_validation.suggestions:
                 validation_text += "修正案:\n" + "\n".join([f"- {suggestion}" for suggestion in structured_validation.suggestions]) + "\n"
             
             validation_results.append(validation_text)
-            
-            # 検証結果をログに記録
-            capture_filename = os.path.basename(capture_path)
-            logger.info(f"検証結果 ({capture_filename}): {structured_validation.status}")
+
+        if not structured_validations:
+            raise ValueError("検証結果がありません（キャプチャが見つかりません）")
+
+        # 修正が必要なシートがあればその結果を、無ければ先頭シートの結果を代表とする
+        primary_validation = next(
+            (validation for validation in structured_validations if validation.status == "修正が必要"),
+            structured_validations[0]
+        )
         
         # 検証結果をファイルに保存
         validation_result_file = final_output_dir / f"validation_result_v{state['current_iteration']}.txt"
@@ -643,8 +588,7 @@ def validate_with_multimodal_llm(state: ExcelFormState) -> ExcelFormState:
         # 構造化された検証結果を保存
         structured_validation_file = final_output_dir / f"structured_validation_v{state['current_iteration']}.json"
         with open(structured_validation_file, "w", encoding="utf-8") as f:
-            # 複数の検証結果がある場合は最初のものを使用
-            f.write(structured_validations[0].model_dump_json(indent=2))
+            f.write(primary_validation.model_dump_json(indent=2))
         logger.info(f"構造化検証結果ファイル保存: {structured_validation_file}")
         
         # 検証結果の分析
@@ -653,13 +597,21 @@ def validate_with_multimodal_llm(state: ExcelFormState) -> ExcelFormState:
             validation_status = "修正が必要"
         
         logger.info(f"検証完了: 結果={validation_status}")
+        progress.publish(
+            "format_validation",
+            iteration=state["current_iteration"],
+            status=validation_status,
+            validated_sheets=llm_calls,
+            total_sheets=len(sheet_names),
+        )
         
         # 状態の更新
         return {
             **state,
             "validation_result": "\n\n".join(validation_results),
-            "structured_validation": structured_validations[0],  # 複数ある場合は最初のものを使用
+            "structured_validation": primary_validation,
             "validation_status": validation_status,
+            "sheet_verdicts": sheet_verdicts,
             "status": "進行中"
         }
         
@@ -697,18 +649,13 @@ def correct_fields_with_multimodal_llm(state: ExcelFormState) -> ExcelFormState:
         structured_validation = state["structured_validation"]
         
         # ハイライトされたExcel画像
-        with open(state["highlighted_captures"][0], "rb") as img_file:
-            base64_image = base64.b64encode(img_file.read()).decode("utf-8")
+        image_url = image_file_data_url(state["highlighted_captures"][0], "corrector", autocrop=True)
         
         # 元のExcelフォームの画像
-        with open(state["original_excel_capture"], "rb") as img_file_original:
-            base64_image_original = base64.b64encode(img_file_original.read()).decode("utf-8")
+        image_url_original = image_file_data_url(state["original_excel_capture"], "corrector", autocrop=True)
 
         # マルチモーダルLLMクライアントの初期化（structured_output使用）
-        llm = ChatOpenAI(
-            model="gpt-4.1-mini",
-            temperature=0
-        ).with_structured_output(CollectExcelFormFields)
+        llm = get_chat_model("corrector", temperature=0).with_structured_output(CollectExcelFormFields)
         
         # プロンプトの作成
         prompt = f"""
@@ -733,13 +680,13 @@ STEP2:検証結果と画像に基づいて、修正すべき箇所を回答し
                 {
                     "type": "image_url",
                     "image_url": {
-                        "url": f"data:image/png;base64,{base64_image_original}"
+                        "url": image_url_original
                     }
                 },
                 {
                     "type": "image_url",
                     "image_url": {
-                        "url": f"data:image/png;base64,{base64_image}"
+                        "url": image_url
                     }
                 }
             ])
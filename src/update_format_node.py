@@ -2,12 +2,13 @@ import logging
 from state import State
 from typing import List
 from langchain_core.messages import HumanMessage
-from langchain_openai import ChatOpenAI
-from pydantic import BaseModel
-import shutil # shutil をインポート
+from llm_registry import get_chat_model
+from image_prep import image_file_data_url
+import progress
+import excel_writer
+from pydantic import BaseModel, Field
 from datetime import datetime # datetime をインポート
 
-import base64
 import os
 import pandas as pd
 
@@ -16,6 +17,7 @@ logger = logging.getLogger(__name__)
 class CellValue(BaseModel):
     cell_id: str
     value: str
+    values: List[str] = Field(default_factory=list, description="表の行に上から順に記入する値（cell_id は先頭のセルまたは範囲）")
 
 class CellValueList(BaseModel):
     items: List[CellValue]
@@ -82,13 +84,6 @@ def update_format_node(state: State) -> dict:
     new_file_basename = f"{os.path.basename(file_name)}_{timestamp}{file_extension}"
     new_format_file_path = os.path.join(output_dir, new_file_basename)
 
-    try:
-        shutil.copy2(original_format_path, new_format_file_path) # メタデータもコピー
-        logger.info(f"Excelフォーマットをコピーしました: {original_format_path} -> {new_format_file_path}")
-    except Exception as e:
-        logger.error(f"Excelファイルのコピー中にエラーが発生しました: {e}")
-        return {"error": f"Failed to copy Excel file: {e}"}
-
     # excel_format_json_path が存在するか確認してから読み込む
     json_path = state.excel_format_json_path
     if not json_path or not os.path.exists(json_path):
@@ -98,11 +93,10 @@ def update_format_node(state: State) -> dict:
     with open(json_path, "r", encoding="utf-8") as f:  # これはLLMへの入力なので元のまま
         format_json_for_llm = f.read()
     
-    with open(state.highlighted_captures[-1], "rb") as img_file:
-        base64_image = base64.b64encode(img_file.read()).decode("utf-8")
+    image_url = image_file_data_url(state.highlighted_captures[-1], "writer", autocrop=True)
     
     # LLMに、各セルにどのようなデータを記入するか回答させる
-    llm = ChatOpenAI(model="gpt-4.1")
+    llm = get_chat_model("writer")
     prompt = f"""
     あなたは内部監査のデータ入力担当者です。監査結果データをよく読み、
     以下の形式で、各セル番号（cell_id）と記入すべき値（value）のペアをリストで出力してください。
@@ -113,8 +107,11 @@ def update_format_node(state: State) -> dict:
         {{"cell_id": "C3", "value": "XXXとXXXの確認結果"}},
         {{"cell_id": "C4", "value": "2024-06-01"}},
         {{"cell_id": "C5", "value": ""}},※情報が不足していて記入できないセルはブランクを設定
+        {{"cell_id": "Sheet2!B8", "value": "", "values": ["サンプル1の結果", "サンプル2の結果"]}}※表の行にサンプルごとの値を記入する場合
       ]
     }}
+    セル情報のセル番号にシート名が付いている場合は、そのままシート名を付けて出力してください。
+    数値・日付は「1234」「12.5%」「2024-06-01」のように書式を付けずに出力してください。
     
     # セル情報:
     {format_json_for_llm}
@@ -134,30 +131,19 @@ def update_format_node(state: State) -> dict:
                     {
                         "type": "image_url",
                         "image_url": {
-                            "url": f"data:image/png;base64,{base64_image}"
+                            "url": image_url
                         }
                     }
                 ])
             ])
     logger.info(response.items)
 
-    # エクセルフォーマットを更新
+    # テンプレートを1回だけ読み込み、全てのセルを書き込んで出力先に保存する
     try:
-        import openpyxl
-        workbook = openpyxl.load_workbook(new_format_file_path)
-        sheet = workbook.active
-
-        for item in response.items:
-            sheet[item.cell_id] = item.value
-
-        workbook.save(new_format_file_path)
-        logger.info(f"コピー先のExcelファイルのセルを更新しました: {new_format_file_path}")
-    except FileNotFoundError:
-        logger.error(f"コピー先のExcelファイルが見つかりません: {new_format_file_path}")
-        # ここで適切なエラー処理を行うか、例外を再発生させる
-        raise
+        write_stats = excel_writer.write_cells(original_format_path, new_format_file_path, response.items)
+        progress.publish("output_written", path=new_format_file_path, cells=write_stats["cells"], sheets=write_stats["sheets"])
     except Exception as e:
-        logger.error(f"Excelファイルの更新中にエラーが発生しました: {new_format_file_path},エラー: {e}")
+        logger.error(f"Excelファイルの書き込み中にエラーが発生しました: {new_format_file_path},エラー: {e}")
         # ここで適切なエラー処理を行うか、例外を再発生させる
         raise
 
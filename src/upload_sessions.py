@@ -0,0 +1,263 @@
+"""
+再開可能な分割アップロードのセッション
+
+大きな証跡フォルダを1回のmultipartリクエストで送ると、途中で接続が切れた場合に全体を再送する必要がある。
+ここでは次の手順でアップロードする。
+    1. open_session: ファイルの一覧（パス・サイズ・SHA-256）を送ってセッションを開く。
+       ブロブストアに同じダイジェストのオブジェクトがあるファイルは送信不要（skipped）になる
+    2. write_chunk: ファイルごとにオフセットを指定してチャンクを送る（途中から再送できる）
+    3. finalize: 受信したファイルのサイズ・SHA-256を検証してブロブストアに登録し、アップロード先に配置する
+セッションの状態は UPLOAD_SESSION_DIR/<セッションID>/state.json に保存するため、プロセスを再起動しても再開できる。
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List
+
+import blob_store
+from config import (
+    UPLOAD_MAX_FILE_BYTES,
+    UPLOAD_MAX_REQUEST_BYTES,
+    UPLOAD_SESSION_DIR,
+    UPLOAD_SESSION_TTL,
+)
+
+logger = logging.getLogger(__name__)
+
+STATE_FILE = "state.json"
+
+class UploadSessionError(Exception):
+    """アップロードセッションの操作に失敗した場合の例外（status_code はHTTPのステータスコード）"""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+# セッションID -> ロック（同じセッションへのチャンクの書き込みと状態の更新を直列化する）
+_locks: Dict[str, threading.Lock] = {}
+_locks_lock = threading.Lock()
+
+def _lock(session_id: str) -> threading.Lock:
+    with _locks_lock:
+        return _locks.setdefault(session_id, threading.Lock())
+
+def _session_dir(session_id: str) -> Path:
+    # セッションIDはディレクトリ名に使うため、open_session が発行した形式（16進数）のみ受け付ける
+    if not session_id or any(c not in "0123456789abcdef" for c in session_id):
+        raise UploadSessionError(404, f"アップロードセッションが見つかりません: {session_id}")
+    return UPLOAD_SESSION_DIR / session_id
+
+def _load(session_id: str) -> dict:
+    state_file = _session_dir(session_id) / STATE_FILE
+    if not state_file.exists():
+        raise UploadSessionError(404, f"アップロードセッションが見つかりません: {session_id}")
+    with open(state_file, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def _save(state: dict) -> None:
+    session_dir = _session_dir(state["id"])
+    fd, tmp_path = tempfile.mkstemp(dir=session_dir, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp_path, session_dir / STATE_FILE)
+
+def _part_path(state: dict, entry: dict) -> Path:
+    return _session_dir(state["id"]) / f"{entry['index']}.part"
+
+def _safe_rel_path(path: str) -> str:
+    return path.replace("..", "_").lstrip("/\\").replace("\\", "/")
+
+def _file_entry(state: dict, path: str) -> dict:
+    entry = state["files"].get(_safe_rel_path(path))
+    if entry is None:
+        raise UploadSessionError(404, f"セッションに含まれないファイルです: {path}")
+    return entry
+
+def summarize(state: dict) -> dict:
+    """セッションとファイルごとの進捗"""
+    files = []
+    for rel_path, entry in state["files"].items():
+        files.append({
+            "path": rel_path,
+            "size": entry["size"],
+            "sha256": entry["sha256"],
+            "received": entry["received"],
+            "status": entry["status"],
+            "progress": round(entry["received"] / entry["size"], 4) if entry["size"] else 1.0,
+        })
+    total = sum(entry["size"] for entry in state["files"].values())
+    received = sum(entry["received"] for entry in state["files"].values())
+    return {
+        "session_id": state["id"],
+        "status": state["status"],
+        "total_bytes": total,
+        "received_bytes": received,
+        "files": files,
+    }
+
+def cleanup_expired(ttl: float = UPLOAD_SESSION_TTL) -> int:
+    """最終更新から ttl 秒以上経過したセッションを削除し、削除した件数を返す"""
+    if not UPLOAD_SESSION_DIR.exists():
+        return 0
+    removed = 0
+    expires_before = time.time() - ttl
+    for session_dir in UPLOAD_SESSION_DIR.iterdir():
+        state_file = session_dir / STATE_FILE
+        mtime = state_file.stat().st_mtime if state_file.exists() else session_dir.stat().st_mtime
+        if mtime < expires_before:
+            shutil.rmtree(session_dir, ignore_errors=True)
+            removed += 1
+    return removed
+
+def open_session(upload_root: str, manifest_name: str, files: List[dict]) -> dict:
+    """
+    アップロードセッションを開く。files は {"path", "size", "sha256"} のリスト。
+    既にブロブストアにあるファイルは skipped（送信不要）、それ以外は pending になる
+    """
+    cleanup_expired()
+    total = 0
+    state = {
+        "id": uuid.uuid4().hex,
+        "upload_root": str(upload_root),
+        "manifest": manifest_name,
+        "status": "open",
+        "created": time.time(),
+        "files": {},
+    }
+    for index, file in enumerate(files):
+        rel_path = _safe_rel_path(file["path"])
+        size = int(file["size"])
+        digest = file["sha256"].lower()
+        if size > UPLOAD_MAX_FILE_BYTES:
+            raise UploadSessionError(413, f"{rel_path}: ファイルサイズの上限（{UPLOAD_MAX_FILE_BYTES} bytes）を超えています")
+        if len(digest) != 64 or any(c not in "0123456789abcdef" for c in digest):
+            raise UploadSessionError(400, f"{rel_path}: SHA-256 の形式が不正です")
+        skipped = blob_store.has(digest)
+        if not skipped:
+            total += size
+        state["files"][rel_path] = {
+            "index": index,
+            "size": size,
+            "sha256": digest,
+            "received": size if skipped else 0,
+            "status": "skipped" if skipped else "pending",
+        }
+    if total > UPLOAD_MAX_REQUEST_BYTES:
+        raise UploadSessionError(413, f"アップロード合計サイズの上限（{UPLOAD_MAX_REQUEST_BYTES} bytes）を超えています")
+
+    _session_dir(state["id"]).mkdir(parents=True, exist_ok=True)
+    _save(state)
+    skipped_count = sum(1 for entry in state["files"].values() if entry["status"] == "skipped")
+    logger.info(f"アップロードセッションを開きました: {state['id']} ({len(files)}ファイル、送信不要 {skipped_count})")
+    return summarize(state)
+
+def status(session_id: str) -> dict:
+    return summarize(_load(session_id))
+
+def write_chunk(session_id: str, path: str, offset: int, data: bytes) -> dict:
+    """
+    ファイルの offset の位置にチャンクを書き込む。
+    offset は受信済みのバイト数以下である必要がある（受信済みの範囲の再送は上書きする）
+    """
+    with _lock(session_id):
+        state = _load(session_id)
+        if state["status"] != "open":
+            raise UploadSessionError(409, f"アップロードセッションは既に {state['status']} です")
+        entry = _file_entry(state, path)
+        if entry["status"] == "skipped":
+            return summarize(state)
+        if offset < 0 or offset > entry["received"]:
+            raise UploadSessionError(
+                409, f"{path}: オフセット {offset} は受信済みのサイズ {entry['received']} を超えています"
+            )
+        if offset + len(data) > entry["size"]:
+            raise UploadSessionError(413, f"{path}: 宣言されたサイズ {entry['size']} bytes を超えています")
+
+        part_path = _part_path(state, entry)
+        with open(part_path, "r+b" if part_path.exists() else "wb") as f:
+            f.seek(offset)
+            f.write(data)
+        entry["received"] = max(entry["received"], offset + len(data))
+        if entry["received"] == entry["size"]:
+            entry["status"] = "received"
+        _save(state)
+        return summarize(state)
+
+def finalize(session_id: str) -> dict:
+    """
+    全てのファイルを受信済みであれば、SHA-256を検証してブロブストアに登録し、アップロード先に配置する
+    """
+    with _lock(session_id):
+        state = _load(session_id)
+        if state["status"] != "open":
+            raise UploadSessionError(409, f"アップロードセッションは既に {state['status']} です")
+        incomplete = [
+            rel_path for rel_path, entry in state["files"].items()
+            if entry["received"] < entry["size"]
+        ]
+        if incomplete:
+            raise UploadSessionError(409, f"受信が完了していないファイルがあります: {', '.join(incomplete)}")
+
+        # 全てのファイルのSHA-256を先に検証する（途中で失敗しても .part ファイルと状態が食い違わないように）
+        corrupted = []
+        for rel_path, entry in state["files"].items():
+            if entry["status"] in ("skipped", "ingested"):
+                continue
+            part_path = _part_path(state, entry)
+            if entry["size"] == 0 and not part_path.exists():
+                part_path.touch()
+            sha256 = hashlib.sha256()
+            with open(part_path, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    sha256.update(chunk)
+            if sha256.hexdigest() != entry["sha256"]:
+                # 破損したファイルは最初から送り直してもらう
+                part_path.unlink()
+                entry["received"] = 0
+                entry["status"] = "pending"
+                corrupted.append(rel_path)
+        if corrupted:
+            _save(state)
+            raise UploadSessionError(422, f"SHA-256 が一致しません。再送してください: {', '.join(corrupted)}")
+
+        results = []
+        for rel_path, entry in state["files"].items():
+            if entry["status"] not in ("skipped", "ingested"):
+                entry["deduplicated"] = blob_store.ingest(str(_part_path(state, entry)), entry["sha256"])
+                # 登録済みであることを記録してから次に進む（再実行時に .part ファイルを探さない）
+                entry["status"] = "ingested"
+                _save(state)
+            deduplicated = entry.get("deduplicated", True)
+            blob_store.materialize(entry["sha256"], os.path.join(state["upload_root"], rel_path))
+            blob_store.record(state["manifest"], rel_path, entry["sha256"], entry["size"])
+            results.append({
+                "saved_path": rel_path,
+                "size": entry["size"],
+                "sha256": entry["sha256"],
+                "deduplicated": deduplicated,
+            })
+
+        shutil.rmtree(_session_dir(session_id), ignore_errors=True)
+        with _locks_lock:
+            _locks.pop(session_id, None)
+        logger.info(f"アップロードセッションを完了しました: {session_id} ({len(results)}ファイル)")
+        return {"session_id": session_id, "status": "finalized", "files": results}
+
+def abort(session_id: str) -> None:
+    """セッションと受信済みのデータを削除する"""
+    with _lock(session_id):
+        session_dir = _session_dir(session_id)
+        if not session_dir.exists():
+            raise UploadSessionError(404, f"アップロードセッションが見つかりません: {session_id}")
+        shutil.rmtree(session_dir, ignore_errors=True)
+    with _locks_lock:
+        _locks.pop(session_id, None)
@@ -0,0 +1,121 @@
+"""
+analyze_image_tool の回答キャッシュ
+
+(画像のダイジェスト, 正規化した質問文, モデル) をキーとして回答を保存し、同じ画像に対する同じ質問には
+LLMを呼ばずに回答する。プロセス内のLRU（1段目）とSQLiteのファイル（2段目、スレッド・プロセス間で共有）の
+2段構成で、どちらも VISION_CACHE_TTL を過ぎたエントリは使わない。
+"""
+
+import hashlib
+import logging
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from config import VISION_CACHE_MEMORY_ENTRIES, VISION_CACHE_PATH, VISION_CACHE_TTL
+
+logger = logging.getLogger(__name__)
+
+def image_digest(image_data: str) -> str:
+    """画像データ（base64文字列）のSHA-256"""
+    return hashlib.sha256(image_data.encode("ascii")).hexdigest()
+
+def normalize_query(query: str) -> str:
+    """全角/半角・大文字/小文字・空白の違いを吸収した質問文"""
+    query = unicodedata.normalize("NFKC", query).lower()
+    query = re.sub(r"\s+", " ", query).strip()
+    return query.rstrip("?？。.")
+
+def cache_key(image_data: str, query: str, model: str) -> str:
+    return hashlib.sha256(f"{image_digest(image_data)}\n{normalize_query(query)}\n{model}".encode("utf-8")).hexdigest()
+
+class VisionCache:
+    """メモリLRU + SQLite の2段キャッシュ"""
+
+    def __init__(self, db_path=VISION_CACHE_PATH, ttl: float = VISION_CACHE_TTL, memory_entries: int = VISION_CACHE_MEMORY_ENTRIES):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.memory_entries = memory_entries
+        self._memory: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0}
+
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            "key TEXT PRIMARY KEY, model TEXT NOT NULL, answer TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        # 期限切れのエントリは起動時にまとめて削除する
+        self._conn.execute("DELETE FROM answers WHERE created < ?", (time.time() - ttl,))
+        self._conn.commit()
+
+    def _remember(self, key: str, answer: str, created: float) -> None:
+        self._memory[key] = (answer, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, image_data: str, query: str, model: str) -> Optional[str]:
+        key = cache_key(image_data, query, model)
+        expires_before = time.time() - self.ttl
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and entry[1] >= expires_before:
+                self._memory.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                return entry[0]
+            row = self._conn.execute(
+                "SELECT answer, created FROM answers WHERE key = ? AND created >= ?", (key, expires_before)
+            ).fetchone()
+            if row is not None:
+                self._remember(key, row[0], row[1])
+                self.counters["disk_hits"] += 1
+                return row[0]
+            self.counters["misses"] += 1
+            return None
+
+    def put(self, image_data: str, query: str, model: str, answer: str) -> None:
+        key = cache_key(image_data, query, model)
+        created = time.time()
+        with self._lock:
+            self._remember(key, answer, created)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answers (key, model, answer, created) VALUES (?, ?, ?, ?)",
+                (key, model, answer, created),
+            )
+            self._conn.commit()
+            self.counters["stores"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            self._conn.execute("DELETE FROM answers")
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.counters["memory_hits"] + self.counters["disk_hits"] + self.counters["misses"]
+            hits = self.counters["memory_hits"] + self.counters["disk_hits"]
+            return {
+                **self.counters,
+                "hit_rate": round(hits / lookups, 3) if lookups else None,
+                "memory_entries": len(self._memory),
+                "disk_entries": self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0],
+            }
+
+_cache: Optional[VisionCache] = None
+_cache_lock = threading.Lock()
+
+def get_vision_cache() -> VisionCache:
+    """プロセス共通のVisionCacheを返す"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = VisionCache()
+        return _cache
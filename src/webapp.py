@@ -1,9 +1,30 @@
-from typing import List
-from fastapi import FastAPI, File, UploadFile
+from typing import Any, Dict, List, Literal, Optional
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 import os
 import asyncio
+import hashlib
+import json
+import httpx
 from pathlib import Path
+from pydantic import BaseModel
+from python_multipart.multipart import MultipartParser, parse_options_header
+from langgraph_sdk import get_client
+
+import blob_store
+import progress
+import thread_summary
+import upload_sessions
+from config import (
+    LANGGRAPH_API_URL,
+    PROGRESS_HEARTBEAT_SECONDS,
+    UPLOAD_CHUNK_BYTES,
+    UPLOAD_CONCURRENCY,
+    UPLOAD_MAX_FILE_BYTES,
+    UPLOAD_MAX_REQUEST_BYTES,
+    UPLOAD_SESSION_MAX_CHUNK_BYTES,
+)
 
 app = FastAPI()
 
@@ -12,46 +33,324 @@ app = FastAPI()
 PROJECT_ROOT = Path(__file__).resolve().parent.parent
 DATA_DIR = PROJECT_ROOT / "data"
 
-# Mount the 'data' directory to be served under '/files'
-# This will allow accessing files like /data/format/file.xlsx via /files/format/file.xlsx
-app.mount("/files", StaticFiles(directory=DATA_DIR), name="files")
-
 UPLOAD_ROOT = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "sample")
 UPLOAD_ROOT_FORMAT = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "format")
 
-def save_file(save_path: str, content: bytes):
-    os.makedirs(os.path.dirname(save_path), exist_ok=True)
-    with open(save_path, "wb") as f:
-        f.write(content)
+# Serve only the uploaded samples and the templates/outputs under '/files'
+# e.g. /data/format/file.xlsx via /files/format/file.xlsx
+# The rest of 'data' (checkpoints, caches, blob store, upload sessions) must not be public
+app.mount("/files/sample", StaticFiles(directory=UPLOAD_ROOT, check_dir=False), name="files-sample")
+app.mount("/files/format", StaticFiles(directory=UPLOAD_ROOT_FORMAT, check_dir=False), name="files-format")
 
-@app.post("/upload-folder/")
-async def upload_folder(files: List[UploadFile] = File(...)):
-    results = []
-    for file in files:
-        content = await file.read()
-        rel_path = file.filename.replace("..", "_").lstrip("/\\")
-        save_path = os.path.join(UPLOAD_ROOT, rel_path)
-        await asyncio.to_thread(save_file, save_path, content)
-        results.append({
-            "saved_path": os.path.relpath(save_path, UPLOAD_ROOT),
-            "size": len(content)
+class UploadQuota:
+    """1リクエスト分のアップロード容量の上限（ファイル単位・リクエスト合計）"""
+
+    def __init__(self, max_file_bytes: int = UPLOAD_MAX_FILE_BYTES, max_request_bytes: int = UPLOAD_MAX_REQUEST_BYTES):
+        self.max_file_bytes = max_file_bytes
+        self.max_request_bytes = max_request_bytes
+        self.total_bytes = 0
+
+    def consume(self, filename: str, file_bytes: int, chunk_bytes: int) -> None:
+        self.total_bytes += chunk_bytes
+        if file_bytes > self.max_file_bytes:
+            raise HTTPException(status_code=413, detail=f"{filename}: ファイルサイズの上限（{self.max_file_bytes} bytes）を超えています")
+        if self.total_bytes > self.max_request_bytes:
+            raise HTTPException(status_code=413, detail=f"アップロード合計サイズの上限（{self.max_request_bytes} bytes）を超えています")
+
+def safe_upload_path(upload_root: str, filename: str) -> str:
+    rel_path = filename.replace("..", "_").lstrip("/\\")
+    return os.path.join(upload_root, rel_path)
+
+# マルチパートの区切り・ヘッダーの分として、Content-Length がファイルの合計の上限をこれだけ超えることを許容する
+MULTIPART_OVERHEAD_BYTES = 1024 * 1024
+
+class MultipartUpload:
+    """
+    multipart/form-data の本文を受信しながら解析し、"files" のパートをブロブストアの一時ファイルに直接書き込む。
+    書き込みと同時にSHA-256を計算して容量の上限を確認し、パートの終わりでオブジェクトとして登録する
+    """
+
+    def __init__(self, boundary: bytes, quota: UploadQuota):
+        self.quota = quota
+        self.results: List[Dict[str, Any]] = []
+        self._header_field = b""
+        self._header_value = b""
+        self._headers: Dict[bytes, bytes] = {}
+        self._filename: Optional[str] = None
+        self._out = None
+        self._tmp_path: Optional[str] = None
+        self._digest = None
+        self._size = 0
+        self.parser = MultipartParser(boundary, {
+            "on_part_begin": self._on_part_begin,
+            "on_header_field": self._on_header_field,
+            "on_header_value": self._on_header_value,
+            "on_header_end": self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data": self._on_part_data,
+            "on_part_end": self._on_part_end,
         })
+
+    def _on_part_begin(self) -> None:
+        self._headers = {}
+
+    def _on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_field += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def _on_header_end(self) -> None:
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def _on_headers_finished(self) -> None:
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        name = options.get(b"name", b"").decode("utf-8", "replace")
+        filename = options.get(b"filename")
+        self._filename = None
+        if name != "files" or not filename:
+            return  # ファイル以外のフィールドは読み捨てる
+        self._filename = filename.decode("utf-8", "replace")
+        fd, self._tmp_path = blob_store.temp_file()
+        self._out = os.fdopen(fd, "wb")
+        self._digest = hashlib.sha256()
+        self._size = 0
+
+    def _on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._out is None:
+            return
+        chunk = data[start:end]
+        self._size += len(chunk)
+        self.quota.consume(self._filename, self._size, len(chunk))
+        self._digest.update(chunk)
+        self._out.write(chunk)
+
+    def _on_part_end(self) -> None:
+        if self._out is None:
+            return
+        self._out.close()
+        self._out = None
+        sha256 = self._digest.hexdigest()
+        deduplicated = blob_store.ingest(self._tmp_path, sha256)
+        self._tmp_path = None
+        self.results.append({"filename": self._filename, "size": self._size, "sha256": sha256, "deduplicated": deduplicated})
+
+    def abort(self) -> None:
+        """受信途中のファイルの一時ファイルを削除する"""
+        if self._out is not None:
+            self._out.close()
+            self._out = None
+        if self._tmp_path and os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+        self._tmp_path = None
+
+async def receive_uploads(request: Request) -> List[Dict[str, Any]]:
+    """
+    リクエスト本文を受信しながら "files" のパートをブロブストアに登録し、ファイルごとの結果を送信順に返す。
+    Content-Length が上限を超える場合は本文を受信せずに、受信中に上限を超えた場合はその時点で 413 を返す。
+    失敗したリクエストのファイルはアップロード先に配置せず、マニフェストにも記録しない
+    （登録済みのオブジェクトはブロブストアに残り、同じ内容のファイルの重複排除に使われる）
+    """
+    quota = UploadQuota()
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > quota.max_request_bytes + MULTIPART_OVERHEAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"アップロード合計サイズの上限（{quota.max_request_bytes} bytes）を超えています")
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or not options.get(b"boundary"):
+        raise HTTPException(status_code=400, detail="multipart/form-data で送信してください")
+
+    upload = MultipartUpload(options[b"boundary"], quota)
+    try:
+        # 受信したデータを UPLOAD_CHUNK_BYTES ずつまとめ、解析とディスクへの書き込みはイベントループの外で行う
+        buffer = bytearray()
+        async for chunk in request.stream():
+            buffer += chunk
+            if len(buffer) >= UPLOAD_CHUNK_BYTES:
+                await asyncio.to_thread(upload.parser.write, bytes(buffer))
+                buffer.clear()
+        if buffer:
+            await asyncio.to_thread(upload.parser.write, bytes(buffer))
+        await asyncio.to_thread(upload.parser.finalize)
+    except BaseException:
+        upload.abort()
+        raise
+    if not upload.results:
+        raise HTTPException(status_code=400, detail="アップロードするファイルがありません")
+    return upload.results
+
+async def save_uploads(request: Request, upload_root: str, manifest_name: str) -> List[Dict[str, Any]]:
+    """
+    リクエストの全てのファイルを受信してから、upload_root 配下の各パスにブロブストアのオブジェクトを
+    ハードリンクで配置し（最大 UPLOAD_CONCURRENCY 件ずつ並行）、マニフェストに記録する。
+    内容が同じファイルは1つだけ保存する
+    """
+    received = await receive_uploads(request)
+    slots = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+
+    async def place_one(saved: Dict[str, Any]) -> Dict[str, Any]:
+        save_path = safe_upload_path(upload_root, saved["filename"])
+        rel_path = os.path.relpath(save_path, upload_root)
+        async with slots:
+            await asyncio.to_thread(blob_store.materialize, saved["sha256"], save_path)
+            await asyncio.to_thread(blob_store.record, manifest_name, rel_path, saved["sha256"], saved["size"])
+        return {"saved_path": rel_path, "size": saved["size"], "sha256": saved["sha256"], "deduplicated": saved["deduplicated"]}
+
+    # 結果はアップロードされたファイルの順に返す
+    return await asyncio.gather(*(place_one(saved) for saved in received))
+
+@app.post("/upload-folder/")
+async def upload_folder(request: Request):
+    results = await save_uploads(request, UPLOAD_ROOT, "sample")
     return {"files": results}
 
 @app.post("/upload-format/")
-async def upload_format(files: List[UploadFile] = File(...)):
-    results = []
-    for file in files:
-        content = await file.read()
-        rel_path = file.filename.replace("..", "_").lstrip("/\\")
-        save_path = os.path.join(UPLOAD_ROOT_FORMAT, rel_path)
-        await asyncio.to_thread(save_file, save_path, content)
-        results.append({
-            "saved_path": os.path.relpath(save_path, UPLOAD_ROOT_FORMAT),
-            "size": len(content)
-        })
+async def upload_format(request: Request):
+    results = await save_uploads(request, UPLOAD_ROOT_FORMAT, "format")
     return {"files": results}
 
+class UploadSessionFile(BaseModel):
+    path: str
+    size: int
+    sha256: str
+
+class UploadSessionRequest(BaseModel):
+    target: Literal["sample", "format"] = "sample"
+    files: List[UploadSessionFile]
+
+UPLOAD_TARGETS = {"sample": (UPLOAD_ROOT, "sample"), "format": (UPLOAD_ROOT_FORMAT, "format")}
+
+async def run_session_operation(func, *args):
+    try:
+        return await asyncio.to_thread(func, *args)
+    except upload_sessions.UploadSessionError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+@app.post("/upload-sessions/")
+async def open_upload_session(request: UploadSessionRequest):
+    """分割アップロードのセッションを開く（サーバーに既にあるファイルは skipped になる）"""
+    upload_root, manifest_name = UPLOAD_TARGETS[request.target]
+    files = [file.model_dump() for file in request.files]
+    return await run_session_operation(upload_sessions.open_session, upload_root, manifest_name, files)
+
+@app.put("/upload-sessions/{session_id}/chunk")
+async def put_upload_chunk(session_id: str, path: str, offset: int, request: Request):
+    """ファイル path の offset の位置にリクエストボディ（チャンク）を書き込む"""
+    data = bytearray()
+    async for piece in request.stream():
+        data.extend(piece)
+        if len(data) > UPLOAD_SESSION_MAX_CHUNK_BYTES:
+            raise HTTPException(status_code=413, detail=f"チャンクサイズの上限（{UPLOAD_SESSION_MAX_CHUNK_BYTES} bytes）を超えています")
+    return await run_session_operation(upload_sessions.write_chunk, session_id, path, offset, bytes(data))
+
+@app.get("/upload-sessions/{session_id}")
+async def get_upload_session(session_id: str):
+    """ファイルごとの受信状況"""
+    return await run_session_operation(upload_sessions.status, session_id)
+
+@app.post("/upload-sessions/{session_id}/finalize")
+async def finalize_upload_session(session_id: str):
+    """受信したファイルを検証してアップロード先に配置する"""
+    return await run_session_operation(upload_sessions.finalize, session_id)
+
+@app.delete("/upload-sessions/{session_id}")
+async def abort_upload_session(session_id: str):
+    await run_session_operation(upload_sessions.abort, session_id)
+    return {"session_id": session_id, "status": "aborted"}
+
+def format_sse(message: Dict[str, Any]) -> str:
+    payload = json.dumps({**message["data"], "time": message["time"]}, ensure_ascii=False)
+    return f"id: {message['id']}\nevent: {message['event']}\ndata: {payload}\n\n"
+
+@app.get("/threads/{thread_id}/progress")
+async def stream_progress(thread_id: str, request: Request, last_event_id: int = Header(0)):
+    """
+    スレッドの進捗イベントをSSE（text/event-stream）で送り続ける。
+    Last-Event-ID ヘッダー（EventSource が再接続時に付ける）があれば、それより後のイベントから送る
+    """
+    async def events():
+        async for message in progress.subscribe(thread_id, last_event_id, PROGRESS_HEARTBEAT_SECONDS):
+            if await request.is_disconnected():
+                break
+            # イベントが無い間はコメント行を送って接続を維持する
+            yield format_sse(message) if message else ": keep-alive\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/threads/{thread_id}/progress/recent")
+async def recent_progress(thread_id: str, after: int = 0):
+    """バッファに残っている進捗イベント（SSEを使えないクライアント向け）"""
+    return {"events": progress.recent(thread_id, after)}
+
+_langgraph_client = None
+
+def langgraph_client():
+    """スレッドの状態を読むためのLangGraph APIクライアント（LANGGRAPH_API_URL 未設定時は同じプロセスのサーバー）"""
+    global _langgraph_client
+    if _langgraph_client is None:
+        _langgraph_client = get_client(url=LANGGRAPH_API_URL)
+    return _langgraph_client
+
+@app.get("/threads/{thread_id}/summary")
+async def thread_summary_view(
+    thread_id: str,
+    fields: str = None,
+    offset: int = 0,
+    limit: int = thread_summary.DEFAULT_PAGE_SIZE,
+    if_none_match: str = Header(None),
+):
+    """
+    スレッドの状態のうち fields（カンマ区切り。省略時は進捗表示用の項目）だけを返す。
+    messages は件数のみ、iter_data は offset から limit 件を返す。
+    If-None-Match が ETag と一致する場合は 304 を返す
+    """
+    try:
+        selected = thread_summary.parse_fields(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        thread = await langgraph_client().threads.get(thread_id)
+    except httpx.HTTPStatusError as e:
+        raise HTTPException(status_code=e.response.status_code, detail=f"スレッドを取得できません: {thread_id}")
+
+    body = thread_summary.encode(thread_summary.project(thread, selected, offset, limit))
+    etag = thread_summary.etag(body)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if thread_summary.etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+BLOB_MEDIA_TYPES = [
+    (b"\x89PNG", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF8", "image/gif"),
+    (b"%PDF", "application/pdf"),
+]
+
+def sniff_media_type(head: bytes) -> str:
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    for magic, media_type in BLOB_MEDIA_TYPES:
+        if head.startswith(magic):
+            return media_type
+    return "application/octet-stream"
+
+@app.get("/blobs/{digest}")
+async def get_blob(digest: str):
+    """ブロブストアのオブジェクト（メッセージ内の blob: 参照の画像など）を返す"""
+    if len(digest) != 64 or any(c not in "0123456789abcdef" for c in digest) or not blob_store.has(digest):
+        raise HTTPException(status_code=404, detail=f"オブジェクトが見つかりません: {digest}")
+    path = blob_store.object_path(digest)
+    with open(path, "rb") as f:
+        head = f.read(16)
+    # 内容が変わらないため長期間キャッシュできる
+    return FileResponse(path, media_type=sniff_media_type(head), headers={"Cache-Control": "public, max-age=31536000, immutable"})
+
 @app.get("/list-folders/")
 async def list_folders():
     def get_folders():
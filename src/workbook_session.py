@@ -0,0 +1,274 @@
+"""
+Excel入力欄特定ワークフロー用のワークブックセッション
+
+テンプレートを1回だけ解析してメモリ上に保持し、テキスト抽出・キャプチャ用コピーの保存・
+各反復のハイライトで同じワークブックを使い回す。ハイライトはコピーオンライトのオーバーレイとして
+適用し、変更したセルだけを記録して保存後に元に戻すため、ワークブック全体の複製や再解析は発生しない。
+"""
+
+import logging
+import os
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict
+from contextlib import contextmanager
+from copy import copy
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import openpyxl
+from openpyxl.cell.cell import MergedCell
+from openpyxl.utils.cell import coordinate_to_tuple, range_boundaries
+
+from config import TRACE_WORKBOOK_MEMORY
+
+logger = logging.getLogger(__name__)
+
+# Excelのシートの最大行数・最大列数
+MAX_ROW = 1048576
+MAX_COLUMN = 16384
+
+# 同時に保持するセッション数の上限（古いものから解放する）
+MAX_SESSIONS = 4
+
+# プロセス全体での解析・保存回数
+_totals = {"parse_count": 0, "save_count": 0}
+
+def _set_print_area(sheet) -> None:
+    """シートの使用範囲を印刷範囲に設定する（LibreOfficeが1ページに収めて出力するように fitToPage も有効化）"""
+    try:
+        dimension = sheet.calculate_dimension()
+        if dimension:
+            sheet.print_area = dimension
+            sheet.page_setup.fitToPage = True
+    except Exception as e_dim:
+        logger.warning(f"シート '{sheet.title}' の印刷範囲設定エラー: {e_dim}")
+
+def merged_anchor(sheet, row: int, col: int) -> Tuple[int, int]:
+    """結合範囲に含まれるセルの場合は範囲の左上のセルの (行, 列)、それ以外はそのまま返す"""
+    for merged_range in sheet.merged_cells.ranges:
+        if merged_range.min_row <= row <= merged_range.max_row and merged_range.min_col <= col <= merged_range.max_col:
+            return merged_range.min_row, merged_range.min_col
+    return row, col
+
+class WorkbookOverlay:
+    """
+    セッションのワークブックに対するコピーオンライトの変更セット。
+    初めて変更するセルの値・スタイルを記録し、discard() で元に戻す。
+    """
+
+    def __init__(self, session: "WorkbookSession"):
+        self.session = session
+        self.workbook = session.workbook
+        # (シート名, 行, 列) -> (元々セルが存在したか, 値, スタイル)
+        self._originals: Dict[Tuple[str, int, int], Tuple[bool, object, object]] = {}
+        self._print_settings = {
+            sheet.title: (sheet.print_area, sheet.page_setup.fitToPage) for sheet in self.workbook.worksheets
+        }
+
+    def cell(self, sheet_name: str, cell_addr: str):
+        """
+        変更用にセルを取得する（初回のみ元の状態を記録する）。
+        結合範囲の左上以外のセルは値を持てないため、結合範囲の左上のセルを返す
+        """
+        sheet = self.workbook[sheet_name]
+        row, col = coordinate_to_tuple(cell_addr)
+        if isinstance(sheet._cells.get((row, col)), MergedCell):
+            row, col = merged_anchor(sheet, row, col)
+        key = (sheet_name, row, col)
+        if key not in self._originals:
+            existed = (row, col) in sheet._cells
+            original = sheet._cells.get((row, col))
+            self._originals[key] = (
+                existed,
+                original.value if original is not None else None,
+                copy(original._style) if original is not None else None,
+            )
+        return sheet.cell(row=row, column=col)
+
+    def save(self, path: str) -> None:
+        """印刷範囲を変更後の使用範囲に合わせ、1回の保存で書き出す"""
+        for sheet in self.workbook.worksheets:
+            _set_print_area(sheet)
+        self.session.save(path)
+
+    def discard(self) -> None:
+        """
+        記録した元の状態に戻す（新たに作成したセルは削除して使用範囲も元に戻す）。
+        一部のセルの復元に失敗しても、残りのセルは全て復元する
+        """
+        for (sheet_name, row, col), (existed, value, style) in self._originals.items():
+            try:
+                sheet = self.workbook[sheet_name]
+                if not existed:
+                    sheet._cells.pop((row, col), None)
+                    continue
+                cell = sheet._cells[(row, col)]
+                cell._style = style
+                if not isinstance(cell, MergedCell):
+                    cell.value = value
+            except Exception as e:
+                logger.error(f"セル {sheet_name}!({row}, {col}) を元に戻せませんでした: {e}")
+        for sheet in self.workbook.worksheets:
+            print_area, fit_to_page = self._print_settings[sheet.title]
+            sheet.print_area = print_area
+            sheet.page_setup.fitToPage = fit_to_page
+        self._originals.clear()
+
+    def __enter__(self) -> "WorkbookOverlay":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        try:
+            self.discard()
+        finally:
+            self.session._lock.release()
+
+class WorkbookSession:
+    """テンプレートを1回だけ解析して保持するセッション"""
+
+    def __init__(self, excel_file: str):
+        self.excel_file = excel_file
+        self.save_count = 0
+        self.key: Optional[Tuple[str, int, int]] = None
+        # session_scope() で使用中の実行の数（0 になったら解放する）
+        self.users = 0
+        self._lock = threading.Lock()
+
+        tracing = TRACE_WORKBOOK_MEMORY and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        started = time.perf_counter()
+        try:
+            self.workbook = openpyxl.load_workbook(excel_file)
+            self.peak_parse_bytes = tracemalloc.get_traced_memory()[1] if tracing else None
+        finally:
+            if tracing:
+                tracemalloc.stop()
+        self.parse_seconds = time.perf_counter() - started
+        _totals["parse_count"] += 1
+        logger.info(f"ワークブックを解析しました: {excel_file} ({self.parse_seconds:.3f}秒)")
+
+        self.sheet_names = list(self.workbook.sheetnames)
+        # 元の使用範囲 (min_col, min_row, max_col, max_row)。入力欄がどのシートのものかの判定に使う
+        self.sheet_bounds = {
+            sheet.title: range_boundaries(sheet.calculate_dimension()) for sheet in self.workbook.worksheets
+        }
+
+        # キャプチャ用の印刷範囲は元の使用範囲で一度だけ設定する（テキスト抽出には影響しない）
+        for sheet in self.workbook.worksheets:
+            _set_print_area(sheet)
+
+    def locate_field(self, cell_id: str) -> List[Tuple[str, str]]:
+        """
+        入力欄のセル番号を (シート名, セル番地) のリストに解決する。
+        "シート名!A1" 形式の場合はそのシート、シート名が無い場合は元の使用範囲にそのセルを含むシート
+        （どのシートにも含まれない場合は先頭シート）を返す。不正なセル番号の場合は空リストを返す
+        """
+        sheet_name, _, cell_addr = cell_id.rpartition("!")
+        sheet_name = sheet_name.strip("'")
+        cell_addr = cell_addr.replace("$", "").strip().upper()
+        try:
+            row, col = coordinate_to_tuple(cell_addr)
+        except ValueError:
+            return []
+        if not (1 <= row <= MAX_ROW and 1 <= col <= MAX_COLUMN):
+            return []
+        if sheet_name:
+            return [(sheet_name, cell_addr)] if sheet_name in self.sheet_bounds else []
+        sheets = [
+            title for title, (min_col, min_row, max_col, max_row) in self.sheet_bounds.items()
+            if min_row <= row <= max_row and min_col <= col <= max_col
+        ]
+        return [(title, cell_addr) for title in (sheets or self.sheet_names[:1])]
+
+    def clone(self) -> WorkbookOverlay:
+        """
+        ハイライト用のコピーオンライトのオーバーレイを返す。with 文で使用し、終了時に変更が破棄される。
+        オーバーレイの使用中は同じセッションの他のオーバーレイは待機する。
+        """
+        self._lock.acquire()
+        return WorkbookOverlay(self)
+
+    @contextmanager
+    def read(self) -> Iterator[openpyxl.Workbook]:
+        """
+        オーバーレイの変更が適用されていないワークブックを読み取り用に返す。with 文で使用し、
+        使用中は同じセッションのオーバーレイ（他の実行のハイライト）は待機する
+        """
+        with self._lock:
+            yield self.workbook
+
+    def save(self, path: str) -> None:
+        self.workbook.save(path)
+        self.save_count += 1
+        _totals["save_count"] += 1
+
+    def stats(self) -> dict:
+        return {
+            "excel_file": self.excel_file,
+            "parse_seconds": round(self.parse_seconds, 3),
+            "peak_parse_bytes": self.peak_parse_bytes,
+            "save_count": self.save_count,
+            "total_parse_count": _totals["parse_count"],
+            "total_save_count": _totals["save_count"],
+        }
+
+_sessions: "OrderedDict[Tuple[str, int, int], WorkbookSession]" = OrderedDict()
+_sessions_lock = threading.Lock()
+
+def _session_key(excel_file: str) -> Tuple[str, int, int]:
+    stat = os.stat(excel_file)
+    return (os.path.abspath(excel_file), stat.st_mtime_ns, stat.st_size)
+
+def _get_session_locked(excel_file: str) -> WorkbookSession:
+    # _sessions_lock を取得した状態で呼び出す
+    key = _session_key(excel_file)
+    session = _sessions.get(key)
+    if session is None:
+        session = WorkbookSession(excel_file)
+        session.key = key
+        _sessions[key] = session
+        # 使用中でないセッションを古いものから解放する
+        for idle_key in [k for k, s in _sessions.items() if s.users == 0 and k != key]:
+            if len(_sessions) <= MAX_SESSIONS:
+                break
+            del _sessions[idle_key]
+    _sessions.move_to_end(key)
+    return session
+
+def get_session(excel_file: str) -> WorkbookSession:
+    """
+    ファイルに対応するセッションを返す。ファイルが更新されていれば再解析する
+    """
+    with _sessions_lock:
+        return _get_session_locked(excel_file)
+
+@contextmanager
+def session_scope(excel_file: str) -> Iterator[WorkbookSession]:
+    """
+    ワークフローの実行中セッションを保持する。同じテンプレートを使う実行が全て終了したとき
+    （失敗した場合も含む）にセッションを解放し、統計情報をログに出力する
+    """
+    with _sessions_lock:
+        session = _get_session_locked(excel_file)
+        session.users += 1
+    try:
+        yield session
+    finally:
+        with _sessions_lock:
+            session.users -= 1
+            released = session.users == 0
+            if released and _sessions.get(session.key) is session:
+                del _sessions[session.key]
+        if released:
+            logger.info(f"ワークブックセッションを解放しました: {session.stats()}")
+
+def close_session(excel_file: str) -> Optional[dict]:
+    """
+    セッションを解放し、その統計情報を返す
+    """
+    key = _session_key(excel_file)
+    with _sessions_lock:
+        session = _sessions.pop(key, None)
+    return session.stats() if session else None